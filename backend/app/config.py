@@ -11,6 +11,27 @@ class Settings:
     
     # Infrastructure
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+    # Job state: redis (shared by all API workers) or memory (single process, tests)
+    JOB_STORE: str = os.getenv("JOB_STORE", "redis")
+    # Jobs expire this long after their last update
+    JOB_TTL_SECONDS: int = int(os.getenv("JOB_TTL_SECONDS", str(7 * 24 * 3600)))
+    JOB_MAX_LOGS: int = int(os.getenv("JOB_MAX_LOGS", "500"))
+    # How often each /jobs/{id}/events stream checks its job for changes
+    JOB_STREAM_INTERVAL: float = float(os.getenv("JOB_STREAM_INTERVAL", "0.5"))
+    # Pipeline stage results (script, TTS, visuals...) are reused for this long
+    # by retries and, for TTS and montage, by jobs with the same inputs
+    STAGE_CACHE_TTL_SECONDS: int = int(os.getenv("STAGE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+    # Independent pipeline stages (keywords, TTS + avatar, visuals) run concurrently
+    PIPELINE_MAX_PARALLEL_STAGES: int = int(os.getenv("PIPELINE_MAX_PARALLEL_STAGES", "4"))
+
+    # Where jobs run: celery (light/heavy queues, see workers/celery_worker.py)
+    # or background (FastAPI BackgroundTasks inside the API process)
+    JOB_EXECUTION: str = os.getenv("JOB_EXECUTION", "background")
+    CELERY_LIGHT_QUEUE: str = os.getenv("CELERY_LIGHT_QUEUE", "light")
+    CELERY_HEAVY_QUEUE: str = os.getenv("CELERY_HEAVY_QUEUE", "heavy")
+    # Worker processes per Celery worker (0: one per CPU); -c on the command line overrides it
+    CELERY_CONCURRENCY: int = int(os.getenv("CELERY_CONCURRENCY", "0"))
     
     # API Keys
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
@@ -28,4 +49,14 @@ class Settings:
     R2_SECRET_ACCESS_KEY: str = os.getenv("R2_SECRET_ACCESS_KEY", "")
     R2_BUCKET_NAME: str = os.getenv("R2_BUCKET_NAME", "multiforge-assets")
 
+    # Wav2Lip runtime: torch, torchscript or onnx (graphs from Wav2Lip/export.py)
+    WAV2LIP_BACKEND: str = os.getenv("WAV2LIP_BACKEND", "torch")
+    WAV2LIP_EXPORT_DIR: str = os.getenv("WAV2LIP_EXPORT_DIR", "")
+    # fp32, bf16 or int8 (calibrated with Wav2Lip/quantize.py, CPU only)
+    WAV2LIP_PRECISION: str = os.getenv("WAV2LIP_PRECISION", "fp32")
+    # Tune the Wav2Lip / face detection batch sizes for the host (cached)
+    WAV2LIP_AUTOTUNE: bool = os.getenv("WAV2LIP_AUTOTUNE", "False").lower() == "true"
+    # Load Wav2Lip when a Celery worker process starts (workers of the heavy queue)
+    WAV2LIP_WARMUP: bool = os.getenv("WAV2LIP_WARMUP", "False").lower() == "true"
+
 settings = Settings()
\ No newline at end of file
@@ -1,10 +1,15 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Optional, List
+import asyncio
+import json
 import uuid
 from app.config import settings
+from app.services.job_store import get_job_store
 # Lazy import: run_pipeline will be imported inside functions to avoid blocking startup
 
 app = FastAPI(title=settings.PROJECT_NAME)
@@ -21,8 +26,8 @@ app.add_middleware(
 # Static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# In-memory job storage (simple, no Redis needed)
-jobs_db: Dict[str, dict] = {}
+# Job state, shared by all the API workers (Redis, or memory as a fallback)
+job_store = get_job_store()
 
 # --- Models ---
 class VideoRequest(BaseModel):
@@ -56,57 +61,163 @@ def read_root():
 def run_job_in_background(job_id: str, request_data: dict):
     """Execute le pipeline et met à jour le job"""
     def update_progress(progress, step, logs):
-        jobs_db[job_id].update({
-            "progress": progress,
-            "current_step": step,
-            "logs": logs,
-            "status": "PROCESSING"
-        })
+        job_store.update(
+            job_id,
+            progress=progress,
+            current_step=step,
+            logs=logs,
+            status="PROCESSING"
+        )
     
     try:
         # Lazy import to avoid blocking server startup
         from app.workers.job_pipeline import run_pipeline
         
-        result = run_pipeline(request_data, update_progress)
-        jobs_db[job_id].update({
-            "status": "COMPLETED",
-            "progress": 100,
-            "current_step": "Terminé",
-            "result_video_url": result.get("result_video_url"),
-            "script_text": result.get("script_text"),
-            "logs": result.get("logs", [])
-        })
+        result = run_pipeline(request_data, update_progress, job_id)
+        job_store.update(
+            job_id,
+            status="COMPLETED",
+            progress=100,
+            current_step="Terminé",
+            result_video_url=result.get("result_video_url"),
+            script_text=result.get("script_text"),
+            logs=result.get("logs", [])
+        )
     except Exception as e:
-        jobs_db[job_id].update({
-            "status": "FAILED",
-            "logs": [f"Erreur: {str(e)}"]
-        })
+        job_store.update(
+            job_id,
+            status="FAILED",
+            logs=[f"Erreur: {str(e)}"]
+        )
 
+# Les routes qui touchent Redis / Celery sont synchrones : FastAPI les exécute
+# dans son threadpool au lieu de bloquer la boucle d'événements.
 @app.post("/create-video", response_model=JobResponse)
-async def create_video(request: VideoRequest, background_tasks: BackgroundTasks):
+def create_video(request: VideoRequest, background_tasks: BackgroundTasks):
     """Lance le pipeline en arrière-plan"""
     job_id = str(uuid.uuid4())
     
     # Initialiser le job
-    jobs_db[job_id] = {
+    job_store.create(job_id, {
         "job_id": job_id,
         "status": "PENDING",
         "progress": 0,
         "current_step": "En attente...",
         "result_video_url": None,
         "script_text": None,
-        "logs": []
-    }
+        "logs": [],
+        "execution": settings.JOB_EXECUTION,
+        "request": request.dict(),
+        "attempt": 1
+    })
     
-    # Lancer en arrière-plan
-    background_tasks.add_task(run_job_in_background, job_id, request.dict())
+    start_job(job_id, request.dict(), 1, background_tasks)
+    
+    return {"job_id": job_id, "status": "PENDING"}
+
+def start_job(job_id: str, request_data: dict, attempt: int, background_tasks: BackgroundTasks):
+    """Lance le pipeline en arrière-plan (workers Celery ou BackgroundTasks)"""
+    if settings.JOB_EXECUTION == "celery":
+        from app.workers.celery_worker import enqueue_video_job
+        enqueue_video_job(job_id, request_data, attempt)
+    else:
+        background_tasks.add_task(run_job_in_background, job_id, request_data)
+
+@app.post("/jobs/{job_id}/retry", response_model=JobResponse)
+def retry_job(job_id: str, background_tasks: BackgroundTasks):
+    """
+    Relance un job échoué : les étapes déjà réussies sont reprises du cache,
+    le pipeline repart de celle qui a échoué.
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.get("execution") == "celery":
+        from app.workers.celery_worker import get_job_state
+        job.update(get_job_state(job_id, job.get("attempt", 1)))
+    if job["status"] != "FAILED" or "request" not in job:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}, only failed jobs can be retried")
+    
+    attempt = job.get("attempt", 1) + 1
+    job_store.update(
+        job_id,
+        status="PENDING",
+        progress=0,
+        current_step="Reprise...",
+        logs=[],
+        execution=settings.JOB_EXECUTION,
+        attempt=attempt
+    )
+    start_job(job_id, job["request"], attempt, background_tasks)
     
     return {"job_id": job_id, "status": "PENDING"}
 
 @app.get("/jobs/{job_id}", response_model=JobStatus)
-async def get_job_status(job_id: str):
+def get_job_status(job_id: str):
     """Récupère l'état d'un job"""
-    if job_id not in jobs_db:
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if job.get("execution") == "celery":
+        from app.workers.celery_worker import get_job_state
+        job.update(get_job_state(job_id, job.get("attempt", 1)))
+    
+    return job
+
+# Champs envoyés par le flux de progression quand ils changent
+STREAM_FIELDS = ["status", "progress", "current_step", "result_video_url", "script_text", "log_base"]
+STREAM_KEEPALIVE_SECONDS = 15
+
+async def job_events(job_id: str, log_cursor: int, request: Request):
+    """
+    Événements SSE d'un job : on ne relit le job que quand sa version change
+    (mise à jour par le progress_callback), et on n'envoie que les champs
+    modifiés et les lignes de logs après le curseur.
+    """
+    version, sent, idle = None, {}, 0.
+    while not await request.is_disconnected():
+        current = await run_in_threadpool(job_store.get_version, job_id)
+        if current is None:
+            return
+        if current != version:
+            version = current
+            job = await run_in_threadpool(job_store.get_changes, job_id, log_cursor)
+            if job is None:
+                return
+            event = {k: job[k] for k in STREAM_FIELDS if k in job and (k not in sent or sent[k] != job[k])}
+            sent.update(event)
+            if job["logs"]:
+                event["logs"] = job["logs"]
+            log_cursor = job.get("log_count", log_cursor)
+            if event:
+                idle = 0.
+                yield f"id: {log_cursor}\nevent: progress\ndata: {json.dumps(event)}\n\n"
+            if job.get("status") in ("COMPLETED", "FAILED"):
+                yield "event: end\ndata: {}\n\n"
+                return
+        elif idle >= STREAM_KEEPALIVE_SECONDS:
+            idle = 0.
+            yield ": keepalive\n\n"
+        await asyncio.sleep(settings.JOB_STREAM_INTERVAL)
+        idle += settings.JOB_STREAM_INTERVAL
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_status(job_id: str, request: Request):
+    """
+    Progression d'un job en Server-Sent Events, à la place du polling de
+    /jobs/{job_id} : le premier événement donne l'état courant, les suivants
+    seulement ce qui a changé et les nouvelles lignes de logs. L'id d'un
+    événement est le curseur de logs, que le navigateur renvoie (Last-Event-ID)
+    en se reconnectant.
+    """
+    if await run_in_threadpool(job_store.get_version, job_id) is None:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    return jobs_db[job_id]
\ No newline at end of file
+    last_event_id = request.headers.get("last-event-id", "")
+    log_cursor = int(last_event_id) if last_event_id.isdigit() else 0
+    return StreamingResponse(
+        job_events(job_id, log_cursor, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,6 +1,8 @@
 import librosa
 import librosa.filters
 import numpy as np
+import hashlib, os, threading
+from collections import OrderedDict
 # import tensorflow as tf
 from scipy import signal
 from scipy.io import wavfile
@@ -50,6 +52,90 @@ def melspectrogram(wav):
         return _normalize(S)
     return S
 
+class MelCache:
+    """Mel-spectrograms of wav files, keyed by a hash of the file content and
+    of the hparams that affect the mel, so identical audio hits the cache
+    whatever file it is in.
+
+    Keeps the last ``max_items`` mels in memory, and the hashes of the last
+    ``max_paths`` files by path, size and mtime so that unchanged files are
+    not hashed again. Both are bounded, and safe to share between threads.
+    With ``disk=True`` the mels are also stored as ``<name>.mel-<key>.npy``
+    next to the wav file and reused by later runs and other processes. The
+    returned arrays are read-only.
+    """
+    def __init__(self, max_items=128, max_paths=4096):
+        self.max_items = max_items
+        self.max_paths = max_paths
+        self._mels = OrderedDict()
+        self._digests = OrderedDict()  # path -> (size, mtime, inode, key)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, disk=False):
+        key = self.key(path)
+        with self._lock:
+            mel = self._mels.get(key)
+            if mel is not None:
+                self._mels.move_to_end(key)
+                self.hits += 1
+                return mel
+            self.misses += 1
+
+        # computed outside the lock: two threads may both compute the same mel
+        npy_path = '{}.mel-{}.npy'.format(os.path.splitext(path)[0], key[:16])
+        if disk and os.path.isfile(npy_path):
+            mel = np.load(npy_path)
+        else:
+            mel = melspectrogram(load_wav(path, hp.sample_rate))
+            if disk:
+                tmp_path = '{}.{}.tmp.npy'.format(npy_path[:-4], os.getpid())
+                np.save(tmp_path, mel)
+                os.replace(tmp_path, npy_path)
+
+        mel.setflags(write=False)
+        with self._lock:
+            self._mels[key] = mel
+            self._mels.move_to_end(key)
+            while len(self._mels) > self.max_items:
+                self._mels.popitem(last=False)
+        return mel
+
+    def key(self, path):
+        st = os.stat(path)
+        stamp = (st.st_size, st.st_mtime_ns, st.st_ino)
+        with self._lock:
+            memo = self._digests.get(path)
+            if memo is not None and memo[:3] == stamp:
+                self._digests.move_to_end(path)
+                return memo[3]
+
+        h = hashlib.sha1(_mel_params_signature())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        key = h.hexdigest()
+        with self._lock:
+            self._digests[path] = stamp + (key,)
+            self._digests.move_to_end(path)
+            while len(self._digests) > self.max_paths:
+                self._digests.popitem(last=False)
+        return key
+
+def _mel_params_signature():
+    names = ['sample_rate', 'num_mels', 'n_fft', 'hop_size', 'win_size', 'frame_shift_ms', 'use_lws',
+             'preemphasize', 'preemphasis', 'fmin', 'fmax', 'min_level_db', 'ref_level_db',
+             'signal_normalization', 'allow_clipping_in_normalization', 'symmetric_mels', 'max_abs_value']
+    return repr([(name, getattr(hp, name)) for name in names]).encode()
+
+mel_cache = MelCache()
+
+def load_mel(path, disk=False):
+    """Mel-spectrogram of the wav file at ``path`` (resampled to
+    hp.sample_rate), served from the shared ``mel_cache``."""
+    return mel_cache.get(path, disk=disk)
+
 def _lws_processor():
     import lws
     return lws.lws(hp.n_fft, get_hop_size(), fftsize=hp.win_size, mode="speech")
@@ -97,7 +183,7 @@ def _linear_to_mel(spectogram):
 
 def _build_mel_basis():
     assert hp.fmax <= hp.sample_rate // 2
-    return librosa.filters.mel(hp.sample_rate, hp.n_fft, n_mels=hp.num_mels,
+    return librosa.filters.mel(sr=hp.sample_rate, n_fft=hp.n_fft, n_mels=hp.num_mels,
                                fmin=hp.fmin, fmax=hp.fmax)
 
 def _amp_to_db(x):
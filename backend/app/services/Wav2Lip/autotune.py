@@ -0,0 +1,172 @@
+"""Batch sizes for Wav2Lip and the face detector (`--autotune` in inference.py).
+
+BatchSizeTuner times a few batch sizes and keeps the fastest one, skipping
+sizes whose activations could not fit in the free memory (RAM, or GPU memory
+on CUDA). Wav2Lip is timed on synthetic inputs, the detector on a real frame
+of the request, so that it goes through the same downscale as the frames it
+will see. Results are cached in a json file per host (device, torch
+threads), model settings and, for the detector, detection resolution, so the
+probing only happens once.
+
+BatchLimit runs a batch in smaller chunks when it hits an out-of-memory
+error, and remembers the smaller size for the following batches.
+"""
+import os, json, time
+import numpy as np
+import torch
+
+def default_cache_path():
+	return os.path.join(os.path.expanduser('~'), '.cache', 'wav2lip', 'batch_sizes.json')
+
+def is_out_of_memory(e):
+	if isinstance(e, MemoryError):
+		return True
+	message = str(e).lower()
+	return any(s in message for s in ['out of memory', "can't allocate memory", 'failed to allocate memory'])
+
+def free_memory(device):
+	"""Bytes that can be allocated on `device` without swapping, None if unknown."""
+	if device == 'cuda':
+		return torch.cuda.mem_get_info()[0]
+	try:
+		with open('/proc/meminfo') as f:
+			for line in f:
+				if line.startswith('MemAvailable:'):
+					return int(line.split()[1]) * 1024
+	except IOError:
+		pass
+	try:
+		return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+	except (ValueError, OSError, AttributeError):
+		return None
+
+def activation_bytes(module, *inputs):
+	"""Bytes of all the layer outputs of one forward pass, an upper bound of
+	the activation memory (several times the actual peak, as most outputs
+	are freed before the next layers run). None if `module` is not an
+	nn.Module (exported graphs)."""
+	if not isinstance(module, torch.nn.Module):
+		return None
+
+	total = [0]
+	def count(module, inputs, output):
+		for o in (output if isinstance(output, (tuple, list)) else [output]):
+			if torch.is_tensor(o):
+				total[0] += o.numel() * o.element_size()
+
+	hooks = [m.register_forward_hook(count) for m in module.modules() if len(list(m.children())) == 0]
+	try:
+		with torch.no_grad():
+			module(*inputs)
+	finally:
+		for hook in hooks:
+			hook.remove()
+	return total[0]
+
+class BatchLimit(object):
+	"""Calls `fn` on slices of at most `size` items of its batched arguments
+	and concatenates the results, halving `size` on out-of-memory errors."""
+	def __init__(self, name, size=None):
+		self.name = name
+		self.size = size
+
+	def __call__(self, fn, *batches):
+		n = len(batches[0])
+		size = min(self.size or n, n)
+		while 1:
+			try:
+				outputs = [fn(*[b[i:i + size] for b in batches]) for i in range(0, n, size)]
+				return outputs[0] if len(outputs) == 1 else torch.cat(outputs)
+			except Exception as e:
+				if not is_out_of_memory(e) or size == 1:
+					raise
+				size = self.size = size // 2
+				if torch.cuda.is_available():
+					torch.cuda.empty_cache()
+				print('Recovering from OOM error; New {} batch size: {}'.format(self.name, size))
+
+class BatchSizeTuner(object):
+	def __init__(self, device, cache_path=None, verbose=True):
+		self.device = device
+		self.cache_path = cache_path or default_cache_path()
+		self.verbose = verbose
+		self.cache = {}
+		if os.path.isfile(self.cache_path):
+			try:
+				with open(self.cache_path) as f:
+					self.cache = json.load(f)
+			except ValueError:
+				pass
+
+	def host(self):
+		if self.device == 'cuda':
+			return 'cuda:' + torch.cuda.get_device_name()
+		return 'cpu:{}threads'.format(torch.get_num_threads())
+
+	def save(self):
+		os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+		tmp_path = self.cache_path + '.tmp'
+		with open(tmp_path, 'w') as f:
+			json.dump(self.cache, f, indent=1, sort_keys=True)
+		os.replace(tmp_path, self.cache_path)
+
+	def cached(self, key, probe):
+		key = '|'.join([self.host()] + [str(k) for k in key])
+		if key not in self.cache:
+			start = time.time()
+			self.cache[key] = probe()
+			self.save()
+			if self.verbose:
+				print('Tuned {} in {:.1f}s: batch size {}'.format(key, time.time() - start, self.cache[key]))
+		return self.cache[key]
+
+	def fastest(self, run, candidates, bytes_per_item):
+		"""Largest-throughput candidate; sizes stop growing once throughput
+		stops improving, memory runs out or the estimate says it would."""
+		free = free_memory(self.device)
+		best, best_rate = candidates[0], 0.
+		run(candidates[0]) # warm-up
+		for size in candidates:
+			if free is not None and bytes_per_item and size * bytes_per_item > free:
+				break
+			try:
+				start = time.time()
+				run(size)
+				rate = size / max(time.time() - start, 1e-9)
+			except Exception as e:
+				if not is_out_of_memory(e):
+					raise
+				break
+			if rate < best_rate * 1.05:
+				break
+			best, best_rate = size, rate
+		return best
+
+	def wav2lip_batch_size(self, model, args, run):
+		"""`run(size)` runs the model on a synthetic batch of `size` samples."""
+		candidates = [16, 32, 64, 128, 256, 512] if self.device == 'cuda' else [8, 16, 32, 64, 128, 256]
+
+		def probe():
+			per_item = activation_bytes(model, torch.zeros(1, 1, 80, 16, device=self.device),
+										torch.zeros(1, 6, args.img_size, args.img_size, device=self.device))
+			return self.fastest(run, candidates, per_item)
+
+		key = ['wav2lip', args.backend, args.precision, 'channels_last' if args.channels_last else 'nchw']
+		return self.cached(key, probe)
+
+	def face_det_batch_size(self, detector, frame, args):
+		"""Timed on copies of `frame`; the detector runs at the resolution
+		its det_face_res downscale picks for that frame."""
+		h, w = frame.shape[:2]
+		factor = detector.detection_factor(frame) if getattr(detector, 'detection_face_res', None) else 1
+		det_h, det_w = h // factor, w // factor
+		candidates = [1, 2, 4, 8, 16]
+
+		def probe():
+			frames = np.repeat(frame[None], candidates[-1], axis=0)
+			net = getattr(getattr(detector, 'face_detector', None), 'face_detector', None)
+			per_item = activation_bytes(net, torch.zeros(1, 3, det_h, det_w, device=self.device))
+			return self.fastest(lambda size: detector.get_detections_for_batch(frames[:size]), candidates, per_item)
+
+		key = ['s3fd', args.backend, '{}x{}'.format(det_w, det_h)]
+		return self.cached(key, probe)
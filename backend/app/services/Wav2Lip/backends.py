@@ -0,0 +1,81 @@
+"""Runtime backends of the inference path.
+
+'torch' runs the eager modules from models/ and face_detection/. 'torchscript'
+and 'onnx' run the graphs written by export.py, the latter on ONNX Runtime's
+CPU execution provider with all graph optimizations enabled. The wrappers
+take and return torch tensors so that the rest of inference.py does not
+depend on the backend.
+"""
+import os
+import numpy as np
+import torch
+
+BACKENDS = ['torch', 'torchscript', 'onnx']
+WAV2LIP_GRAPHS = ['wav2lip', 'wav2lip_encode_face', 'wav2lip_forward_cached']
+S3FD_GRAPH = 's3fd'
+ONNX_THREADS = int(os.environ.get('ONNX_THREADS', 0)) # 0: let ONNX Runtime decide
+
+def default_export_dir(checkpoint_path):
+	return os.path.join(os.path.dirname(os.path.abspath(checkpoint_path)), 'exported')
+
+class OnnxGraph(object):
+	"""Callable ONNX Runtime session: torch tensors in, list of torch tensors out."""
+	def __init__(self, path, threads=ONNX_THREADS):
+		import onnxruntime as ort
+
+		options = ort.SessionOptions()
+		options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+		if threads:
+			options.intra_op_num_threads = threads
+		self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+		self.input_names = [i.name for i in self.session.get_inputs()]
+
+	def __call__(self, *tensors):
+		feeds = {name: np.ascontiguousarray(t.detach().float().cpu().numpy())
+					for name, t in zip(self.input_names, tensors)}
+		return [torch.from_numpy(o) for o in self.session.run(None, feeds)]
+
+class ScriptGraph(object):
+	"""Callable TorchScript module with the same calling convention as OnnxGraph."""
+	def __init__(self, path, device):
+		self.module = torch.jit.load(path, map_location=device).eval()
+
+	def __call__(self, *tensors):
+		with torch.no_grad():
+			out = self.module(*tensors)
+		return list(out) if isinstance(out, (tuple, list)) else [out]
+
+class ExportedWav2Lip(object):
+	"""Stands in for models.Wav2Lip (forward on 4D inputs, encode_face and
+	forward_cached) with exported graphs."""
+	def __init__(self, forward, encode_face, forward_cached):
+		self.graphs = (forward, encode_face, forward_cached)
+
+	def __call__(self, audio_sequences, face_sequences):
+		return self.graphs[0](audio_sequences, face_sequences)[0]
+
+	def encode_face(self, face_sequences):
+		return self.graphs[1](face_sequences)
+
+	def forward_cached(self, audio_sequences, feats):
+		return self.graphs[2](audio_sequences, *feats)[0]
+
+	def to(self, *args, **kwargs):
+		return self
+
+	def eval(self):
+		return self
+
+def load_graph(backend, export_dir, name, device):
+	if backend == 'onnx':
+		return OnnxGraph(os.path.join(export_dir, name + '.onnx'))
+	if backend == 'torchscript':
+		return ScriptGraph(os.path.join(export_dir, name + '.pt'), device)
+	raise ValueError('Unknown backend {}, expected one of {}'.format(backend, BACKENDS))
+
+def load_wav2lip(backend, export_dir, device):
+	return ExportedWav2Lip(*[load_graph(backend, export_dir, name, device) for name in WAV2LIP_GRAPHS])
+
+def load_s3fd(backend, export_dir, device):
+	"""Callable replacing the s3fd module inside SFDDetector."""
+	return load_graph(backend, export_dir, S3FD_GRAPH, device)
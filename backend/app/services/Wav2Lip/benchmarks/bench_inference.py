@@ -0,0 +1,246 @@
+"""Benchmarks the lip-sync path of inference.py on synthetic inputs, without
+checkpoints or footage: randomly initialised Wav2Lip and s3fd (unless
+--checkpoint_path / --s3fd_path are given), noise frames with a bright
+rectangle standing in for the face, and a synthetic voice-like wav.
+
+For every resolution and duration, in a fresh process (so that peak RSS is
+that of one job):
+  - each stage runs once, serially, and is timed on its own: mel extraction,
+    face detection, datagen (crop/resize/batching), the Wav2Lip forward,
+    paste-back and encoding (ffmpeg, or nothing with --no_encode)
+  - then the same job runs end to end through inference.lipsync, with the
+    overlap between the model and paste-back/encoding, for the real fps.
+
+The detector runs on every frame as usual, but reports the known rectangle:
+random s3fd weights do not find faces. With random weights the number of
+candidate boxes, and so the NMS time, differs from real footage.
+
+	python benchmarks/bench_inference.py --resolutions 1280x720 1920x1080 --durations 5 20
+	python benchmarks/bench_inference.py --json results.json --precision bf16 --channels_last
+
+Unknown options are passed on to inference.py (e.g. --precision, --backend, --feather).
+"""
+import os, sys, time, json, math, resource, argparse, tempfile
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STAGES = ['mel', 'detect', 'datagen', 'infer', 'paste', 'encode']
+
+parser = argparse.ArgumentParser(description='Benchmark Wav2Lip inference on synthetic inputs')
+parser.add_argument('--resolutions', nargs='+', default=['640x360', '1280x720', '1920x1080'], help='WIDTHxHEIGHT of the frames')
+parser.add_argument('--durations', nargs='+', type=float, default=[5.], help='Clip lengths in seconds')
+parser.add_argument('--fps', type=float, default=25.)
+parser.add_argument('--checkpoint_path', type=str, default=None, help='Wav2Lip checkpoint (random weights if omitted)')
+parser.add_argument('--s3fd_path', type=str, default=None, help='s3fd.pth (random weights if omitted)')
+parser.add_argument('--no_encode', default=False, action='store_true', help='Do not run ffmpeg, drop the frames instead')
+parser.add_argument('--no_end_to_end', default=False, action='store_true', help='Only time the stages one by one')
+parser.add_argument('--json', type=str, default=None, help='Also write the results to this file')
+parser.add_argument('--seed', type=int, default=0)
+
+def peak_rss_mb():
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak / 1024. if sys.platform != 'darwin' else peak / 1024. ** 2 # KB on Linux, bytes on macOS
+
+def synthetic_frames(width, height, count, seed, pool=25):
+	"""`count` frames cycling through `pool` distinct ones (memory stays
+	bounded for long clips), and the (x1, y1, x2, y2) box of the face."""
+	rng = np.random.RandomState(seed)
+	x1, y1 = 2 * width // 5, height // 3
+	x2, y2 = x1 + width // 5, y1 + height // 3
+	frames = []
+	for i in range(pool):
+		frame = (rng.rand(height, width, 3) * 80).astype(np.uint8)
+		frame[y1:y2, x1:x2] = 200 + rng.randint(0, 50)
+		frames.append(frame)
+	return [frames[i % pool] for i in range(count)], (x1, y1, x2, y2)
+
+def synthetic_wav(path, seconds, seed, sr=16000):
+	from scipy.io import wavfile
+
+	rng = np.random.RandomState(seed)
+	t = np.arange(int(seconds * sr)) / float(sr)
+	syllables = 0.5 * (1 + np.sin(2 * np.pi * 4 * t)) # ~4 syllables per second
+	wav = syllables * (0.3 * np.sin(2 * np.pi * 180 * t) + 0.1 * np.sin(2 * np.pi * 720 * t)) + 0.01 * rng.randn(len(t))
+	wavfile.write(path, sr, (wav * 32767).astype(np.int16))
+	return path
+
+class NullWriter(object):
+	def write(self, frame):
+		pass
+
+	def release(self):
+		pass
+
+	def abort(self):
+		pass
+
+class KnownFace(object):
+	"""Runs the face detector for its cost, but returns the synthetic face box."""
+	def __init__(self, detector, box):
+		self.detector = detector
+		self.box = box
+
+	def get_detections_for_batch(self, images):
+		self.detector.get_detections_for_batch(images)
+		return [self.box] * len(images)
+
+def build_model(args, inference):
+	import torch
+	from models import Wav2Lip
+
+	if args.checkpoint_path:
+		return inference.load_model(args.checkpoint_path, inference.device, args.backend, args.export_dir,
+									args.precision, args.calibration_path)
+	if args.backend != 'torch' or args.precision == 'int8':
+		raise ValueError('--backend {} / --precision {} need --checkpoint_path'.format(args.backend, args.precision))
+	torch.manual_seed(args.seed)
+	return Wav2Lip().to(inference.device).eval()
+
+def build_detector(args, inference):
+	import torch
+	import face_detection
+	from face_detection.detection.sfd.net_s3fd import s3fd
+
+	if args.backend != 'torch':
+		return inference.build_detector(inference.device, args.det_face_res, args.det_min_res,
+										args.backend, args.export_dir)
+	if args.s3fd_path:
+		kwargs = {'path_to_detector': args.s3fd_path}
+	else:
+		torch.manual_seed(args.seed)
+		kwargs = {'net': s3fd().to(inference.device).eval()}
+	return face_detection.FaceAlignment(face_detection.LandmarksType._2D, flip_input=False, device=inference.device,
+										detection_face_res=args.det_face_res, min_detection_res=args.det_min_res,
+										face_detector_kwargs=kwargs)
+
+def time_stages(frames, wav_path, model, detector, args, inference, temp_dir, outfile):
+	import torch
+
+	timings = dict((stage, 0.) for stage in STAGES)
+
+	start = time.time()
+	mel_chunks = inference.get_mel_chunks(wav_path, args.fps)
+	timings['mel'] = time.time() - start
+	frames = frames[:len(mel_chunks)]
+
+	start = time.time()
+	face_det_results = inference.face_detect(frames, args, detector, temp_dir)
+	timings['detect'] = time.time() - start
+
+	model = inference.prepare_model(model, args)
+	inputs = inference.InputBuffers(args.channels_last)
+	paste = inference.PasteBack(args.feather)
+	height, width = frames[0].shape[:2]
+	out = NullWriter() if args.no_encode else \
+		inference.open_writer(args.fps, width, height, wav_path, outfile, args)
+
+	# same crops as face_detect gave, without detecting again
+	gen = inference.datagen(frames, mel_chunks, argparse.Namespace(**dict(vars(args), box=list(face_det_results[0][1]))),
+							None, temp_dir)
+	written = 0
+	while 1:
+		start = time.time()
+		batch = next(gen, None)
+		timings['datagen'] += time.time() - start
+		if batch is None:
+			break
+		img_batch, mel_batch, frame_batch, coords = batch
+
+		start = time.time()
+		with torch.no_grad(), inference.precision_context(args):
+			pred = model(inputs('mel', mel_batch), inputs('img', img_batch))
+		if inference.device == 'cuda':
+			torch.cuda.synchronize()
+		timings['infer'] += time.time() - start
+
+		start = time.time()
+		paste(pred, frame_batch, coords)
+		timings['paste'] += time.time() - start
+
+		start = time.time()
+		for f in frame_batch:
+			out.write(f)
+		written += len(frame_batch)
+		timings['encode'] += time.time() - start
+
+	start = time.time()
+	out.release()
+	timings['encode'] += time.time() - start
+	return written, mel_chunks, timings
+
+def run_config(width, height, seconds, args):
+	"""One benchmark, meant to run in its own process."""
+	import inference
+
+	with tempfile.TemporaryDirectory(prefix='wav2lip_bench_') as temp_dir:
+		wav_path = synthetic_wav(os.path.join(temp_dir, 'audio.wav'), seconds, args.seed)
+		frames, box = synthetic_frames(width, height, int(math.ceil(seconds * args.fps)) + 1, args.seed)
+		outfile = os.path.join(temp_dir, 'result.mp4')
+
+		start = time.time()
+		model = build_model(args, inference)
+		detector = KnownFace(build_detector(args, inference), box)
+		load_seconds = time.time() - start
+
+		written, mel_chunks, timings = time_stages(frames, wav_path, model, detector, args, inference,
+													temp_dir, outfile)
+
+		end_to_end = None
+		if not args.no_end_to_end:
+			if args.no_encode:
+				inference.open_writer = lambda *a, **k: NullWriter()
+			start = time.time()
+			inference.lipsync(frames, args.fps, mel_chunks, model, args, wav_path, outfile, detector, temp_dir)
+			end_to_end = time.time() - start + timings['mel'] # mel extraction is not part of lipsync
+
+	total = sum(timings.values())
+	return {
+		'resolution': '{}x{}'.format(width, height),
+		'seconds': seconds,
+		'frames': written,
+		'load_seconds': load_seconds,
+		'stage_seconds': timings,
+		'stage_ms_per_frame': dict((k, 1000. * v / max(written, 1)) for k, v in timings.items()),
+		'serial_fps': written / max(total, 1e-9),
+		'end_to_end_fps': written / end_to_end if end_to_end else None,
+		'peak_rss_mb': peak_rss_mb(),
+	}
+
+def print_results(results):
+	header = '{:>10} {:>6} {:>6} ' + ' '.join(['{:>8}'] * len(STAGES)) + ' {:>8} {:>8} {:>9}'
+	row = '{:>10} {:>6.1f} {:>6} ' + ' '.join(['{:>8.2f}'] * len(STAGES)) + ' {:>8.2f} {:>8} {:>9.0f}'
+	print('Per-stage latency in ms per frame; fps of the serial stages and end to end')
+	print(header.format('resolution', 'secs', 'frames', *(STAGES + ['fps', 'e2e fps', 'RSS (MB)'])))
+	for r in results:
+		e2e = '{:.2f}'.format(r['end_to_end_fps']) if r['end_to_end_fps'] else '-'
+		print(row.format(r['resolution'], r['seconds'], r['frames'], *([r['stage_ms_per_frame'][s] for s in STAGES]
+						+ [r['serial_fps'], e2e, r['peak_rss_mb']])))
+
+def main(args, extra):
+	import inference
+
+	inference_args = inference.parse_args(['--checkpoint_path', args.checkpoint_path or '', '--face', '', '--audio', '']
+											+ extra)
+	for key, value in vars(inference_args).items():
+		if not hasattr(args, key):
+			setattr(args, key, value)
+	args.static = False
+
+	results = []
+	for resolution in args.resolutions:
+		width, height = [int(v) for v in resolution.lower().split('x')]
+		for seconds in args.durations:
+			print('Benchmarking {}x{}, {:.1f}s...'.format(width, height, seconds))
+			with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn')) as pool:
+				results.append(pool.submit(run_config, width, height, seconds, args).result())
+
+	print_results(results)
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump({'options': sys.argv[1:], 'results': results}, f, indent=1)
+
+if __name__ == '__main__':
+	main(*parser.parse_known_args())
@@ -0,0 +1,107 @@
+"""Compares the vectorized S3FD anchor decoding in
+face_detection/detection/sfd/detect.py with the original per-anchor loop.
+
+Runs s3fd once per repeat (random weights unless --weights is given) and
+times only the decoding of its outputs, then checks that both versions
+give the same boxes after NMS.
+
+	python benchmarks/bench_sfd_decode.py --width 1920 --height 1080 --batch_size 4
+"""
+import os, sys, time, argparse
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from face_detection.detection.sfd.net_s3fd import s3fd
+from face_detection.detection.sfd.bbox import nms, batch_decode
+from face_detection.detection.sfd.detect import batch_decode_detections
+
+parser = argparse.ArgumentParser(description='Benchmark S3FD anchor decoding (loop vs vectorized)')
+parser.add_argument('--width', type=int, default=1280)
+parser.add_argument('--height', type=int, default=720)
+parser.add_argument('--batch_size', type=int, default=4)
+parser.add_argument('--repeats', type=int, default=5)
+parser.add_argument('--weights', type=str, default=None, help='Path to s3fd.pth (random weights if omitted)')
+parser.add_argument('--seed', type=int, default=0)
+
+def legacy_batch_decode_detections(olist):
+	"""The original batch_detect decoding: one tiny prior tensor and one
+	batch_decode call per candidate anchor."""
+	bboxlist = []
+	for i in range(len(olist) // 2):
+		olist[i * 2] = F.softmax(olist[i * 2], dim=1)
+	olist = [oelem.data.cpu() for oelem in olist]
+	BB = olist[0].size(0)
+	for i in range(len(olist) // 2):
+		ocls, oreg = olist[i * 2], olist[i * 2 + 1]
+		stride = 2**(i + 2)
+		poss = zip(*np.where(ocls[:, 1, :, :] > 0.05))
+		for Iindex, hindex, windex in poss:
+			axc, ayc = stride / 2 + windex * stride, stride / 2 + hindex * stride
+			score = ocls[:, 1, hindex, windex]
+			loc = oreg[:, :, hindex, windex].contiguous().view(BB, 1, 4)
+			priors = torch.Tensor([[axc / 1.0, ayc / 1.0, stride * 4 / 1.0, stride * 4 / 1.0]]).view(1, 1, 4)
+			variances = [0.1, 0.2]
+			box = batch_decode(loc, priors, variances)
+			box = box[:, 0] * 1.0
+			bboxlist.append(torch.cat([box, score.unsqueeze(1)], 1).cpu().numpy())
+	bboxlist = np.array(bboxlist)
+	if 0 == len(bboxlist):
+		bboxlist = np.zeros((1, BB, 5))
+
+	return bboxlist
+
+def final_boxes(bboxlists):
+	"""Per-image NMS followed by the 0.5 score filter, as detect_from_batch
+	used to do it."""
+	keeps = [nms(bboxlists[:, i, :], 0.3) for i in range(bboxlists.shape[1])]
+	bboxlists = [bboxlists[keep, i, :] for i, keep in enumerate(keeps)]
+	return [np.array([x for x in bboxlist if x[-1] > 0.5]).reshape(-1, 5) for bboxlist in bboxlists]
+
+def same_boxes(a, b):
+	if a.shape != b.shape:
+		return False
+	order_a, order_b = np.lexsort(a.T), np.lexsort(b.T)
+	return np.allclose(a[order_a], b[order_b], atol=1e-3)
+
+def timed(fn, olist):
+	olist = [o.clone() for o in olist]
+	start = time.time()
+	result = fn(olist)
+	return result, time.time() - start
+
+def main(args):
+	torch.manual_seed(args.seed)
+	net = s3fd()
+	if args.weights is not None:
+		net.load_state_dict(torch.load(args.weights, map_location='cpu'))
+	net.eval()
+
+	rng = np.random.RandomState(args.seed)
+	legacy_times, vectorized_times = [], []
+	all_match = True
+	for r in range(args.repeats):
+		imgs = rng.randint(0, 256, (args.batch_size, args.height, args.width, 3)).astype(np.float32)
+		imgs = torch.from_numpy((imgs - np.array([104, 117, 123])).transpose(0, 3, 1, 2)).float()
+		with torch.no_grad():
+			olist = net(imgs)
+
+		legacy, t_legacy = timed(legacy_batch_decode_detections, olist)
+		vectorized, t_vectorized = timed(batch_decode_detections, olist)
+		legacy_times.append(t_legacy)
+		vectorized_times.append(t_vectorized)
+
+		match = all(same_boxes(a, b) for a, b in zip(final_boxes(legacy), final_boxes(vectorized)))
+		all_match = all_match and match
+		print('Run {}: {} candidate rows (loop) / {} (vectorized), loop {:.1f} ms, vectorized {:.1f} ms, boxes match: {}'.format(
+			r, len(legacy), len(vectorized), t_legacy * 1000, t_vectorized * 1000, match))
+
+	print('{}x{} batch of {}: loop {:.1f} ms/batch, vectorized {:.1f} ms/batch ({:.1f}x), outputs {}'.format(
+		args.width, args.height, args.batch_size,
+		np.mean(legacy_times) * 1000, np.mean(vectorized_times) * 1000,
+		np.mean(legacy_times) / max(np.mean(vectorized_times), 1e-9),
+		'identical' if all_match else 'DIFFERENT'))
+
+if __name__ == '__main__':
+	main(parser.parse_args())
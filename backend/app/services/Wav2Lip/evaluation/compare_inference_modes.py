@@ -0,0 +1,125 @@
+"""Renders the same clips with several inference modes (see MODES) and
+compares them against the fp32 output: throughput, PSNR of the frames and,
+when a syncnet_python checkout is given, the LSE-D / LSE-C sync scores of
+scores_LSE/calculate_scores_LRS.py (copy the scores_LSE scripts into the
+checkout first, see README.md).
+
+	python evaluation/compare_inference_modes.py --checkpoint_path checkpoints/wav2lip.pth \
+		--faces a.mp4 b.mp4 --audios a.wav b.wav --modes fp32 bf16 --syncnet_dir ../syncnet_python
+
+Unknown options are passed on to inference.py (e.g. --box, --pads, --resize_factor).
+Outputs are written losslessly (--crf 0) so that PSNR measures the model, not x264.
+"""
+import os, sys, time, argparse, subprocess, re, hashlib, tempfile
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import inference
+
+MODES = {
+	'fp32': [],
+	'bf16': ['--precision', 'bf16', '--channels_last'],
+	'onnx': ['--backend', 'onnx'], # needs the graphs of export.py
+	'int8': ['--precision', 'int8'], # needs the calibration of quantize.py
+}
+
+parser = argparse.ArgumentParser(description='Compare Wav2Lip inference modes against fp32')
+parser.add_argument('--checkpoint_path', type=str, required=True)
+parser.add_argument('--faces', nargs='+', required=True, help='Videos/images to lip-sync')
+parser.add_argument('--audios', nargs='+', required=True, help='One audio file per face')
+parser.add_argument('--modes', nargs='+', default=['fp32', 'bf16'], choices=sorted(MODES))
+parser.add_argument('--results_dir', type=str, default='mode_comparison', help='One sub-folder of videos per mode')
+parser.add_argument('--syncnet_dir', type=str, default=None,
+					help='syncnet_python checkout with the scores_LSE scripts, to compute LSE-D / LSE-C')
+
+class MemoDetector(object):
+	"""Face detector that remembers its results, so that detection runs once
+	per clip and the timings compare the lip-sync model only."""
+	def __init__(self):
+		self.detector = None
+		self.results = {}
+
+	def get_detections_for_batch(self, images):
+		key = hashlib.sha1(np.ascontiguousarray(images).tobytes()).hexdigest()
+		if key not in self.results:
+			if self.detector is None:
+				self.detector = inference.build_detector(inference.device)
+			self.results[key] = self.detector.get_detections_for_batch(images)
+		return self.results[key]
+
+def render(model, detector, face, audio_path, outfile, extra):
+	args = inference.parse_args(['--checkpoint_path', '', '--face', face, '--audio', audio_path,
+								'--outfile', outfile, '--crf', '0'] + extra)
+	frames, fps = inference.read_frames(args)
+	with tempfile.TemporaryDirectory() as temp_dir:
+		wav_path = inference.prepare_audio(audio_path, temp_dir)
+		mel_chunks = inference.get_mel_chunks(wav_path, fps)
+		if args.box[0] == -1: # fill the detection cache outside of the timing
+			inference.face_detect(frames[:1] if args.static else frames[:len(mel_chunks)], args, detector, temp_dir)
+
+		start = time.time()
+		written = inference.lipsync(frames, fps, mel_chunks, model, args, wav_path, outfile, detector, temp_dir)
+		return written, time.time() - start
+
+def read_video(path):
+	video_stream = cv2.VideoCapture(path)
+	frames = []
+	while 1:
+		still_reading, frame = video_stream.read()
+		if not still_reading:
+			video_stream.release()
+			return frames
+		frames.append(frame)
+
+def psnr(frames, ref_frames):
+	mse = np.mean([np.mean((a.astype(np.float64) - b) ** 2) for a, b in zip(frames, ref_frames)])
+	return float('inf') if mse == 0 else 10 * np.log10(255. ** 2 / mse)
+
+def lse_scores(syncnet_dir, video_dir):
+	"""(LSE-D, LSE-C) averaged over the .mp4 files of `video_dir`."""
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		out = subprocess.run([sys.executable, 'calculate_scores_LRS.py', '--data_root', os.path.abspath(video_dir),
+							'--tmp_dir', tmp_dir], cwd=syncnet_dir, check=True, stdout=subprocess.PIPE,
+							universal_newlines=True).stdout
+	dist = re.search(r'Average Minimum Distance: (\S+)', out)
+	conf = re.search(r'Average Confidence: (\S+)', out)
+	return float(dist.group(1)), float(conf.group(1))
+
+def main(args, extra):
+	if len(args.faces) != len(args.audios):
+		parser.error('Give one audio file per face')
+	modes = ['fp32'] + [m for m in args.modes if m != 'fp32']
+
+	detector = MemoDetector()
+	outputs, stats = {}, {}
+	for mode in modes:
+		mode_args = inference.parse_args(['--checkpoint_path', args.checkpoint_path, '--face', '', '--audio', '']
+										+ extra + MODES[mode])
+		model = inference.load_model(args.checkpoint_path, backend=mode_args.backend, export_dir=mode_args.export_dir,
+										precision=mode_args.precision, calibration_path=mode_args.calibration_path)
+		mode_dir = os.path.join(args.results_dir, mode)
+		os.makedirs(mode_dir, exist_ok=True)
+
+		frames = seconds = 0
+		outputs[mode] = []
+		for i, (face, audio_path) in enumerate(zip(args.faces, args.audios)):
+			outfile = os.path.join(mode_dir, '{}.mp4'.format(i))
+			written, elapsed = render(model, detector, face, audio_path, outfile, extra + MODES[mode])
+			frames += written
+			seconds += elapsed
+			outputs[mode].append(outfile)
+		stats[mode] = {'frames': frames, 'seconds': seconds}
+
+	print('{:<8} {:>8} {:>10} {:>8} {:>12} {:>8} {:>8}'.format('mode', 'frames', 'fps', 'speedup', 'PSNR vs fp32', 'LSE-D', 'LSE-C'))
+	for mode in modes:
+		fps = stats[mode]['frames'] / max(stats[mode]['seconds'], 1e-9)
+		speedup = fps / (stats['fp32']['frames'] / max(stats['fp32']['seconds'], 1e-9))
+		quality = np.mean([psnr(read_video(out), read_video(ref)) for out, ref in zip(outputs[mode], outputs['fp32'])])
+		lse_d, lse_c = lse_scores(args.syncnet_dir, os.path.join(args.results_dir, mode)) \
+						if args.syncnet_dir else (float('nan'), float('nan'))
+		print('{:<8} {:>8} {:>10.2f} {:>7.2f}x {:>12.2f} {:>8.3f} {:>8.3f}'.format(
+			mode, stats[mode]['frames'], fps, speedup, quality, lse_d, lse_c))
+
+if __name__ == '__main__':
+	main(*parser.parse_known_args())
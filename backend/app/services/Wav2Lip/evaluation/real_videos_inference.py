@@ -218,8 +218,7 @@ def main():
 		subprocess.call(command, shell=True)
 		temp_audio = '../temp/temp.wav'
 
-		wav = audio.load_wav(temp_audio, 16000)
-		mel = audio.melspectrogram(wav)
+		mel = audio.load_mel(temp_audio)
 
 		if np.isnan(mel.reshape(-1)).sum() > 0:
 			raise ValueError('Mel contains nan!')
@@ -0,0 +1,128 @@
+"""Exports Wav2Lip and the S3FD face detector to TorchScript and ONNX, for the
+`--backend torchscript` / `--backend onnx` options of inference.py.
+
+	python export.py --checkpoint_path checkpoints/wav2lip_gan.pth
+
+writes to --export_dir (default: exported/ next to the checkpoint), per format:
+	wav2lip.{pt,onnx}                 (mel, face) -> image, same as Wav2Lip.forward on 4D inputs
+	wav2lip_encode_face.{pt,onnx}     face -> the 7 face encoder feature maps
+	wav2lip_forward_cached.{pt,onnx}  (mel, 7 feature maps of batch 1) -> image
+	s3fd.{pt,onnx}                    mean-subtracted BGR images -> the 12 raw s3fd outputs
+
+The batch size (and for s3fd the image size) stays dynamic. With --check the
+exported graphs are run once and compared against the PyTorch modules.
+"""
+import os, argparse
+import torch
+from torch import nn
+from torch.utils.model_zoo import load_url
+
+from models import Wav2Lip
+from backends import OnnxGraph, default_export_dir, S3FD_GRAPH
+from face_detection.detection.sfd.net_s3fd import s3fd
+from face_detection.detection.sfd.sfd_detector import models_urls
+
+NUM_FACE_FEATS = 7
+
+parser = argparse.ArgumentParser(description='Export Wav2Lip and S3FD to TorchScript / ONNX')
+parser.add_argument('--checkpoint_path', type=str, required=True, help='Wav2Lip checkpoint to export')
+parser.add_argument('--s3fd_path', type=str,
+					default=os.path.join('face_detection', 'detection', 'sfd', 's3fd.pth'),
+					help='S3FD weights (downloaded if the file does not exist)')
+parser.add_argument('--export_dir', type=str, default=None, help='Output folder (default: exported/ next to the checkpoint)')
+parser.add_argument('--formats', nargs='+', default=['torchscript', 'onnx'], choices=['torchscript', 'onnx'])
+parser.add_argument('--opset', type=int, default=17)
+parser.add_argument('--check', default=False, action='store_true', help='Compare the exported graphs against PyTorch')
+
+class EncodeFace(nn.Module):
+	def __init__(self, model):
+		super(EncodeFace, self).__init__()
+		self.model = model
+
+	def forward(self, face_sequences):
+		return tuple(self.model.encode_face(face_sequences))
+
+class ForwardCached(nn.Module):
+	def __init__(self, model):
+		super(ForwardCached, self).__init__()
+		self.model = model
+
+	def forward(self, audio_sequences, *feats):
+		return self.model.forward_cached(audio_sequences, list(feats))
+
+def load_wav2lip(checkpoint_path):
+	checkpoint = torch.load(checkpoint_path, map_location='cpu')
+	s = checkpoint["state_dict"]
+	model = Wav2Lip()
+	model.load_state_dict({k.replace('module.', ''): v for k, v in s.items()})
+	return model.eval()
+
+def load_s3fd(path):
+	net = s3fd()
+	net.load_state_dict(torch.load(path, map_location='cpu') if os.path.isfile(path) else load_url(models_urls['s3fd']))
+	return net.eval()
+
+def graphs(model, net, batch_size=4):
+	"""(name, module, example inputs, input names, output names, dynamic axes) of every graph."""
+	mel = torch.randn(batch_size, 1, 80, 16)
+	face = torch.rand(batch_size, 6, 96, 96)
+	with torch.no_grad():
+		feats = tuple(f[:1] for f in model.encode_face(face[:1]))
+	feat_names = ['feat{}'.format(i) for i in range(NUM_FACE_FEATS)]
+	batch = {0: 'batch'}
+
+	s3fd_outputs = ['out{}'.format(i) for i in range(12)]
+	return [
+		('wav2lip', model, (mel, face), ['mel', 'face'], ['image'],
+			{'mel': batch, 'face': batch, 'image': batch}),
+		('wav2lip_encode_face', EncodeFace(model).eval(), (face,), ['face'], feat_names,
+			dict({'face': batch}, **{name: batch for name in feat_names})),
+		('wav2lip_forward_cached', ForwardCached(model).eval(), (mel,) + feats, ['mel'] + feat_names, ['image'],
+			{'mel': batch, 'image': batch}),
+		(S3FD_GRAPH, net, (torch.randn(2, 3, 240, 320),), ['image'], s3fd_outputs,
+			dict({'image': {0: 'batch', 2: 'height', 3: 'width'}},
+				**{name: {0: 'batch', 2: 'height', 3: 'width'} for name in s3fd_outputs})),
+	]
+
+def export(module, inputs, path, input_names, output_names, dynamic_axes, fmt, opset):
+	with torch.no_grad():
+		if fmt == 'torchscript':
+			torch.jit.save(torch.jit.trace(module, inputs, check_trace=False), path)
+		else:
+			torch.onnx.export(module, inputs, path, input_names=input_names, output_names=output_names,
+								dynamic_axes=dynamic_axes, opset_version=opset, dynamo=False)
+
+def check(module, inputs, path, fmt):
+	"""Max abs difference between the exported graph and the module, on
+	inputs with another batch size than the export example."""
+	inputs = tuple(torch.cat([x, x[:1]]) if x.size(0) > 1 else x for x in inputs)
+	with torch.no_grad():
+		expected = module(*inputs)
+	expected = expected if isinstance(expected, (tuple, list)) else [expected]
+
+	if fmt == 'torchscript':
+		with torch.no_grad():
+			got = torch.jit.load(path)(*inputs)
+		got = got if isinstance(got, (tuple, list)) else [got]
+	else:
+		got = OnnxGraph(path)(*inputs)
+	return max(float((e - g).abs().max()) for e, g in zip(expected, got))
+
+def main(args):
+	export_dir = args.export_dir or default_export_dir(args.checkpoint_path)
+	os.makedirs(export_dir, exist_ok=True)
+
+	model = load_wav2lip(args.checkpoint_path)
+	net = load_s3fd(args.s3fd_path)
+
+	for name, module, inputs, input_names, output_names, dynamic_axes in graphs(model, net):
+		for fmt in args.formats:
+			path = os.path.join(export_dir, name + ('.pt' if fmt == 'torchscript' else '.onnx'))
+			export(module, inputs, path, input_names, output_names, dynamic_axes, fmt, args.opset)
+			message = 'Exported {}'.format(path)
+			if args.check:
+				message += ' (max abs diff vs PyTorch: {:.2e})'.format(check(module, inputs, path, fmt))
+			print(message)
+
+if __name__ == '__main__':
+	main(parser.parse_args())
@@ -1,5 +1,6 @@
 from __future__ import print_function
 import os
+import copy
 import torch
 from torch.utils.model_zoo import load_url
 from enum import Enum
@@ -44,12 +45,29 @@ class NetworkSize(Enum):
 ROOT = os.path.dirname(os.path.abspath(__file__))
 
 class FaceAlignment:
+    """Face detector front-end.
+
+    With ``detection_face_res`` set, detection runs on a downscaled copy of
+    each batch: the frame is shrunk so that faces come out around
+    ``detection_face_res`` pixels, without going below ``min_detection_res``
+    on the short side. Boxes are mapped back to full resolution.
+
+    The downscale factor costs one detection, so it is computed on the first
+    batch of each frame size and reused for the following ones; call
+    ``reset_detection_factor`` when a new video starts. If the downscaled
+    detection misses most faces of a batch, that frame size goes back to
+    full resolution.
+    """
     def __init__(self, landmarks_type, network_size=NetworkSize.LARGE,
-                 device='cuda', flip_input=False, face_detector='sfd', verbose=False):
+                 device='cuda', flip_input=False, face_detector='sfd', verbose=False,
+                 detection_face_res=None, min_detection_res=480, face_detector_kwargs=None):
         self.device = device
         self.flip_input = flip_input
         self.landmarks_type = landmarks_type
         self.verbose = verbose
+        self.detection_face_res = detection_face_res
+        self.min_detection_res = min_detection_res
+        self._factors = {}  # frame shape -> detection downscale factor
 
         network_size = int(network_size)
 
@@ -59,9 +77,80 @@ class FaceAlignment:
         # Get the face detector
         face_detector_module = __import__('face_detection.detection.' + face_detector,
                                           globals(), locals(), [face_detector], 0)
-        self.face_detector = face_detector_module.FaceDetector(device=device, verbose=verbose)
+        self.face_detector = face_detector_module.FaceDetector(device=device, verbose=verbose,
+                                                               **(face_detector_kwargs or {}))
 
     def get_detections_for_batch(self, images):
+        if not self.detection_face_res:
+            return self._detect(images)
+
+        h, w = images.shape[1:3]
+        shape = images.shape[1:]
+        factor = self._factors.get(shape)
+        if factor is None:
+            factor = self._factors[shape] = self.detection_factor(images[0])
+        if factor == 1:
+            return self._detect(images)
+
+        size = (w // factor, h // factor)
+        small = np.asarray([cv2.resize(im, size, interpolation=cv2.INTER_AREA) for im in images])
+        scale_x, scale_y = w / float(size[0]), h / float(size[1])
+
+        results = []
+        for d in self._detect(small):
+            if d is not None:
+                x1, y1, x2, y2 = d
+                d = (int(x1 * scale_x), int(y1 * scale_y), min(w, int(x2 * scale_x)), min(h, int(y2 * scale_y)))
+            results.append(d)
+
+        # faces missed at the lower resolution get a second chance at full resolution
+        missed = [i for i, d in enumerate(results) if d is None]
+        if len(missed) * 2 > len(results):
+            # re-detecting most frames at full resolution costs more than the baseline
+            self._factors[shape] = 1
+        if len(missed) > 0:
+            for i, d in zip(missed, self._detect(images[missed])):
+                results[i] = d
+
+        return results
+
+    def with_resolution(self, detection_face_res, min_detection_res):
+        """Copy with other downscale settings, sharing the face detector
+        network (and its weights) with this one."""
+        other = copy.copy(self)
+        other.detection_face_res = detection_face_res
+        other.min_detection_res = min_detection_res
+        other._factors = {}
+        return other
+
+    def reset_detection_factor(self):
+        self._factors.clear()
+
+    def detection_factor(self, image):
+        """Integer downscale factor for detection, chosen from the face size
+        in ``image`` (found on a copy at the smallest allowed resolution)."""
+        h, w = image.shape[:2]
+        max_factor = min(h, w) // self.min_detection_res
+        if max_factor < 2:
+            return 1
+
+        probe = cv2.resize(image, (w // max_factor, h // max_factor), interpolation=cv2.INTER_AREA)
+        rect = self._detect(probe[None])[0]
+        if rect is None:
+            return 1
+
+        x1, y1, x2, y2 = rect
+        face_size = max(y2 - y1, x2 - x1) * max_factor
+
+        factor, diff = 1, abs(face_size - self.detection_face_res)
+        for f in range(2, max_factor + 1):
+            f_diff = abs(face_size // f - self.detection_face_res)
+            if f_diff >= diff:
+                break
+            factor, diff = f, f_diff
+        return factor
+
+    def _detect(self, images):
         images = images[..., ::-1]
         detected_faces = self.face_detector.detect_from_batch(images.copy())
         results = []
@@ -64,6 +64,52 @@ def nms(dets, thresh):
     return keep
 
 
+def batch_nms(dets, thresh, score_thresh=None):
+    """NMS over a (N, B, 5) batch of detections in one call.
+
+    Candidates scoring at or below score_thresh are dropped first; a box can
+    only be suppressed by a higher scoring one, so this does not change the
+    result of thresholding after NMS. The remaining candidates of each image
+    are sorted into a padded (B, M) batch and every iteration suppresses
+    around the best remaining box of all images at once.
+
+    Returns one (K, 5) array per image, sorted by decreasing score.
+    """
+    N, B, _ = dets.shape
+    dets = dets.transpose(1, 0, 2)
+    scores = dets[:, :, 4]
+    alive = np.ones((B, N), dtype=bool) if score_thresh is None else scores > score_thresh
+
+    M = alive.sum(axis=1).max()
+    if 0 == M:
+        return [np.zeros((0, 5)) for _ in range(B)]
+
+    order = np.argsort(-np.where(alive, scores, -np.inf), axis=1, kind='stable')[:, :M]
+    dets = np.take_along_axis(dets, order[:, :, None], axis=1)
+    alive = np.take_along_axis(alive, order, axis=1)
+
+    x1, y1, x2, y2 = dets[:, :, 0], dets[:, :, 1], dets[:, :, 2], dets[:, :, 3]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    keep = np.zeros((B, M), dtype=bool)
+    rows = np.arange(B)
+
+    while alive.any():
+        i = alive.argmax(axis=1)
+        has_box = alive[rows, i]
+        keep[rows[has_box], i[has_box]] = True
+        alive[rows, i] = False
+
+        xx1, yy1 = np.maximum(x1[rows, i][:, None], x1), np.maximum(y1[rows, i][:, None], y1)
+        xx2, yy2 = np.minimum(x2[rows, i][:, None], x2), np.minimum(y2[rows, i][:, None], y2)
+
+        w, h = np.maximum(0.0, xx2 - xx1 + 1), np.maximum(0.0, yy2 - yy1 + 1)
+        ovr = w * h / (areas[rows, i][:, None] + areas - w * h)
+
+        alive &= ovr <= thresh
+
+    return [dets[b][keep[b]] for b in range(B)]
+
+
 def encode(matched, priors, variances):
     """Encode the variances from the priorbox layers into the ground truth boxes
     we have matched (based on jaccard overlap) with the prior boxes.
@@ -29,31 +29,7 @@ def detect(net, img, device):
     with torch.no_grad():
         olist = net(img)
 
-    bboxlist = []
-    for i in range(len(olist) // 2):
-        olist[i * 2] = F.softmax(olist[i * 2], dim=1)
-    olist = [oelem.data.cpu() for oelem in olist]
-    for i in range(len(olist) // 2):
-        ocls, oreg = olist[i * 2], olist[i * 2 + 1]
-        FB, FC, FH, FW = ocls.size()  # feature map size
-        stride = 2**(i + 2)    # 4,8,16,32,64,128
-        anchor = stride * 4
-        poss = zip(*np.where(ocls[:, 1, :, :] > 0.05))
-        for Iindex, hindex, windex in poss:
-            axc, ayc = stride / 2 + windex * stride, stride / 2 + hindex * stride
-            score = ocls[0, 1, hindex, windex]
-            loc = oreg[0, :, hindex, windex].contiguous().view(1, 4)
-            priors = torch.Tensor([[axc / 1.0, ayc / 1.0, stride * 4 / 1.0, stride * 4 / 1.0]])
-            variances = [0.1, 0.2]
-            box = decode(loc, priors, variances)
-            x1, y1, x2, y2 = box[0] * 1.0
-            # cv2.rectangle(imgshow,(int(x1),int(y1)),(int(x2),int(y2)),(0,0,255),1)
-            bboxlist.append([x1, y1, x2, y2, score])
-    bboxlist = np.array(bboxlist)
-    if 0 == len(bboxlist):
-        bboxlist = np.zeros((1, 5))
-
-    return bboxlist
+    return decode_detections(olist)
 
 def batch_detect(net, imgs, device):
     imgs = imgs - np.array([104, 117, 123])
@@ -67,31 +43,66 @@ def batch_detect(net, imgs, device):
     with torch.no_grad():
         olist = net(imgs)
 
+    return batch_decode_detections(olist)
+
+def anchor_priors(hindex, windex, stride):
+    """Prior boxes (cx, cy, w, h) of the anchors at the given feature map positions."""
+    priors = torch.empty((len(hindex), 4))
+    priors[:, 0] = stride / 2 + windex.float() * stride
+    priors[:, 1] = stride / 2 + hindex.float() * stride
+    priors[:, 2:] = stride * 4
+    return priors
+
+def decode_detections(olist):
+    """Turns the raw s3fd outputs of a single image into a (N, 5) array of
+    (x1, y1, x2, y2, score), decoding all candidate anchors of a feature
+    level at once."""
     bboxlist = []
     for i in range(len(olist) // 2):
         olist[i * 2] = F.softmax(olist[i * 2], dim=1)
     olist = [oelem.data.cpu() for oelem in olist]
     for i in range(len(olist) // 2):
         ocls, oreg = olist[i * 2], olist[i * 2 + 1]
-        FB, FC, FH, FW = ocls.size()  # feature map size
         stride = 2**(i + 2)    # 4,8,16,32,64,128
-        anchor = stride * 4
-        poss = zip(*np.where(ocls[:, 1, :, :] > 0.05))
-        for Iindex, hindex, windex in poss:
-            axc, ayc = stride / 2 + windex * stride, stride / 2 + hindex * stride
-            score = ocls[:, 1, hindex, windex]
-            loc = oreg[:, :, hindex, windex].contiguous().view(BB, 1, 4)
-            priors = torch.Tensor([[axc / 1.0, ayc / 1.0, stride * 4 / 1.0, stride * 4 / 1.0]]).view(1, 1, 4)
-            variances = [0.1, 0.2]
-            box = batch_decode(loc, priors, variances)
-            box = box[:, 0] * 1.0
-            # cv2.rectangle(imgshow,(int(x1),int(y1)),(int(x2),int(y2)),(0,0,255),1)
-            bboxlist.append(torch.cat([box, score.unsqueeze(1)], 1).cpu().numpy())
-    bboxlist = np.array(bboxlist)
+        hindex, windex = torch.nonzero(ocls[0, 1] > 0.05, as_tuple=True)
+        if len(hindex) == 0:
+            continue
+        score = ocls[0, 1, hindex, windex]
+        loc = oreg[0, :, hindex, windex].t()
+        priors = anchor_priors(hindex, windex, stride)
+        variances = [0.1, 0.2]
+        box = decode(loc, priors, variances)
+        bboxlist.append(torch.cat([box, score.unsqueeze(1)], 1))
     if 0 == len(bboxlist):
-        bboxlist = np.zeros((1, BB, 5))
+        return np.zeros((1, 5))
 
-    return bboxlist
+    return torch.cat(bboxlist).numpy()
+
+def batch_decode_detections(olist):
+    """Batched version of decode_detections. Returns a (N, B, 5) array: every
+    anchor that scores above 0.05 in any image of the batch is decoded for
+    all images."""
+    bboxlist = []
+    for i in range(len(olist) // 2):
+        olist[i * 2] = F.softmax(olist[i * 2], dim=1)
+    olist = [oelem.data.cpu() for oelem in olist]
+    BB = olist[0].size(0)
+    for i in range(len(olist) // 2):
+        ocls, oreg = olist[i * 2], olist[i * 2 + 1]
+        stride = 2**(i + 2)    # 4,8,16,32,64,128
+        hindex, windex = torch.nonzero((ocls[:, 1] > 0.05).any(dim=0), as_tuple=True)
+        if len(hindex) == 0:
+            continue
+        score = ocls[:, 1, hindex, windex]
+        loc = oreg[:, :, hindex, windex].permute(0, 2, 1)
+        priors = anchor_priors(hindex, windex, stride).unsqueeze(0)
+        variances = [0.1, 0.2]
+        box = batch_decode(loc, priors, variances)
+        bboxlist.append(torch.cat([box, score.unsqueeze(2)], 2))
+    if 0 == len(bboxlist):
+        return np.zeros((1, BB, 5))
+
+    return torch.cat(bboxlist, 1).permute(1, 0, 2).numpy()
 
 def flip_detect(net, img, device):
     img = cv2.flip(img, 1)
@@ -14,9 +14,15 @@ models_urls = {
 
 
 class SFDDetector(FaceDetector):
-    def __init__(self, device, path_to_detector=os.path.join(os.path.dirname(os.path.abspath(__file__)), 's3fd.pth'), verbose=False):
+    def __init__(self, device, path_to_detector=os.path.join(os.path.dirname(os.path.abspath(__file__)), 's3fd.pth'), verbose=False,
+                 net=None):
         super(SFDDetector, self).__init__(device, verbose)
 
+        # An exported s3fd graph (see backends.py) replaces the PyTorch network
+        if net is not None:
+            self.face_detector = net
+            return
+
         # Initialise the face detector
         if not os.path.isfile(path_to_detector):
             model_weights = load_url(models_urls['s3fd'])
@@ -32,19 +38,16 @@ class SFDDetector(FaceDetector):
         image = self.tensor_or_path_to_ndarray(tensor_or_path)
 
         bboxlist = detect(self.face_detector, image, device=self.device)
+        bboxlist = bboxlist[bboxlist[:, -1] > 0.5]
         keep = nms(bboxlist, 0.3)
-        bboxlist = bboxlist[keep, :]
-        bboxlist = [x for x in bboxlist if x[-1] > 0.5]
+        bboxlist = [x for x in bboxlist[keep, :]]
 
         return bboxlist
 
     def detect_from_batch(self, images):
         bboxlists = batch_detect(self.face_detector, images, device=self.device)
-        keeps = [nms(bboxlists[:, i, :], 0.3) for i in range(bboxlists.shape[1])]
-        bboxlists = [bboxlists[keep, i, :] for i, keep in enumerate(keeps)]
-        bboxlists = [[x for x in bboxlist if x[-1] > 0.5] for bboxlist in bboxlists]
 
-        return bboxlists
+        return batch_nms(bboxlists, 0.3, score_thresh=0.5)
 
     @property
     def reference_scale(self):
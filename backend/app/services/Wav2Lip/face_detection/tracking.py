@@ -0,0 +1,94 @@
+import numpy as np
+import cv2
+
+
+class KeyframeTracker:
+    """Runs the face detector on keyframes only and interpolates the boxes of
+    the frames in between.
+
+    Keyframes are every ``keyframe_interval``-th frame, the last frame of a
+    batch and the frames on both sides of a scene cut. An interpolated box is
+    checked against the face at the nearest keyframe: if the upper half of
+    the face (the mouth is expected to move) differs by more than
+    ``drift_threshold`` (mean absolute difference of 0-255 grayscale
+    thumbnails), the frame is detected again.
+
+    Exposes the same ``get_detections_for_batch`` as ``FaceAlignment``; feed
+    it batches several keyframe intervals long to benefit from it.
+    """
+
+    def __init__(self, detector, keyframe_interval=10, drift_threshold=12., scene_threshold=40.):
+        self.detector = detector
+        self.keyframe_interval = max(1, int(keyframe_interval))
+        self.drift_threshold = drift_threshold
+        self.scene_threshold = scene_threshold
+        self.frames_seen = 0
+        self.frames_detected = 0
+
+    def get_detections_for_batch(self, images):
+        n = len(images)
+        if n == 0:
+            return []
+
+        keyframes = set(range(0, n, self.keyframe_interval))
+        keyframes.add(n - 1)
+        keyframes.update(self._scene_cuts(images))
+        keyframes = sorted(keyframes)
+
+        results = [None] * n
+        for i, rect in zip(keyframes, self._detect(images, keyframes)):
+            results[i] = rect
+
+        interpolated = []
+        for a, b in zip(keyframes[:-1], keyframes[1:]):
+            for i in range(a + 1, b):
+                results[i] = self._interpolate(results[a], results[b], (i - a) / float(b - a))
+                nearest = a if i - a <= b - i else b
+                if results[i] is None or self._drifted(images[i], results[i], images[nearest], results[nearest]):
+                    interpolated.append(i)
+
+        for i, rect in zip(interpolated, self._detect(images, interpolated)):
+            results[i] = rect
+
+        self.frames_seen += n
+        return results
+
+    def _detect(self, images, indices):
+        if len(indices) == 0:
+            return []
+        self.frames_detected += len(indices)
+        return self.detector.get_detections_for_batch(np.asarray([images[i] for i in indices]))
+
+    def _scene_cuts(self, images):
+        thumbs = [self._thumbnail(im) for im in images]
+        cuts = []
+        for i in range(1, len(thumbs)):
+            if np.abs(thumbs[i] - thumbs[i - 1]).mean() > self.scene_threshold:
+                cuts.extend([i - 1, i])
+        return cuts
+
+    @staticmethod
+    def _thumbnail(image, size=32):
+        gray = cv2.cvtColor(np.ascontiguousarray(image), cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    @staticmethod
+    def _interpolate(rect_a, rect_b, t):
+        if rect_a is None or rect_b is None:
+            return rect_a if rect_b is None else rect_b
+        return tuple(int(round((1 - t) * a + t * b)) for a, b in zip(rect_a, rect_b))
+
+    def _drifted(self, image, rect, ref_image, ref_rect):
+        if ref_rect is None:
+            return True
+        face, ref_face = self._upper_face(image, rect), self._upper_face(ref_image, ref_rect)
+        if face is None or ref_face is None:
+            return True
+        return np.abs(face - ref_face).mean() > self.drift_threshold
+
+    def _upper_face(self, image, rect):
+        x1, y1, x2, y2 = rect
+        crop = image[y1:y1 + max(1, (y2 - y1) // 2), x1:x2]
+        if crop.size == 0:
+            return None
+        return self._thumbnail(crop, size=16)
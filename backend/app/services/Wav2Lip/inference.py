@@ -1,12 +1,13 @@
 from os import listdir, path
 import numpy as np
 import scipy, cv2, os, sys, argparse, audio
-import json, subprocess, random, string
+import json, subprocess, random, string, itertools, shutil, tempfile, contextlib, time
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from glob import glob
-import torch, face_detection
+import torch, face_detection, backends, quantize, autotune
 from models import Wav2Lip
-import platform
+from pipeline import Pipeline
 
 parser = argparse.ArgumentParser(description='Inference code to lip-sync videos in the wild using Wav2Lip models')
 
@@ -50,11 +51,76 @@ parser.add_argument('--rotate', default=False, action='store_true',
 parser.add_argument('--nosmooth', default=False, action='store_true',
 					help='Prevent smoothing face detections over a short temporal window')
 
-args = parser.parse_args()
-args.img_size = 96
-
-if os.path.isfile(args.face) and args.face.split('.')[1] in ['jpg', 'png', 'jpeg']:
-	args.static = True
+parser.add_argument('--det_face_res', type=int, default=180,
+					help='Run face detection on frames downscaled so that faces are about this many pixels. 0 detects at full resolution')
+parser.add_argument('--det_min_res', type=int, default=480,
+					help='Never downscale frames for face detection below this short-side resolution')
+
+parser.add_argument('--keyframe_interval', type=int, default=1,
+					help='Run the face detector only every N frames (and on scene cuts) and interpolate the boxes in between. '
+					'1 detects every frame')
+parser.add_argument('--drift_threshold', type=float, default=12.,
+					help='Re-detect an interpolated frame when its face differs from the keyframe face by more than this '
+					'(mean absolute grayscale difference, 0-255)')
+parser.add_argument('--scene_threshold', type=float, default=40.,
+					help='Mean absolute grayscale difference between consecutive frames treated as a scene cut')
+
+parser.add_argument('--temp_dir', type=str, default=None,
+					help='Parent directory of the per-run scratch directory (default: the system temp dir)')
+parser.add_argument('--crf', type=int, default=18,
+					help='x264 quality of the output video (lower is better, 0 is lossless)')
+
+parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'bf16', 'int8'],
+					help='Run Wav2Lip in float32, in bfloat16 autocast (fastest on CPUs with native bf16 support) '
+					'or quantized to INT8 (CPU only, calibrate with quantize.py first)')
+parser.add_argument('--calibration_path', type=str, default=None,
+					help='INT8 calibration written by quantize.py (default: next to the checkpoint)')
+parser.add_argument('--channels_last', default=False, action='store_true',
+					help='Run Wav2Lip on channels-last (NHWC) tensors, usually faster on CPU')
+
+parser.add_argument('--feather', type=int, default=0,
+					help='Blend the generated face into the frame over this many pixels at its edges to hide the seam '
+					'(0: paste it as is)')
+
+parser.add_argument('--autotune', default=False, action='store_true',
+					help='Replace --wav2lip_batch_size and --face_det_batch_size with the fastest sizes on this host, '
+					'found by timing a few sizes the first time (cached per host and frame resolution)')
+parser.add_argument('--autotune_cache', type=str, default=None,
+					help='Cache of the tuned batch sizes (default: ~/.cache/wav2lip/batch_sizes.json)')
+
+parser.add_argument('--backend', type=str, default='torch', choices=backends.BACKENDS,
+					help='Run Wav2Lip and the face detector in PyTorch, or use the graphs written by export.py '
+					'with TorchScript or ONNX Runtime (CPU execution provider)')
+parser.add_argument('--export_dir', type=str, default=None,
+					help='Folder of the exported graphs (default: exported/ next to the checkpoint)')
+
+parser.add_argument('--stream', default=False, action='store_true',
+					help='Decode, detect, lip-sync and write video frames in rolling batches instead of loading the whole video. '
+					'Peak memory then depends on the batch sizes, not on the video length')
+parser.add_argument('--pipeline', default=False, action='store_true',
+					help='Stream (implies --stream) with decoding, face detection, batching, Wav2Lip and encoding '
+					'running concurrently in threads connected by bounded queues, and print the time spent in each stage')
+parser.add_argument('--queue_batches', type=int, default=2,
+					help='With --pipeline, how many batches each queue between two stages can hold')
+
+def parse_args(argv=None):
+	args = parser.parse_args(argv)
+	args.img_size = 96
+
+	if os.path.isfile(args.face) and is_image_file(args.face):
+		args.static = True
+	if args.pipeline:
+		args.stream = True
+
+	if args.export_dir is None:
+		args.export_dir = backends.default_export_dir(args.checkpoint_path)
+	if args.calibration_path is None:
+		args.calibration_path = quantize.default_calibration_path(args.checkpoint_path)
+
+	return args
+
+def is_image_file(path):
+	return os.path.splitext(path)[1][1:].lower() in ['jpg', 'png', 'jpeg']
 
 def get_smoothened_boxes(boxes, T):
 	for i in range(len(boxes)):
@@ -65,54 +131,160 @@ def get_smoothened_boxes(boxes, T):
 		boxes[i] = np.mean(window, axis=0)
 	return boxes
 
-def face_detect(images):
-	detector = face_detection.FaceAlignment(face_detection.LandmarksType._2D, 
-											flip_input=False, device=device)
-
-	batch_size = args.face_det_batch_size
-	
+def build_detector(device, det_face_res=180, det_min_res=480, backend='torch', export_dir=None):
+	kwargs = None
+	if backend != 'torch':
+		kwargs = {'net': backends.load_s3fd(backend, export_dir, device)}
+	return face_detection.FaceAlignment(face_detection.LandmarksType._2D, 
+											flip_input=False, device=device,
+											detection_face_res=det_face_res, min_detection_res=det_min_res,
+											face_detector_kwargs=kwargs)
+
+class BoxSmoother(object):
+	"""Streaming version of get_smoothened_boxes: a box is final once the
+	T - 1 boxes after it are known, so only T boxes are ever held."""
+	def __init__(self, T):
+		self.T = T
+		self.pending = []
+		self.last = None
+
+	def push(self, box):
+		self.pending.append(box)
+		if len(self.pending) < self.T:
+			return []
+
+		window = np.array(self.pending)
+		self.last = np.mean(window, axis=0).astype(window.dtype)
+		self.pending.pop(0)
+		return [self.last]
+
+	def flush(self):
+		if len(self.pending) == 0:
+			return []
+		if self.last is None:
+			return list(get_smoothened_boxes(np.array(self.pending), self.T))
+
+		# the tail of get_smoothened_boxes averages over the last T boxes,
+		# including the ones it has already smoothed
+		window = np.array([self.last] + self.pending)
+		boxes = []
+		for i in range(1, len(window)):
+			window[i] = np.mean(window, axis=0)
+			boxes.append(window[i].copy())
+		self.pending = []
+		return boxes
+
+def reset_detection_factor(detector):
+	"""A new video: the detector picks its det_face_res downscale again on
+	the first batch (it then keeps it for the whole video)."""
+	if hasattr(detector, 'reset_detection_factor'):
+		detector.reset_detection_factor()
+
+def with_tracking(detector, args):
+	"""Wraps the detector in a KeyframeTracker when --keyframe_interval > 1.
+	Returns the detector and how many frames to give it per detection batch."""
+	if args.keyframe_interval <= 1:
+		return detector, 1
+
+	tracker = face_detection.KeyframeTracker(detector, args.keyframe_interval,
+											args.drift_threshold, args.scene_threshold)
+	return tracker, args.keyframe_interval
+
+def run_detector(images, detector, batch_size, progress=True):
 	while 1:
 		predictions = []
 		try:
-			for i in tqdm(range(0, len(images), batch_size)):
+			for i in tqdm(range(0, len(images), batch_size), disable=not progress):
 				predictions.extend(detector.get_detections_for_batch(np.array(images[i:i + batch_size])))
-		except RuntimeError:
+		except Exception as e:
+			if not autotune.is_out_of_memory(e):
+				raise
 			if batch_size == 1: 
 				raise RuntimeError('Image too big to run face detection on GPU. Please use the --resize_factor argument')
 			batch_size //= 2
 			print('Recovering from OOM error; New batch size: {}'.format(batch_size))
 			continue
-		break
+		return predictions, batch_size
+
+def pad_box(rect, image, args, temp_dir='temp'):
+	if rect is None:
+		cv2.imwrite(os.path.join(temp_dir, 'faulty_frame.jpg'), image) # check this frame where the face was not detected.
+		raise ValueError('Face not detected! Ensure the video contains a face in all the frames.')
 
-	results = []
 	pady1, pady2, padx1, padx2 = args.pads
-	for rect, image in zip(predictions, images):
-		if rect is None:
-			cv2.imwrite('temp/faulty_frame.jpg', image) # check this frame where the face was not detected.
-			raise ValueError('Face not detected! Ensure the video contains a face in all the frames.')
-
-		y1 = max(0, rect[1] - pady1)
-		y2 = min(image.shape[0], rect[3] + pady2)
-		x1 = max(0, rect[0] - padx1)
-		x2 = min(image.shape[1], rect[2] + padx2)
-		
-		results.append([x1, y1, x2, y2])
+	y1 = max(0, rect[1] - pady1)
+	y2 = min(image.shape[0], rect[3] + pady2)
+	x1 = max(0, rect[0] - padx1)
+	x2 = min(image.shape[1], rect[2] + padx2)
+	return [x1, y1, x2, y2]
+
+def face_detect(images, args, detector=None, temp_dir='temp'):
+	owns_detector = detector is None
+	if owns_detector:
+		detector = build_detector(device, args.det_face_res, args.det_min_res, args.backend, args.export_dir)
+	reset_detection_factor(detector)
+
+	tracker, frames_per_batch = with_tracking(detector, args)
+	predictions, _ = run_detector(images, tracker, args.face_det_batch_size * frames_per_batch)
+	if tracker is not detector:
+		print('Ran face detection on {} of {} frames'.format(tracker.frames_detected, tracker.frames_seen))
+
+	results = [pad_box(rect, image, args, temp_dir) for rect, image in zip(predictions, images)]
 
 	boxes = np.array(results)
 	if not args.nosmooth: boxes = get_smoothened_boxes(boxes, T=5)
 	results = [[image[y1: y2, x1:x2], (y1, y2, x1, x2)] for image, (x1, y1, x2, y2) in zip(images, boxes)]
 
-	del detector
+	if owns_detector:
+		del detector
 	return results 
 
-def datagen(frames, mels):
+def stream_face_detect(frames, args, detector=None, temp_dir='temp'):
+	"""Yields (frame, (y1, y2, x1, x2)) for an iterable of frames, running the
+	detector one batch at a time. Only the current detection batch and the
+	smoothing window are kept in memory."""
+	if detector is None:
+		detector = build_detector(device, args.det_face_res, args.det_min_res, args.backend, args.export_dir)
+	reset_detection_factor(detector)
+
+	detector, frames_per_batch = with_tracking(detector, args)
+	smoother = BoxSmoother(T=1 if args.nosmooth else 5)
+	batch_size = args.face_det_batch_size * frames_per_batch
+	waiting = [] # frames whose smoothed box is not final yet
+
+	frames = iter(frames)
+	while 1:
+		images = list(itertools.islice(frames, batch_size))
+		if len(images) == 0:
+			break
+
+		predictions, batch_size = run_detector(images, detector, batch_size, progress=False)
+		for rect, image in zip(predictions, images):
+			waiting.append(image)
+			for x1, y1, x2, y2 in smoother.push(pad_box(rect, image, args, temp_dir)):
+				yield waiting.pop(0), (y1, y2, x1, x2)
+
+	for x1, y1, x2, y2 in smoother.flush():
+		yield waiting.pop(0), (y1, y2, x1, x2)
+
+def prepare_batch(img_batch, mel_batch, args):
+	img_batch, mel_batch = np.asarray(img_batch), np.asarray(mel_batch)
+
+	img_masked = img_batch.copy()
+	img_masked[:, args.img_size//2:] = 0
+
+	img_batch = np.concatenate((img_masked, img_batch), axis=3) / 255.
+	mel_batch = np.reshape(mel_batch, [len(mel_batch), mel_batch.shape[1], mel_batch.shape[2], 1])
+	return img_batch, mel_batch
+
+def datagen(frames, mels, args, detector=None, temp_dir='temp'):
 	img_batch, mel_batch, frame_batch, coords_batch = [], [], [], []
 
 	if args.box[0] == -1:
 		if not args.static:
-			face_det_results = face_detect(frames) # BGR2RGB for CNN face detection
+			face_det_results = face_detect(frames, args, detector, temp_dir) # BGR2RGB for CNN face detection
 		else:
-			face_det_results = face_detect([frames[0]])
+			face_det_results = face_detect([frames[0]], args, detector, temp_dir)
 	else:
 		print('Using the specified bounding box instead of face detection...')
 		y1, y2, x1, x2 = args.box
@@ -131,33 +303,73 @@ def datagen(frames, mels):
 		coords_batch.append(coords)
 
 		if len(img_batch) >= args.wav2lip_batch_size:
-			img_batch, mel_batch = np.asarray(img_batch), np.asarray(mel_batch)
+			yield prepare_batch(img_batch, mel_batch, args) + (frame_batch, coords_batch)
+			img_batch, mel_batch, frame_batch, coords_batch = [], [], [], []
 
-			img_masked = img_batch.copy()
-			img_masked[:, args.img_size//2:] = 0
+	if len(img_batch) > 0:
+		yield prepare_batch(img_batch, mel_batch, args) + (frame_batch, coords_batch)
 
-			img_batch = np.concatenate((img_masked, img_batch), axis=3) / 255.
-			mel_batch = np.reshape(mel_batch, [len(mel_batch), mel_batch.shape[1], mel_batch.shape[2], 1])
+def stream_datagen(mels, args, detector=None, temp_dir='temp', pipeline=None):
+	"""Same batches as datagen, but video frames are decoded and face-detected
+	on the fly. If the audio is longer than the video, the video is decoded
+	again from the start and the boxes found in the first pass are reused.
+	With a `pipeline`, decoding and face detection run in their own threads."""
+	img_batch, mel_batch, frame_batch, coords_batch = [], [], [], []
+	coords_cache = []
+
+	def decode(frames):
+		if pipeline is None:
+			return frames
+		return pipeline.stage('decode', frames, args.queue_batches * args.face_det_batch_size)
+
+	def first_pass():
+		frames = decode(itertools.islice(iter_frames(args), len(mels)))
+		if args.box[0] == -1:
+			detected = stream_face_detect(frames, args, detector, temp_dir)
+			if pipeline is not None:
+				detected = pipeline.stage('detect', detected, args.queue_batches * args.wav2lip_batch_size)
+		else:
+			print('Using the specified bounding box instead of face detection...')
+			detected = ((f, tuple(args.box)) for f in frames)
 
-			yield img_batch, mel_batch, frame_batch, coords_batch
-			img_batch, mel_batch, frame_batch, coords_batch = [], [], [], []
+		for frame, coords in detected:
+			coords_cache.append(coords)
+			yield frame, coords
 
-	if len(img_batch) > 0:
-		img_batch, mel_batch = np.asarray(img_batch), np.asarray(mel_batch)
+	def replay():
+		return zip(decode(iter_frames(args)), coords_cache)
 
-		img_masked = img_batch.copy()
-		img_masked[:, args.img_size//2:] = 0
+	source = first_pass()
+	for m in mels:
+		try:
+			frame, coords = next(source)
+		except StopIteration:
+			if len(coords_cache) == 0:
+				raise ValueError('No frames could be read from {}'.format(args.face))
+			source = replay()
+			frame, coords = next(source)
 
-		img_batch = np.concatenate((img_masked, img_batch), axis=3) / 255.
-		mel_batch = np.reshape(mel_batch, [len(mel_batch), mel_batch.shape[1], mel_batch.shape[2], 1])
+		y1, y2, x1, x2 = coords
+		face = cv2.resize(frame[y1: y2, x1:x2], (args.img_size, args.img_size))
 
-		yield img_batch, mel_batch, frame_batch, coords_batch
+		img_batch.append(face)
+		mel_batch.append(m)
+		frame_batch.append(frame)
+		coords_batch.append(coords)
+
+		if len(img_batch) >= args.wav2lip_batch_size:
+			yield prepare_batch(img_batch, mel_batch, args) + (frame_batch, coords_batch)
+			img_batch, mel_batch, frame_batch, coords_batch = [], [], [], []
+
+	if len(img_batch) > 0:
+		yield prepare_batch(img_batch, mel_batch, args) + (frame_batch, coords_batch)
 
 mel_step_size = 16
+PIPELINE_STAGES = ['decode', 'detect', 'batch', 'infer', 'encode']
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 print('Using {} for inference.'.format(device))
 
-def _load(checkpoint_path):
+def _load(checkpoint_path, device=device):
 	if device == 'cuda':
 		checkpoint = torch.load(checkpoint_path)
 	else:
@@ -165,10 +377,18 @@ def _load(checkpoint_path):
 								map_location=lambda storage, loc: storage)
 	return checkpoint
 
-def load_model(path):
+def load_model(path, device=device, backend='torch', export_dir=None, precision='fp32', calibration_path=None):
+	if precision == 'int8' and (backend != 'torch' or device != 'cpu'):
+		raise ValueError('INT8 inference needs the torch backend on CPU')
+
+	if backend != 'torch':
+		export_dir = export_dir or backends.default_export_dir(path)
+		print("Load {} graphs from: {}".format(backend, export_dir))
+		return backends.load_wav2lip(backend, export_dir, device)
+
 	model = Wav2Lip()
 	print("Load checkpoint from: {}".format(path))
-	checkpoint = _load(path)
+	checkpoint = _load(path, device)
 	s = checkpoint["state_dict"]
 	new_s = {}
 	for k, v in s.items():
@@ -176,53 +396,72 @@ def load_model(path):
 	model.load_state_dict(new_s)
 
 	model = model.to(device)
+	if precision == 'int8':
+		calibration_path = calibration_path or quantize.default_calibration_path(path)
+		print("Quantize to INT8 with: {}".format(calibration_path))
+		return quantize.load_int8(model, calibration_path)
 	return model.eval()
 
-def main():
-	if not os.path.isfile(args.face):
-		raise ValueError('--face argument must be a valid path to video/image file')
+def preprocess_frame(frame, args):
+	if args.resize_factor > 1:
+		frame = cv2.resize(frame, (frame.shape[1]//args.resize_factor, frame.shape[0]//args.resize_factor))
 
-	elif args.face.split('.')[1] in ['jpg', 'png', 'jpeg']:
-		full_frames = [cv2.imread(args.face)]
-		fps = args.fps
+	if args.rotate:
+		frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
 
-	else:
-		video_stream = cv2.VideoCapture(args.face)
-		fps = video_stream.get(cv2.CAP_PROP_FPS)
+	y1, y2, x1, x2 = args.crop
+	if x2 == -1: x2 = frame.shape[1]
+	if y2 == -1: y2 = frame.shape[0]
 
-		print('Reading video frames...')
+	return frame[y1:y2, x1:x2]
 
-		full_frames = []
+def iter_frames(args):
+	video_stream = cv2.VideoCapture(args.face)
+	try:
 		while 1:
 			still_reading, frame = video_stream.read()
 			if not still_reading:
-				video_stream.release()
 				break
-			if args.resize_factor > 1:
-				frame = cv2.resize(frame, (frame.shape[1]//args.resize_factor, frame.shape[0]//args.resize_factor))
+			yield preprocess_frame(frame, args)
+	finally:
+		video_stream.release()
+
+def read_fps(args):
+	if not os.path.isfile(args.face):
+		raise ValueError('--face argument must be a valid path to video/image file')
 
-			if args.rotate:
-				frame = cv2.rotate(frame, cv2.cv2.ROTATE_90_CLOCKWISE)
+	if is_image_file(args.face):
+		return args.fps
 
-			y1, y2, x1, x2 = args.crop
-			if x2 == -1: x2 = frame.shape[1]
-			if y2 == -1: y2 = frame.shape[0]
+	video_stream = cv2.VideoCapture(args.face)
+	fps = video_stream.get(cv2.CAP_PROP_FPS)
+	video_stream.release()
+	return fps
 
-			frame = frame[y1:y2, x1:x2]
+def read_frames(args):
+	fps = read_fps(args)
+
+	if is_image_file(args.face):
+		full_frames = [cv2.imread(args.face)]
 
-			full_frames.append(frame)
+	else:
+		print('Reading video frames...')
+		full_frames = list(iter_frames(args))
 
 	print ("Number of frames available for inference: "+str(len(full_frames)))
+	return full_frames, fps
 
-	if not args.audio.endswith('.wav'):
-		print('Extracting raw audio...')
-		command = 'ffmpeg -y -i {} -strict -2 {}'.format(args.audio, 'temp/temp.wav')
+def prepare_audio(audio_path, temp_dir='temp'):
+	if audio_path.endswith('.wav'):
+		return audio_path
 
-		subprocess.call(command, shell=True)
-		args.audio = 'temp/temp.wav'
+	print('Extracting raw audio...')
+	wav_path = os.path.join(temp_dir, 'temp.wav')
+	subprocess.check_call(['ffmpeg', '-y', '-loglevel', 'error', '-i', audio_path, '-strict', '-2', wav_path])
+	return wav_path
 
-	wav = audio.load_wav(args.audio, 16000)
-	mel = audio.melspectrogram(wav)
+def get_mel_chunks(wav_path, fps):
+	mel = audio.load_mel(wav_path)
 	print(mel.shape)
 
 	if np.isnan(mel.reshape(-1)).sum() > 0:
@@ -240,41 +479,351 @@ def main():
 		i += 1
 
 	print("Length of mel chunks: {}".format(len(mel_chunks)))
+	return mel_chunks
+
+class FFmpegWriter(object):
+	"""cv2.VideoWriter look-alike that pipes raw BGR frames into a single
+	ffmpeg process, which encodes them and muxes `audio_path` into `outfile`
+	in one pass (no intermediate AVI). ffmpeg writes a hidden partial file
+	next to `outfile`, renamed to it by release() once ffmpeg succeeded;
+	abort() kills ffmpeg and deletes the partial file, leaving `outfile` as
+	it was."""
+	def __init__(self, outfile, fps, frame_w, frame_h, audio_path, crf=18):
+		outdir, name = os.path.split(outfile)
+		stem, ext = os.path.splitext(name)
+		self.partial = os.path.join(outdir, '.{}.{}.partial{}'.format(stem, os.getpid(), ext))
+		command = ['ffmpeg', '-y', '-loglevel', 'error',
+					'-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', '{}x{}'.format(frame_w, frame_h), '-r', str(fps), '-i', '-',
+					'-i', audio_path, '-map', '0:v', '-map', '1:a',
+					'-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', # yuv420p needs even dimensions
+					'-c:v', 'libx264', '-preset', 'veryfast', '-crf', str(crf), '-pix_fmt', 'yuv420p',
+					'-c:a', 'aac', self.partial]
+		self.outfile = outfile
+		self.frame_size = (frame_h, frame_w, 3)
+		self.stderr = tempfile.TemporaryFile()
+		self.proc = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self.stderr)
+
+	def write(self, frame):
+		if frame.shape != self.frame_size:
+			raise ValueError('Frame of shape {} written to a {} video'.format(frame.shape, self.frame_size))
+		try:
+			self.proc.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+		except (BrokenPipeError, OSError):
+			self.release()
+
+	def release(self):
+		if self.proc.stdin.closed:
+			return
+		self.proc.stdin.close()
+		returncode = self.proc.wait()
+		self.stderr.seek(0)
+		error = self.stderr.read().decode(errors='replace').strip()
+		self.stderr.close()
+		if returncode != 0:
+			self.abort()
+			raise RuntimeError('ffmpeg failed to write {} (exit code {}): {}'.format(self.outfile, returncode, error))
+		os.replace(self.partial, self.outfile)
+
+	def abort(self):
+		if self.proc.poll() is None:
+			self.proc.kill()
+			self.proc.wait()
+		for f in [self.proc.stdin, self.stderr]:
+			try:
+				f.close()
+			except (BrokenPipeError, OSError):
+				pass
+		if os.path.exists(self.partial):
+			os.remove(self.partial)
+
+def open_writer(fps, frame_w, frame_h, audio_path, outfile, args=None):
+	outdir = os.path.dirname(outfile)
+	if outdir:
+		os.makedirs(outdir, exist_ok=True)
+	crf = 18 if args is None else args.crf
+	return FFmpegWriter(outfile, fps, frame_w, frame_h, audio_path, crf)
+
+class InputBuffers(object):
+	"""Reused model input tensors. NHWC numpy batches are cast and copied into
+	them in a single pass (no intermediate transposed copy); with channels_last
+	the NHWC layout is kept as is. Buffers are pinned when running on CUDA,
+	and a buffer is only refilled once its previous asynchronous upload is
+	done: nothing else waits for it now that the outputs are read back on the
+	post-processing thread."""
+	def __init__(self, channels_last=False):
+		self.channels_last = channels_last
+		self.buffers = {}
+		self.uploads = {}
+
+	def __call__(self, name, batch):
+		src = torch.from_numpy(np.asarray(batch)).permute(0, 3, 1, 2)
+		key = (name, tuple(src.shape))
+		buf = self.buffers.get(key)
+		if buf is None:
+			buf = torch.empty(src.shape, dtype=torch.float32, pin_memory=device == 'cuda',
+								memory_format=torch.channels_last if self.channels_last else torch.contiguous_format)
+			self.buffers[key] = buf
+		if key in self.uploads:
+			self.uploads[key].synchronize()
+		buf.copy_(src)
+		if device != 'cuda':
+			return buf
+		batch = buf.to(device, non_blocking=True)
+		self.uploads[key] = torch.cuda.Event()
+		self.uploads[key].record()
+		return batch
+
+def prepare_model(model, args):
+	if args is not None and args.channels_last:
+		model = model.to(memory_format=torch.channels_last)
+	return model
+
+def precision_context(args):
+	if args is not None and args.precision == 'bf16':
+		return torch.autocast(device_type='cuda' if device == 'cuda' else 'cpu', dtype=torch.bfloat16)
+	return contextlib.nullcontext()
+
+def to_frames(pred):
+	"""Model output (N, 3, H, W) in [0, 1] -> (N, H, W, 3) uint8."""
+	return (pred.float().cpu().numpy().transpose(0, 2, 3, 1) * 255.).astype(np.uint8)
+
+class PasteBack(object):
+	"""Post-processing of a batch of model outputs: the batch is converted to
+	uint8 at once, then each face is resized to its box and pasted, or with
+	`feather` > 0 blended through a mask that fades it out over that many
+	pixels at the box edges. Masks are cached per box size."""
+	def __init__(self, feather=0):
+		self.feather = feather
+		self.masks = {}
+
+	def mask(self, h, w):
+		if (h, w) not in self.masks:
+			feather = max(1, min(self.feather, h // 2, w // 2))
+			dist_y = np.minimum(np.arange(h), np.arange(h)[::-1])
+			dist_x = np.minimum(np.arange(w), np.arange(w)[::-1])
+			weights = np.minimum((np.minimum.outer(dist_y, dist_x) + 1.) / feather, 1.).astype(np.float32)
+			self.masks[(h, w)] = (weights, 1. - weights)
+		return self.masks[(h, w)]
+
+	def faces(self, pred, coords, backgrounds):
+		"""uint8 faces resized to `coords` (y1, y2, x1, x2) and, when feathering,
+		blended with the same box of `backgrounds`."""
+		faces = []
+		for p, background, (y1, y2, x1, x2) in zip(to_frames(pred), backgrounds, coords):
+			p = cv2.resize(p, (x2 - x1, y2 - y1))
+			if self.feather > 0:
+				weights, inverse = self.mask(y2 - y1, x2 - x1)
+				p = cv2.blendLinear(p, background[y1:y2, x1:x2], weights, inverse)
+			faces.append(p)
+		return faces
+
+	def __call__(self, pred, frames, coords):
+		"""Pastes the predictions into `frames` in place."""
+		for f, face, (y1, y2, x1, x2) in zip(frames, self.faces(pred, coords, frames), coords):
+			f[y1:y2, x1:x2] = face
+		return frames
+
+def write_batches(gen, total, model, fps, audio_path, outfile, args=None, pipeline=None):
+	"""Runs Wav2Lip on the batches of `gen`, pastes the mouths back and writes
+	`outfile`. Returns the number of frames written. Paste-back and writing of
+	a batch run on a worker thread while the model runs on the next one. With
+	a `pipeline`, the time spent in both is added to its timings."""
+	out = None
+	model = prepare_model(model, args)
+	inputs = InputBuffers(args is not None and args.channels_last)
+	paste = PasteBack(0 if args is None else args.feather)
+	limit = autotune.BatchLimit('Wav2Lip')
+
+	def post(pred, frames, coords):
+		start = time.time()
+		for f in paste(pred, frames, coords):
+			out.write(f)
+		if pipeline is not None:
+			pipeline.add('encode', time.time() - start, len(frames))
+		return len(frames)
+
+	written = 0
+	pending = None
+	try:
+		with ThreadPoolExecutor(max_workers=1) as post_thread:
+			for i, (img_batch, mel_batch, frames, coords) in enumerate(tqdm(gen, total=total)):
+				if out is None:
+					frame_h, frame_w = frames[0].shape[:-1]
+					out = open_writer(fps, frame_w, frame_h, audio_path, outfile, args)
+
+				img_batch = inputs('img', img_batch)
+				mel_batch = inputs('mel', mel_batch)
+
+				start = time.time()
+				with torch.no_grad(), precision_context(args):
+					pred = limit(model, mel_batch, img_batch)
+				if pipeline is not None:
+					if device == 'cuda':
+						torch.cuda.synchronize()
+					pipeline.add('infer', time.time() - start, len(frames))
+
+				# at most one batch in post-processing: keeps the order and bounds memory
+				if pending is not None:
+					written += pending.result()
+				pending = post_thread.submit(post, pred, frames, coords)
+
+			if pending is not None:
+				written += pending.result()
+	except BaseException:
+		# no truncated video at `outfile`
+		if out is not None:
+			out.abort()
+		raise
 
-	full_frames = full_frames[:len(mel_chunks)]
-
-	batch_size = args.wav2lip_batch_size
-	gen = datagen(full_frames.copy(), mel_chunks)
-
-	for i, (img_batch, mel_batch, frames, coords) in enumerate(tqdm(gen, 
-											total=int(np.ceil(float(len(mel_chunks))/batch_size)))):
-		if i == 0:
-			model = load_model(args.checkpoint_path)
-			print ("Model loaded")
-
-			frame_h, frame_w = full_frames[0].shape[:-1]
-			out = cv2.VideoWriter('temp/result.avi', 
-									cv2.VideoWriter_fourcc(*'DIVX'), fps, (frame_w, frame_h))
+	out.release()
+	return written
 
-		img_batch = torch.FloatTensor(np.transpose(img_batch, (0, 3, 1, 2))).to(device)
-		mel_batch = torch.FloatTensor(np.transpose(mel_batch, (0, 3, 1, 2))).to(device)
+def static_face(frame, args, detector=None, temp_dir='temp'):
+	if args.box[0] == -1:
+		return face_detect([frame], args, detector, temp_dir)[0]
+
+	print('Using the specified bounding box instead of face detection...')
+	y1, y2, x1, x2 = args.box
+	return [frame[y1: y2, x1:x2], (y1, y2, x1, x2)]
+
+def lipsync_static(frame, fps, mel_chunks, model, args, audio_path, outfile, detector=None, temp_dir='temp'):
+	"""Fast path for a still avatar. The face is detected, resized, masked and
+	run through the face encoder once; each batch only runs the audio encoder
+	and the decoder. Mouths are pasted into a single preallocated output frame."""
+	face, (y1, y2, x1, x2) = static_face(frame, args, detector, temp_dir)
+	face = cv2.resize(face, (args.img_size, args.img_size))
+	img_batch, _ = prepare_batch([face], [mel_chunks[0]], args)
+	model = prepare_model(model, args)
+	inputs = InputBuffers(args.channels_last)
+
+	with torch.no_grad(), precision_context(args):
+		face_feats = model.encode_face(inputs('img', img_batch))
+
+	frame_h, frame_w = frame.shape[:-1]
+	out = open_writer(fps, frame_w, frame_h, audio_path, outfile, args)
+	out_frame = frame.copy()
+
+	paste = PasteBack(args.feather)
+	limit = autotune.BatchLimit('Wav2Lip')
+	forward_cached = lambda mel_batch: model.forward_cached(mel_batch, face_feats)
+
+	def post(pred):
+		coords = [(y1, y2, x1, x2)] * len(pred)
+		for face in paste.faces(pred, coords, [frame] * len(pred)):
+			out_frame[y1:y2, x1:x2] = face
+			out.write(out_frame)
+		return len(pred)
 
-		with torch.no_grad():
-			pred = model(mel_batch, img_batch)
+	batch_size = args.wav2lip_batch_size
+	written = 0
+	pending = None
+	try:
+		with ThreadPoolExecutor(max_workers=1) as post_thread:
+			for i in tqdm(range(0, len(mel_chunks), batch_size)):
+				mel_batch = inputs('mel', np.asarray(mel_chunks[i:i + batch_size])[..., np.newaxis])
+
+				with torch.no_grad(), precision_context(args):
+					pred = limit(forward_cached, mel_batch)
+
+				if pending is not None:
+					written += pending.result()
+				pending = post_thread.submit(post, pred)
+
+			if pending is not None:
+				written += pending.result()
+	except BaseException:
+		out.abort()
+		raise
 
-		pred = pred.cpu().numpy().transpose(0, 2, 3, 1) * 255.
-		
-		for p, f, c in zip(pred, frames, coords):
-			y1, y2, x1, x2 = c
-			p = cv2.resize(p.astype(np.uint8), (x2 - x1, y2 - y1))
+	out.release()
+	return written
 
-			f[y1:y2, x1:x2] = p
-			out.write(f)
+def lipsync(full_frames, fps, mel_chunks, model, args, audio_path, outfile, detector=None, temp_dir='temp'):
+	"""Runs face detection + Wav2Lip over `full_frames` and writes `outfile`.
+	Returns the number of frames written."""
+	if args.static:
+		return lipsync_static(full_frames[0], fps, mel_chunks, model, args, audio_path, outfile, detector, temp_dir)
 
-	out.release()
+	full_frames = full_frames[:len(mel_chunks)]
 
-	command = 'ffmpeg -y -i {} -i {} -strict -2 -q:v 1 {}'.format(args.audio, 'temp/result.avi', args.outfile)
-	subprocess.call(command, shell=platform.system() != 'Windows')
+	gen = datagen(full_frames.copy(), mel_chunks, args, detector, temp_dir)
+	total = int(np.ceil(float(len(mel_chunks))/args.wav2lip_batch_size))
+	return write_batches(gen, total, model, fps, audio_path, outfile, args)
+
+def lipsync_stream(fps, mel_chunks, model, args, audio_path, outfile, detector=None, temp_dir='temp', pipeline=None):
+	"""Streaming counterpart of lipsync that reads frames from `args.face`.
+	With --pipeline (or a `pipeline` to collect the stage timings in), the
+	stages run concurrently and their timings are printed at the end."""
+	if pipeline is None and args.pipeline:
+		pipeline = Pipeline(PIPELINE_STAGES)
+
+	gen = stream_datagen(mel_chunks, args, detector, temp_dir, pipeline)
+	if pipeline is not None:
+		gen = pipeline.stage('batch', gen, args.queue_batches)
+	total = int(np.ceil(float(len(mel_chunks))/args.wav2lip_batch_size))
+	try:
+		written = write_batches(gen, total, model, fps, audio_path, outfile, args, pipeline)
+	finally:
+		if pipeline is not None:
+			pipeline.close()
+
+	if pipeline is not None:
+		pipeline.report()
+	return written
+
+def tune_batch_sizes(model, detector, frame, args):
+	"""--autotune: sets args.wav2lip_batch_size and, with a detector,
+	args.face_det_batch_size to the fastest sizes on this host (the detector
+	is timed on `frame`, the first frame of the input)."""
+	tuner = autotune.BatchSizeTuner(device, args.autotune_cache)
+	tuned_model = prepare_model(model, args)
+	inputs = InputBuffers(args.channels_last)
+	rng = np.random.RandomState(0)
+
+	def run(size):
+		img_batch = inputs('img', rng.rand(size, args.img_size, args.img_size, 6).astype(np.float32))
+		mel_batch = inputs('mel', rng.randn(size, 80, mel_step_size, 1).astype(np.float32))
+		with torch.no_grad(), precision_context(args):
+			to_frames(tuned_model(mel_batch, img_batch))
+
+	args.wav2lip_batch_size = tuner.wav2lip_batch_size(model, args, run)
+	if detector is not None:
+		args.face_det_batch_size = tuner.face_det_batch_size(detector, frame, args)
+	print('Batch sizes: Wav2Lip {}, face detection {}'.format(args.wav2lip_batch_size, args.face_det_batch_size))
+
+def main(args):
+	if args.stream and not args.static:
+		fps = read_fps(args)
+	else:
+		full_frames, fps = read_frames(args)
+
+	# every run gets its own scratch directory so that several jobs can share a host
+	temp_dir = tempfile.mkdtemp(prefix='wav2lip_', dir=args.temp_dir)
+	faulty_frame = os.path.join(temp_dir, 'faulty_frame.jpg')
+	try:
+		audio_path = prepare_audio(args.audio, temp_dir)
+		mel_chunks = get_mel_chunks(audio_path, fps)
+
+		model = load_model(args.checkpoint_path, backend=args.backend, export_dir=args.export_dir,
+							precision=args.precision, calibration_path=args.calibration_path)
+		print ("Model loaded")
+
+		detector = None
+		if args.autotune:
+			if args.box[0] == -1 and not args.static:
+				detector = build_detector(device, args.det_face_res, args.det_min_res, args.backend, args.export_dir)
+			frame = next(iter_frames(args)) if args.stream and not args.static else full_frames[0]
+			tune_batch_sizes(model, detector, frame, args)
+
+		if args.stream and not args.static:
+			lipsync_stream(fps, mel_chunks, model, args, audio_path, args.outfile, detector, temp_dir)
+		else:
+			lipsync(full_frames, fps, mel_chunks, model, args, audio_path, args.outfile, detector, temp_dir)
+	finally:
+		if os.path.exists(faulty_frame):
+			print('Frame without a detected face saved to {}'.format(faulty_frame))
+		else:
+			shutil.rmtree(temp_dir, ignore_errors=True)
 
 if __name__ == '__main__':
-	main()
+	main(parse_args())
@@ -84,36 +84,62 @@ class Wav2Lip(nn.Module):
             nn.Conv2d(32, 3, kernel_size=1, stride=1, padding=0),
             nn.Sigmoid()) 
 
-    def forward(self, audio_sequences, face_sequences):
-        # audio_sequences = (B, T, 1, 80, 16)
-        B = audio_sequences.size(0)
-
-        input_dim_size = len(face_sequences.size())
-        if input_dim_size > 4:
-            audio_sequences = torch.cat([audio_sequences[:, i] for i in range(audio_sequences.size(1))], dim=0)
-            face_sequences = torch.cat([face_sequences[:, :, i] for i in range(face_sequences.size(2))], dim=0)
-
-        audio_embedding = self.audio_encoder(audio_sequences) # B, 512, 1, 1
+    def encode_face(self, face_sequences):
+        """Runs only the face encoder and returns its feature pyramid.
 
+        For a face that does not change between frames (static avatar), the
+        result can be computed once and passed to forward_cached() for every
+        mel chunk. face_sequences = (B, 6, H, W)
+        """
         feats = []
         x = face_sequences
         for f in self.face_encoder_blocks:
             x = f(x)
             feats.append(x)
+        return feats
+
+    def forward_cached(self, audio_sequences, feats):
+        """Same as forward() on 4D inputs, but with precomputed face features
+        from encode_face(). Features with batch size 1 are broadcast to the
+        audio batch. audio_sequences = (B, 1, 80, 16)
+        """
+        audio_embedding = self.audio_encoder(audio_sequences) # B, 512, 1, 1
+        return self.decode(audio_embedding, feats)
+
+    def decode(self, audio_embedding, feats):
+        feats = list(feats)
 
         x = audio_embedding
         for f in self.face_decoder_blocks:
             x = f(x)
+            feat = feats[-1]
+            if feat.size(0) != x.size(0):
+                feat = feat.expand(x.size(0), -1, -1, -1)
             try:
-                x = torch.cat((x, feats[-1]), dim=1)
+                x = torch.cat((x, feat), dim=1)
             except Exception as e:
                 print(x.size())
-                print(feats[-1].size())
+                print(feat.size())
                 raise e
             
             feats.pop()
 
-        x = self.output_block(x)
+        return self.output_block(x)
+
+    def forward(self, audio_sequences, face_sequences):
+        # audio_sequences = (B, T, 1, 80, 16)
+        B = audio_sequences.size(0)
+
+        input_dim_size = len(face_sequences.size())
+        if input_dim_size > 4:
+            audio_sequences = torch.cat([audio_sequences[:, i] for i in range(audio_sequences.size(1))], dim=0)
+            face_sequences = torch.cat([face_sequences[:, :, i] for i in range(face_sequences.size(2))], dim=0)
+
+        audio_embedding = self.audio_encoder(audio_sequences) # B, 512, 1, 1
+
+        feats = self.encode_face(face_sequences)
+
+        x = self.decode(audio_embedding, feats)
 
         if input_dim_size > 4:
             x = torch.split(x, B, dim=0) # [(B, C, H, W)]
@@ -0,0 +1,157 @@
+"""Packed training data.
+
+``pack_dataset`` turns a preprocessed dataset (``<root>/<dir>/<vid>/{0,1,..}.jpg``
+face crops plus ``audio.wav``) into four files that the trainers memory-map
+instead of decoding JPEGs and recomputing mels for every sample:
+
+    faces.bin   uint8   (num_frames, img_size, img_size, 3)  resized face crops
+    valid.bin   uint8   (num_frames,)                        1 where a face was detected
+    mels.bin    float32 (num_mel_frames, num_mels)           mel-spectrograms (time major)
+    index.json  per-video offsets into the arrays above
+
+Frames of a video are stored at their frame id, frames without a detected face
+(no jpg) are left blank and flagged in ``valid.bin``.
+"""
+import json, os
+from glob import glob
+
+import cv2
+import numpy as np
+
+import audio
+from hparams import hparams
+
+INDEX_NAME = 'index.json'
+
+
+def pack_dataset(preprocessed_root, packed_dir, img_size=None, verbose=True):
+    """Packs every ``<preprocessed_root>/*/*`` video directory that has an
+    audio.wav. Returns the number of videos packed."""
+    img_size = img_size or hparams.img_size
+    os.makedirs(packed_dir, exist_ok=True)
+
+    video_dirs = sorted(d for d in glob(os.path.join(preprocessed_root, '*', '*'))
+                        if os.path.isfile(os.path.join(d, 'audio.wav')))
+    if verbose:
+        from tqdm import tqdm
+        video_dirs = tqdm(video_dirs, desc='Packing')
+
+    videos = {}
+    num_frames = num_mel_frames = 0
+    with open(os.path.join(packed_dir, 'faces.bin'), 'wb') as faces_f, \
+            open(os.path.join(packed_dir, 'valid.bin'), 'wb') as valid_f, \
+            open(os.path.join(packed_dir, 'mels.bin'), 'wb') as mels_f:
+        for video_dir in video_dirs:
+            frame_ids = sorted(int(os.path.basename(f).split('.')[0])
+                               for f in glob(os.path.join(video_dir, '*.jpg')))
+            if len(frame_ids) == 0:
+                continue
+            mel = np.ascontiguousarray(audio.melspectrogram(
+                audio.load_wav(os.path.join(video_dir, 'audio.wav'), hparams.sample_rate)).T, dtype=np.float32)
+
+            count = frame_ids[-1] + 1
+            faces = np.zeros((count, img_size, img_size, 3), dtype=np.uint8)
+            valid = np.zeros(count, dtype=np.uint8)
+            for frame_id in frame_ids:
+                img = cv2.imread(os.path.join(video_dir, '{}.jpg'.format(frame_id)))
+                if img is None or img.size == 0:
+                    continue
+                faces[frame_id] = cv2.resize(img, (img_size, img_size))
+                valid[frame_id] = 1
+
+            faces_f.write(faces.tobytes())
+            valid_f.write(valid.tobytes())
+            mels_f.write(mel.tobytes())
+
+            name = os.path.relpath(video_dir, preprocessed_root).replace(os.sep, '/')
+            videos[name] = {
+                'frame_offset': num_frames, 'num_frames': count,
+                'mel_offset': num_mel_frames, 'num_mel_frames': len(mel),
+            }
+            num_frames += count
+            num_mel_frames += len(mel)
+
+    index = {
+        'img_size': img_size, 'num_mels': hparams.num_mels,
+        'num_frames': num_frames, 'num_mel_frames': num_mel_frames,
+        'videos': videos,
+    }
+    # the index is written last, a packed dir without one is incomplete
+    with open(os.path.join(packed_dir, INDEX_NAME), 'w') as f:
+        json.dump(index, f)
+    return len(videos)
+
+
+class PackedVideos(object):
+    """Read side of ``pack_dataset``. Videos are addressed by the directory
+    path used in the trainers (``<data_root>/<dir>/<vid>``) and frames by id.
+    The arrays are opened lazily, once per process: the trainers read the
+    frame lists in the main process, and each DataLoader worker then maps
+    its own arrays on its first ``__getitem__`` instead of using the
+    parent's (inherited through fork, or dropped when pickled for spawn)."""
+
+    def __init__(self, packed_dir, data_root):
+        self.packed_dir = packed_dir
+        self.data_root = data_root
+        with open(os.path.join(packed_dir, INDEX_NAME)) as f:
+            self.index = json.load(f)
+        if self.index['img_size'] != hparams.img_size:
+            raise ValueError('{} holds {}px faces, hparams.img_size is {}'.format(
+                packed_dir, self.index['img_size'], hparams.img_size))
+        self._arrays = None
+        self._pid = None
+
+    def __getstate__(self):
+        return dict(self.__dict__, _arrays=None, _pid=None)
+
+    @property
+    def arrays(self):
+        if self._arrays is None or self._pid != os.getpid():
+            size, num_frames = self.index['img_size'], self.index['num_frames']
+            path = lambda name: os.path.join(self.packed_dir, name)
+            self._arrays = (
+                np.memmap(path('faces.bin'), dtype=np.uint8, mode='r', shape=(num_frames, size, size, 3)),
+                np.memmap(path('valid.bin'), dtype=np.uint8, mode='r', shape=(num_frames,)),
+                np.memmap(path('mels.bin'), dtype=np.float32, mode='r',
+                          shape=(self.index['num_mel_frames'], self.index['num_mels'])),
+            )
+            self._pid = os.getpid()
+        return self._arrays
+
+    def video(self, vidname):
+        name = os.path.relpath(vidname, self.data_root).replace(os.sep, '/')
+        return self.index['videos'].get(name)
+
+    def frame_names(self, vidname):
+        """Same as globbing ``<vidname>/*.jpg`` in the unpacked dataset."""
+        video = self.video(vidname)
+        if video is None:
+            return []
+        start = video['frame_offset']
+        valid = self.arrays[1][start:start + video['num_frames']]
+        return [os.path.join(vidname, '{}.jpg'.format(i)) for i in np.flatnonzero(valid)]
+
+    def has_frame(self, vidname, frame_id):
+        video = self.video(vidname)
+        if video is None or not 0 <= frame_id < video['num_frames']:
+            return False
+        return bool(self.arrays[1][video['frame_offset'] + frame_id])
+
+    def read_frames(self, vidname, start_id, count):
+        """``count`` consecutive face crops starting at ``start_id``, or None
+        if any of them is missing."""
+        video = self.video(vidname)
+        if video is None or start_id < 0 or start_id + count > video['num_frames']:
+            return None
+        start = video['frame_offset'] + start_id
+        if not self.arrays[1][start:start + count].all():
+            return None
+        return np.array(self.arrays[0][start:start + count])
+
+    def mel(self, vidname):
+        """(num_mel_frames, num_mels) mel-spectrogram, as ``audio.melspectrogram(wav).T``."""
+        video = self.video(vidname)
+        if video is None:
+            raise KeyError('{} is not in {}'.format(vidname, self.packed_dir))
+        start = video['mel_offset']
+        return self.arrays[2][start:start + video['num_mel_frames']]
@@ -0,0 +1,126 @@
+"""Threaded stages for the streaming lip-sync path (`--pipeline` in inference.py).
+
+Each stage is a generator running in its own thread; its items are handed to
+the next stage through a bounded queue, so decoding, face detection, batching,
+Wav2Lip and encoding overlap and the wall time tends to the slowest stage
+instead of the sum of all of them. Threads are enough here: OpenCV, PyTorch
+and the pipe to ffmpeg all release the GIL while they work.
+
+Per stage, `busy` is the time spent producing items, not counting the time
+spent waiting for the stage before it, so the slowest stage is the one with
+the largest busy time.
+"""
+import queue, threading, time
+from collections import OrderedDict
+
+_local = threading.local()
+_DONE = object()
+
+class StageError(object):
+	"""Carries an exception raised in a stage to the thread consuming it."""
+	def __init__(self, error):
+		self.error = error
+
+def _waited(seconds):
+	_local.waited = getattr(_local, 'waited', 0.) + seconds
+
+class Pipeline(object):
+	"""Threaded stages sharing one stop flag and one set of timings. Call
+	close() once the last stage has been consumed (or abandoned). `stages`
+	only sets the order in which the timings are reported."""
+	def __init__(self, stages=()):
+		self.stats = OrderedDict((name, {'busy': 0., 'items': 0}) for name in stages)
+		self.stop = threading.Event()
+		self.threads = []
+		self.start = time.time()
+
+	def add(self, name, seconds, items=1):
+		"""Accounts work done outside of a threaded stage (e.g. on the main thread)."""
+		stats = self.stats.setdefault(name, {'busy': 0., 'items': 0})
+		stats['busy'] += seconds
+		stats['items'] += items
+
+	def stage(self, name, source, maxsize=1):
+		"""Iterates `source` in a new thread and returns a generator over its
+		items, of which at most `maxsize` are queued. Exceptions raised by the
+		source are re-raised by the returned generator."""
+		items = queue.Queue(maxsize=max(1, maxsize))
+		self.stats.setdefault(name, {'busy': 0., 'items': 0})
+
+		def put(item):
+			while 1:
+				try:
+					items.put(item, timeout=.1)
+					return True
+				except queue.Full:
+					if self.stop.is_set():
+						return False
+
+		def get():
+			while 1:
+				try:
+					return items.get(timeout=.1)
+				except queue.Empty:
+					if self.stop.is_set():
+						return _DONE
+
+		def run():
+			source_iter = iter(source)
+			try:
+				while not self.stop.is_set():
+					_local.waited = 0.
+					start = time.time()
+					try:
+						item = next(source_iter)
+					except StopIteration:
+						break
+					self.add(name, time.time() - start - _local.waited)
+					if not put(item):
+						return
+				put(_DONE)
+			except BaseException as e:
+				put(StageError(e))
+			finally:
+				close = getattr(source_iter, 'close', None)
+				if close is not None:
+					close()
+
+		thread = threading.Thread(target=run, name='wav2lip-' + name, daemon=True)
+		self.threads.append(thread)
+		thread.start()
+
+		def consume():
+			while 1:
+				start = time.time()
+				item = get()
+				_waited(time.time() - start)
+				if item is _DONE:
+					return
+				if isinstance(item, StageError):
+					raise item.error
+				yield item
+
+		return consume()
+
+	def close(self):
+		"""Stops the stages that are still running (the consumer is done or gave
+		up early) and waits for their threads."""
+		self.stop.set()
+		for thread in self.threads:
+			thread.join()
+
+	def summary(self):
+		wall = time.time() - self.start
+		return {
+			'wall_seconds': wall,
+			'stages': OrderedDict((name, dict(stats, fps=stats['items'] / stats['busy'] if stats['busy'] > 0 else 0.))
+									for name, stats in self.stats.items()),
+		}
+
+	def report(self):
+		summary = self.summary()
+		print('{:<8} {:>8} {:>10} {:>10}'.format('stage', 'items', 'busy (s)', 'items/s'))
+		for name, stats in summary['stages'].items():
+			print('{:<8} {:>8} {:>10.2f} {:>10.1f}'.format(name, stats['items'], stats['busy'], stats['fps']))
+		print('Wall time: {:.2f}s'.format(summary['wall_seconds']))
+		return summary
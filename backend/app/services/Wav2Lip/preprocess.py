@@ -5,37 +5,42 @@ if sys.version_info[0] < 3 and sys.version_info[1] < 2:
 
 from os import listdir, path
 
-if not path.isfile('face_detection/detection/sfd/s3fd.pth'):
-	raise FileNotFoundError('Save the s3fd model to face_detection/detection/sfd/s3fd.pth \
-							before running this script!')
-
 import multiprocessing as mp
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import numpy as np
-import argparse, os, cv2, traceback, subprocess
+import argparse, os, cv2, traceback, subprocess, json
 from tqdm import tqdm
 from glob import glob
 import audio
 from hparams import hparams as hp
 
 import face_detection
+from packed_dataset import pack_dataset
 
 parser = argparse.ArgumentParser()
 
 parser.add_argument('--ngpu', help='Number of GPUs across which to run in parallel', default=1, type=int)
+parser.add_argument('--cpu', help='Run face detection on the CPU, in a pool of --workers processes', action='store_true')
+parser.add_argument('--workers', help='Number of CPU processes with --cpu (default: one per core)', default=None, type=int)
+parser.add_argument('--audio_workers', help='Number of concurrent ffmpeg audio extractions', default=4, type=int)
 parser.add_argument('--batch_size', help='Single GPU Face detection batch size', default=32, type=int)
-parser.add_argument("--data_root", help="Root folder of the LRS2 dataset", required=True)
+parser.add_argument("--data_root", help="Root folder of the LRS2 dataset. Can be omitted with --pack to only pack", default=None)
 parser.add_argument("--preprocessed_root", help="Root folder of the preprocessed dataset", required=True)
+parser.add_argument('--restart', help='Ignore the manifest of an earlier run and process every video again', 
+					action='store_true')
+parser.add_argument('--pack', help='Pack the preprocessed face crops and mels into memory-mappable arrays for training', 
+					action='store_true')
+parser.add_argument('--packed_dir', help='Output folder of --pack (default: <preprocessed_root>/packed)', default=None)
 
 args = parser.parse_args()
 
-fa = [face_detection.FaceAlignment(face_detection.LandmarksType._2D, flip_input=False, 
-									device='cuda:{}'.format(id)) for id in range(args.ngpu)]
+fa = []
 
 template = 'ffmpeg -loglevel panic -y -i {} -strict -2 {}'
 # template2 = 'ffmpeg -hide_banner -loglevel panic -threads 1 -y -i {} -async 1 -ac 1 -vn -acodec pcm_s16le -ar 16000 {}'
 
-def process_video_file(vfile, args, gpu_id):
+def read_batches(vfile, batch_size):
+	"""Decodes `vfile` batch_size frames at a time."""
 	video_stream = cv2.VideoCapture(vfile)
 	
 	frames = []
@@ -45,17 +50,23 @@ def process_video_file(vfile, args, gpu_id):
 			video_stream.release()
 			break
 		frames.append(frame)
-	
+		if len(frames) == batch_size:
+			yield frames
+			frames = []
+
+	if len(frames) > 0:
+		yield frames
+
+def process_video_file(vfile, args, gpu_id):
 	vidname = os.path.basename(vfile).split('.')[0]
 	dirname = vfile.split('/')[-2]
 
 	fulldir = path.join(args.preprocessed_root, dirname, vidname)
 	os.makedirs(fulldir, exist_ok=True)
 
-	batches = [frames[i:i + args.batch_size] for i in range(0, len(frames), args.batch_size)]
-
 	i = -1
-	for fb in batches:
+	faces = 0
+	for fb in read_batches(vfile, args.batch_size):
 		preds = fa[gpu_id].get_detections_for_batch(np.asarray(fb))
 
 		for j, f in enumerate(preds):
@@ -65,6 +76,9 @@ def process_video_file(vfile, args, gpu_id):
 
 			x1, y1, x2, y2 = f
 			cv2.imwrite(path.join(fulldir, '{}.jpg'.format(i)), fb[j][y1:y2, x1:x2])
+			faces += 1
+
+	return faces
 
 def process_audio_file(vfile, args):
 	vidname = os.path.basename(vfile).split('.')[0]
@@ -76,38 +90,124 @@ def process_audio_file(vfile, args):
 	wavpath = path.join(fulldir, 'audio.wav')
 
 	command = template.format(vfile, wavpath)
-	subprocess.call(command, shell=True)
+	if subprocess.call(command, shell=True) != 0 or not path.isfile(wavpath):
+		raise RuntimeError('Could not extract the audio of {}'.format(vfile))
+
+def init_cpu_worker(threads):
+	"""Process pool initializer of the --cpu mode: one detector per process."""
+	import torch
+	torch.set_num_threads(threads)
+	fa.append(face_detection.FaceAlignment(face_detection.LandmarksType._2D, flip_input=False, device='cpu'))
 
-	
 def mp_handler(job):
 	vfile, args, gpu_id = job
 	try:
-		process_video_file(vfile, args, gpu_id)
+		return process_video_file(vfile, args, gpu_id)
 	except KeyboardInterrupt:
 		exit(0)
 	except:
 		traceback.print_exc()
-		
-def main(args):
-	print('Started processing for {} with {} GPUs'.format(args.data_root, args.ngpu))
+		return None
 
-	filelist = glob(path.join(args.data_root, '*/*.mp4'))
+def audio_handler(vfile, args):
+	try:
+		process_audio_file(vfile, args)
+		return True
+	except KeyboardInterrupt:
+		exit(0)
+	except:
+		traceback.print_exc()
+		return False
+
+class Manifest(object):
+	"""Append-only record of the videos whose faces and audio are both done,
+	so that an interrupted run resumes where it stopped."""
+	def __init__(self, preprocessed_root, data_root, restart=False):
+		self.path = path.join(preprocessed_root, 'manifest.jsonl')
+		self.data_root = data_root
+		self.done = set()
+		if restart and path.isfile(self.path):
+			os.remove(self.path)
+		if path.isfile(self.path):
+			with open(self.path) as f:
+				lines = f.readlines()
+			valid = []
+			for line in lines:
+				try:
+					self.done.add(json.loads(line)['video'])
+					valid.append(line if line.endswith('\n') else line + '\n')
+				except ValueError:
+					continue # line cut short by an interruption
+			if valid != lines:
+				with open(self.path, 'w') as f:
+					f.writelines(valid)
+
+	def key(self, vfile):
+		return path.relpath(vfile, self.data_root)
+
+	def __contains__(self, vfile):
+		return self.key(vfile) in self.done
+
+	def add(self, vfile, faces):
+		with open(self.path, 'a') as f:
+			f.write(json.dumps({'video': self.key(vfile), 'faces': faces}) + '\n')
+		self.done.add(self.key(vfile))
 
-	jobs = [(vfile, args, i%args.ngpu) for i, vfile in enumerate(filelist)]
-	p = ThreadPoolExecutor(args.ngpu)
-	futures = [p.submit(mp_handler, j) for j in jobs]
-	_ = [r.result() for r in tqdm(as_completed(futures), total=len(futures))]
+def main(args):
+	if args.data_root is not None:
+		preprocess(args)
 
-	print('Dumping audios...')
+	if args.pack:
+		packed_dir = args.packed_dir or path.join(args.preprocessed_root, 'packed')
+		print('Packing {} into {}...'.format(args.preprocessed_root, packed_dir))
+		count = pack_dataset(args.preprocessed_root, packed_dir)
+		print('Packed {} videos'.format(count))
 
-	for vfile in tqdm(filelist):
-		try:
-			process_audio_file(vfile, args)
-		except KeyboardInterrupt:
-			exit(0)
-		except:
-			traceback.print_exc()
-			continue
+def preprocess(args):
+	if not path.isfile('face_detection/detection/sfd/s3fd.pth'):
+		raise FileNotFoundError('Save the s3fd model to face_detection/detection/sfd/s3fd.pth \
+								before running this script!')
+
+	manifest = Manifest(args.preprocessed_root, args.data_root, args.restart)
+	filelist = glob(path.join(args.data_root, '*/*.mp4'))
+	todo = [vfile for vfile in filelist if vfile not in manifest]
+	if len(todo) < len(filelist):
+		print('Resuming: {} of {} videos already done'.format(len(filelist) - len(todo), len(filelist)))
+
+	if args.cpu:
+		workers = args.workers or os.cpu_count()
+		print('Started processing for {} with {} CPU processes'.format(args.data_root, workers))
+		# spawn: forking while the audio threads run ffmpeg can deadlock the children
+		p = ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn'), initializer=init_cpu_worker,
+								initargs=(max(1, os.cpu_count() // workers),))
+		jobs = [(vfile, args, 0) for vfile in todo]
+	else:
+		fa.extend(face_detection.FaceAlignment(face_detection.LandmarksType._2D, flip_input=False, 
+												device='cuda:{}'.format(id)) for id in range(args.ngpu))
+		print('Started processing for {} with {} GPUs'.format(args.data_root, args.ngpu))
+		p = ThreadPoolExecutor(args.ngpu)
+		jobs = [(vfile, args, i%args.ngpu) for i, vfile in enumerate(todo)]
+
+	# ffmpeg audio extraction runs alongside face detection
+	audio_pool = ThreadPoolExecutor(args.audio_workers)
+	audio_futures = {vfile: audio_pool.submit(audio_handler, vfile, args) for vfile in todo}
+
+	futures = {p.submit(mp_handler, j): j[0] for j in jobs}
+	failed = 0
+	for future in tqdm(as_completed(futures), total=len(futures)):
+		vfile = futures[future]
+		faces = future.result()
+		if faces is not None and audio_futures[vfile].result():
+			manifest.add(vfile, faces)
+		else:
+			failed += 1
+
+	p.shutdown()
+	audio_pool.shutdown()
+	if failed > 0:
+		print('{} videos failed and will be retried on the next run'.format(failed))
 
 if __name__ == '__main__':
+	if args.data_root is None and not args.pack:
+		parser.error('Nothing to do: give --data_root and/or --pack')
 	main(args)
\ No newline at end of file
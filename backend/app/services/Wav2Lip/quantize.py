@@ -0,0 +1,135 @@
+"""Post-training static INT8 quantization of the Wav2Lip generator, for
+`--precision int8` in inference.py (PyTorch backend, CPU only).
+
+Every block of the encoders, the decoder and the output block is quantized on
+its own with FX graph mode (Conv + BatchNorm + ReLU fused, residual adds
+quantized); the skip connections are concatenated in float between blocks,
+so Wav2Lip.forward, encode_face and forward_cached keep working unchanged.
+
+Activation ranges come from a calibration run on a few sample clips:
+
+	python quantize.py --checkpoint_path checkpoints/wav2lip_gan.pth \
+		--faces a.mp4 b.mp4 --audios a.wav b.wav
+
+The observer state is written next to the checkpoint (<checkpoint>_int8_calibration.pth,
+or --calibration_path) and the model is quantized from it when loaded.
+Compare against fp32 with evaluation/compare_inference_modes.py --modes fp32 int8.
+"""
+import os, argparse, tempfile
+import numpy as np
+import torch
+from tqdm import tqdm
+
+parser = argparse.ArgumentParser(description='Calibrate the INT8 quantization of Wav2Lip on sample clips')
+parser.add_argument('--checkpoint_path', type=str, required=True)
+parser.add_argument('--faces', nargs='+', required=True, help='Sample videos/images')
+parser.add_argument('--audios', nargs='+', required=True, help='One audio file per face')
+parser.add_argument('--calibration_path', type=str, default=None,
+					help='Where to write the calibration (default: next to the checkpoint)')
+parser.add_argument('--max_batches', type=int, default=4, help='Calibration batches per clip')
+parser.add_argument('--batch_size', type=int, default=32)
+
+def default_calibration_path(checkpoint_path):
+	return os.path.splitext(checkpoint_path)[0] + '_int8_calibration.pth'
+
+def blocks(model):
+	"""(parent, key) of every separately quantized block."""
+	keys = [(model.face_encoder_blocks, i) for i in range(len(model.face_encoder_blocks))]
+	keys += [(model.face_decoder_blocks, i) for i in range(len(model.face_decoder_blocks))]
+	return keys + [(model, 'audio_encoder'), (model, 'output_block')]
+
+def get_block(parent, key):
+	return parent[key] if isinstance(key, int) else getattr(parent, key)
+
+def set_block(parent, key, block):
+	if isinstance(key, int):
+		parent[key] = block
+	else:
+		setattr(parent, key, block)
+
+def prepare(model):
+	"""Swaps every block of the (eval mode, CPU) model for an observed copy
+	ready for calibration."""
+	from torch.ao.quantization import get_default_qconfig_mapping
+	from torch.ao.quantization.quantize_fx import prepare_fx
+
+	# example inputs of each block, from a forward pass on a dummy sample
+	example_inputs, hooks = {}, []
+	for parent, key in blocks(model):
+		block = get_block(parent, key)
+		hooks.append(block.register_forward_pre_hook(
+			lambda block, inputs: example_inputs.setdefault(id(block), inputs)))
+	with torch.no_grad():
+		model(torch.zeros(1, 1, 80, 16), torch.zeros(1, 6, 96, 96))
+	for hook in hooks:
+		hook.remove()
+
+	qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+	for parent, key in blocks(model):
+		block = get_block(parent, key)
+		set_block(parent, key, prepare_fx(block, qconfig_mapping, example_inputs[id(block)]))
+	return model
+
+def convert(model):
+	from torch.ao.quantization.quantize_fx import convert_fx
+
+	for parent, key in blocks(model):
+		set_block(parent, key, convert_fx(get_block(parent, key)))
+	return model
+
+def observer_state(model):
+	return {k: v for k, v in model.state_dict().items() if 'activation_post_process' in k}
+
+def load_int8(model, calibration_path):
+	"""Quantizes a loaded fp32 model with the activation ranges saved by this script."""
+	if not os.path.isfile(calibration_path):
+		raise FileNotFoundError('No INT8 calibration at {}, run quantize.py first'.format(calibration_path))
+	calibration = torch.load(calibration_path, map_location='cpu')
+	torch.backends.quantized.engine = calibration['engine']
+
+	model = prepare(model.cpu().eval())
+	missing = set(observer_state(model)) - set(calibration['observers'])
+	if missing:
+		raise ValueError('INT8 calibration {} does not match the model ({} missing entries)'.format(
+							calibration_path, len(missing)))
+	model.load_state_dict(calibration['observers'], strict=False)
+	return convert(model).eval()
+
+def calibration_batches(face, audio_path, args, detector, max_batches):
+	"""The first `max_batches` model inputs inference.py would build for a clip."""
+	import inference
+
+	clip_args = inference.parse_args(['--checkpoint_path', args.checkpoint_path, '--face', face,
+										'--audio', audio_path, '--wav2lip_batch_size', str(args.batch_size)])
+	frames, fps = inference.read_frames(clip_args)
+	with tempfile.TemporaryDirectory(prefix='wav2lip_') as temp_dir:
+		wav_path = inference.prepare_audio(audio_path, temp_dir)
+		mel_chunks = inference.get_mel_chunks(wav_path, fps)
+		# spread the batches over the clip rather than taking its first seconds
+		step = max(1, len(mel_chunks) // (max_batches * args.batch_size))
+		mel_chunks = mel_chunks[::step][:max_batches * args.batch_size]
+		frames = frames[::step][:len(mel_chunks)]
+		for img_batch, mel_batch, _, _ in inference.datagen(frames, mel_chunks, clip_args, detector, temp_dir):
+			yield (torch.FloatTensor(np.transpose(mel_batch, (0, 3, 1, 2))),
+					torch.FloatTensor(np.transpose(img_batch, (0, 3, 1, 2))))
+
+def main(args):
+	import inference
+
+	if len(args.faces) != len(args.audios):
+		parser.error('Give one audio file per face')
+
+	model = prepare(inference.load_model(args.checkpoint_path, 'cpu'))
+	detector = inference.build_detector(inference.device)
+	with torch.no_grad():
+		for face, audio_path in zip(args.faces, args.audios):
+			for mel_batch, img_batch in tqdm(calibration_batches(face, audio_path, args, detector, args.max_batches),
+												total=args.max_batches, desc=os.path.basename(face)):
+				model(mel_batch, img_batch)
+
+	calibration_path = args.calibration_path or default_calibration_path(args.checkpoint_path)
+	torch.save({'engine': torch.backends.quantized.engine, 'observers': observer_state(model)}, calibration_path)
+	print('INT8 calibration saved to {}'.format(calibration_path))
+
+if __name__ == '__main__':
+	main(parser.parse_args())
@@ -0,0 +1,95 @@
+"""Window sampling shared by the trainers.
+
+``WindowIndex`` precomputes every ``(video, start frame)`` window whose frames
+all exist and whose mel crops fit in the audio, so that ``Dataset.__getitem__``
+can serve the index it is given instead of drawing until a draw happens to be
+valid. ``seed_worker`` gives every DataLoader worker its own ``random`` and
+``numpy`` seed (PyTorch only seeds its own generator per worker).
+"""
+import math, os, random, wave
+
+import numpy as np
+import torch
+
+import audio
+from hparams import hparams
+
+
+def mel_start(frame_id):
+    """First mel frame of the crop for ``frame_id`` (see crop_audio_window)."""
+    return int(80. * (frame_id / float(hparams.fps)))
+
+
+def num_mel_frames(wav_path):
+    """Number of mel frames audio.load_mel would return for ``wav_path``,
+    read from the wav header when possible. None if there is no audio."""
+    if not os.path.isfile(wav_path):
+        return None
+    try:
+        with wave.open(wav_path, 'rb') as f:
+            num_samples = int(math.ceil(f.getnframes() * hparams.sample_rate / float(f.getframerate())))
+        return 1 + num_samples // audio.get_hop_size()
+    except (wave.Error, EOFError):
+        return audio.load_mel(wav_path).shape[1]
+
+
+def seed_worker(worker_id):
+    seed = torch.initial_seed() % 2**32
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+class WindowIndex(object):
+    """All valid windows of ``T`` consecutive frames.
+
+    Args:
+        frame_ids: per video, the ids of the frames that have a face crop
+        mel_lengths: per video, the number of mel frames (None: no audio)
+        mel_offsets: frame offsets from the window start whose
+            ``mel_step_size`` long mel crop must lie inside the audio and
+            start at a non-negative frame
+        min_frames: skip videos with this many face crops or fewer
+
+    Windows are kept in two flat int arrays grouped by video, which keeps the
+    index small and cheap to share with forked DataLoader workers.
+    """
+
+    def __init__(self, frame_ids, mel_lengths, T, mel_offsets=(0,), mel_step_size=16, min_frames=0):
+        mel_offsets = list(mel_offsets)
+        videos, starts, self.bounds = [], [], [0]
+        for video_idx, (ids, mel_length) in enumerate(zip(frame_ids, mel_lengths)):
+            valid = np.zeros(0, dtype=np.int64)
+            if len(ids) > min_frames and mel_length is not None:
+                present = np.zeros(max(ids) + 1, dtype=np.int64)
+                present[list(ids)] = 1
+                counts = np.concatenate([[0], np.cumsum(present)])
+                valid = np.flatnonzero(counts[T:] - counts[:-T] == T)
+
+                valid = valid[valid + min(mel_offsets) >= 0]
+                last = valid + max(mel_offsets)
+                valid = valid[(80. * (last / float(hparams.fps))).astype(np.int64) + mel_step_size <= mel_length]
+                if len(valid) < 2: # a wrong window has to differ from the right one
+                    valid = valid[:0]
+
+            videos.append(np.full(len(valid), video_idx, dtype=np.int32))
+            starts.append(valid.astype(np.int32))
+            self.bounds.append(self.bounds[-1] + len(valid))
+
+        self.videos = np.concatenate(videos) if videos else np.zeros(0, dtype=np.int32)
+        self.starts = np.concatenate(starts) if starts else np.zeros(0, dtype=np.int32)
+        self.bounds = np.asarray(self.bounds, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, idx):
+        return int(self.videos[idx]), int(self.starts[idx])
+
+    def random_start(self, video_idx, exclude=None):
+        """Start of another valid window of the same video, drawn with the
+        (worker-seeded) ``random`` module."""
+        lo, hi = self.bounds[video_idx], self.bounds[video_idx + 1]
+        while True:
+            start = int(self.starts[random.randrange(lo, hi)])
+            if start != exclude:
+                return start
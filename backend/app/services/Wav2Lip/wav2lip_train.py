@@ -16,6 +16,8 @@ from glob import glob
 
 import os, random, cv2, argparse
 from hparams import hparams, get_image_list
+from packed_dataset import PackedVideos
+from sampling import WindowIndex, num_mel_frames, seed_worker
 
 parser = argparse.ArgumentParser(description='Code to train the Wav2Lip model without the visual quality discriminator')
 
@@ -25,6 +27,8 @@ parser.add_argument('--checkpoint_dir', help='Save checkpoints to this directory
 parser.add_argument('--syncnet_checkpoint_path', help='Load the pre-trained Expert discriminator', required=True, type=str)
 
 parser.add_argument('--checkpoint_path', help='Resume from this checkpoint', default=None, type=str)
+parser.add_argument('--cache_mels', help='Store computed mel-spectrograms as .npy files next to each audio.wav', action='store_true')
+parser.add_argument('--packed_dir', help='Read faces and mels from this packed dataset (preprocess.py --pack) instead of data_root', default=None, type=str)
 
 args = parser.parse_args()
 
@@ -40,6 +44,11 @@ syncnet_mel_step_size = 16
 class Dataset(object):
     def __init__(self, split):
         self.all_videos = get_image_list(args.data_root, split)
+        self.packed = PackedVideos(args.packed_dir, args.data_root) if args.packed_dir else None
+        self.windows = WindowIndex([[self.get_frame_id(f) for f in self.list_frames(vidname)] for vidname in self.all_videos],
+                                   [self.mel_length(vidname) for vidname in self.all_videos],
+                                   syncnet_T, mel_offsets=range(-1, syncnet_T - 1), # get_segmented_mels
+                                   mel_step_size=syncnet_mel_step_size, min_frames=3 * syncnet_T)
 
     def get_frame_id(self, frame):
         return int(basename(frame).split('.')[0])
@@ -51,13 +60,33 @@ class Dataset(object):
         window_fnames = []
         for frame_id in range(start_id, start_id + syncnet_T):
             frame = join(vidname, '{}.jpg'.format(frame_id))
-            if not isfile(frame):
+            exists = self.packed.has_frame(vidname, frame_id) if self.packed is not None else isfile(frame)
+            if not exists:
                 return None
             window_fnames.append(frame)
         return window_fnames
 
+    def list_frames(self, vidname):
+        if self.packed is not None:
+            return self.packed.frame_names(vidname)
+        return list(glob(join(vidname, '*.jpg')))
+
+    def mel_length(self, vidname):
+        if self.packed is not None:
+            video = self.packed.video(vidname)
+            return None if video is None else video['num_mel_frames']
+        return num_mel_frames(join(vidname, "audio.wav"))
+
+    def load_mel(self, vidname):
+        if self.packed is not None:
+            return self.packed.mel(vidname)
+        return audio.load_mel(join(vidname, "audio.wav"), disk=args.cache_mels).T
+
     def read_window(self, window_fnames):
         if window_fnames is None: return None
+        if self.packed is not None:
+            return self.packed.read_frames(dirname(window_fnames[0]), self.get_frame_id(window_fnames[0]),
+                                           len(window_fnames))
         window = []
         for fname in window_fnames:
             img = cv2.imread(fname)
@@ -106,62 +135,60 @@ class Dataset(object):
         return x
 
     def __len__(self):
-        return len(self.all_videos)
+        return len(self.windows)
 
     def __getitem__(self, idx):
-        while 1:
-            idx = random.randint(0, len(self.all_videos) - 1)
-            vidname = self.all_videos[idx]
-            img_names = list(glob(join(vidname, '*.jpg')))
-            if len(img_names) <= 3 * syncnet_T:
-                continue
-            
-            img_name = random.choice(img_names)
-            wrong_img_name = random.choice(img_names)
-            while wrong_img_name == img_name:
-                wrong_img_name = random.choice(img_names)
-
-            window_fnames = self.get_window(img_name)
-            wrong_window_fnames = self.get_window(wrong_img_name)
-            if window_fnames is None or wrong_window_fnames is None:
-                continue
-
-            window = self.read_window(window_fnames)
-            if window is None:
-                continue
-
-            wrong_window = self.read_window(wrong_window_fnames)
-            if wrong_window is None:
-                continue
-
-            try:
-                wavpath = join(vidname, "audio.wav")
-                wav = audio.load_wav(wavpath, hparams.sample_rate)
-
-                orig_mel = audio.melspectrogram(wav).T
-            except Exception as e:
-                continue
-
-            mel = self.crop_audio_window(orig_mel.copy(), img_name)
-            
-            if (mel.shape[0] != syncnet_mel_step_size):
-                continue
+        # a window that fails to load (e.g. a corrupt jpg) falls through to the next one
+        for attempt in range(len(self.windows)):
+            sample = self.get_sample((idx + attempt) % len(self.windows))
+            if sample is not None:
+                return sample
+        raise RuntimeError('None of the {} windows could be loaded'.format(len(self.windows)))
+
+    def get_sample(self, idx):
+        video_idx, start_id = self.windows[idx]
+        vidname = self.all_videos[video_idx]
+        img_name = join(vidname, '{}.jpg'.format(start_id))
+        wrong_img_name = join(vidname, '{}.jpg'.format(self.windows.random_start(video_idx, exclude=start_id)))
+
+        window_fnames = self.get_window(img_name)
+        wrong_window_fnames = self.get_window(wrong_img_name)
+        if window_fnames is None or wrong_window_fnames is None:
+            return None
+
+        window = self.read_window(window_fnames)
+        if window is None:
+            return None
+
+        wrong_window = self.read_window(wrong_window_fnames)
+        if wrong_window is None:
+            return None
+
+        try:
+            orig_mel = self.load_mel(vidname)
+        except Exception as e:
+            return None
+
+        mel = self.crop_audio_window(orig_mel.copy(), img_name)
+        
+        if (mel.shape[0] != syncnet_mel_step_size):
+            return None
 
-            indiv_mels = self.get_segmented_mels(orig_mel.copy(), img_name)
-            if indiv_mels is None: continue
+        indiv_mels = self.get_segmented_mels(orig_mel.copy(), img_name)
+        if indiv_mels is None: return None
 
-            window = self.prepare_window(window)
-            y = window.copy()
-            window[:, :, window.shape[2]//2:] = 0.
+        window = self.prepare_window(window)
+        y = window.copy()
+        window[:, :, window.shape[2]//2:] = 0.
 
-            wrong_window = self.prepare_window(wrong_window)
-            x = np.concatenate([window, wrong_window], axis=0)
+        wrong_window = self.prepare_window(wrong_window)
+        x = np.concatenate([window, wrong_window], axis=0)
 
-            x = torch.FloatTensor(x)
-            mel = torch.FloatTensor(mel.T).unsqueeze(0)
-            indiv_mels = torch.FloatTensor(indiv_mels).unsqueeze(1)
-            y = torch.FloatTensor(y)
-            return x, indiv_mels, mel, y
+        x = torch.FloatTensor(x)
+        mel = torch.FloatTensor(mel.T).unsqueeze(0)
+        indiv_mels = torch.FloatTensor(indiv_mels).unsqueeze(1)
+        y = torch.FloatTensor(y)
+        return x, indiv_mels, mel, y
 
 def save_sample_images(x, g, gt, global_step, checkpoint_dir):
     x = (x.detach().cpu().numpy().transpose(0, 2, 3, 4, 1) * 255.).astype(np.uint8)
@@ -344,11 +371,13 @@ if __name__ == "__main__":
 
     train_data_loader = data_utils.DataLoader(
         train_dataset, batch_size=hparams.batch_size, shuffle=True,
-        num_workers=hparams.num_workers)
+        num_workers=hparams.num_workers,
+        worker_init_fn=seed_worker)
 
     test_data_loader = data_utils.DataLoader(
-        test_dataset, batch_size=hparams.batch_size,
-        num_workers=4)
+        test_dataset, batch_size=hparams.batch_size, shuffle=True,
+        num_workers=4,
+        worker_init_fn=seed_worker)
 
     device = torch.device("cuda" if use_cuda else "cpu")
 
@@ -0,0 +1,281 @@
+"""
+Stockage de l'état des jobs (statut, progression, logs) partagé par les
+workers de l'API.
+
+RedisJobStore garde chaque job dans un hash Redis plus une liste pour ses
+logs : tous les workers uvicorn derrière le load balancer voient le même
+état, et un redémarrage ne perd rien. MemoryJobStore les garde dans le
+process (tests, dev local sans Redis). Dans les deux, un job expire
+JOB_TTL_SECONDS après sa dernière mise à jour et seules les JOB_MAX_LOGS
+dernières lignes de logs sont gardées : la mémoire reste stable.
+
+Chaque mise à jour incrémente la `version` du job, et `log_count` compte
+toutes les lignes de logs jamais ajoutées : le flux de progression
+(/jobs/{id}/events) surveille la version et ne relit que les lignes après son
+curseur quand quelque chose a changé. `log_base` est le compte au début de la
+liste de logs courante (voir update).
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+
+
+def _new_lines(logs: List[str], stored: int) -> Tuple[List[str], bool]:
+    """
+    Les lignes à ajouter quand un callback renvoie la liste complète des logs
+    (dont `stored` lignes sont déjà enregistrées) : la suite de la liste si
+    elle prolonge l'actuelle, sinon toute la liste, qui la remplace (reset=True).
+    """
+    if len(logs) >= stored:
+        return list(logs[stored:]), False
+    return list(logs), True
+
+
+class JobStore:
+    """Interface commune aux deux backends."""
+
+    def __init__(self, ttl_seconds: int, max_logs: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_logs = max_logs
+
+    def create(self, job_id: str, job: dict) -> None:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Le job avec ses logs, None s'il est inconnu ou expiré."""
+        raise NotImplementedError
+
+    def update(self, job_id: str, **fields) -> None:
+        """
+        Met à jour les champs donnés. `logs` est la liste complète des logs du
+        job : seules les lignes après celles déjà enregistrées sont ajoutées,
+        et une liste plus courte remplace l'ancienne. Sans effet sur un job
+        inconnu ou expiré (on ne crée pas de job incomplet).
+        """
+        raise NotImplementedError
+
+    def get_version(self, job_id: str) -> Optional[int]:
+        """Change à chaque update ; None si le job est inconnu ou expiré."""
+        raise NotImplementedError
+
+    def get_changes(self, job_id: str, log_cursor: int) -> Optional[dict]:
+        """Le job avec seulement les lignes de logs numérotées à partir de
+        `log_cursor` (parmi celles gardées) ; `log_count` est le curseur
+        suivant."""
+        raise NotImplementedError
+
+    def delete(self, job_id: str) -> None:
+        raise NotImplementedError
+
+
+class MemoryJobStore(JobStore):
+    def __init__(self, ttl_seconds: int, max_logs: int):
+        super().__init__(ttl_seconds, max_logs)
+        # job_id -> (expires_at, job), du moins récemment mis à jour au plus récent
+        self.jobs: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _purge(self):
+        now = time.time()
+        while self.jobs:
+            job_id, (expires_at, _) = next(iter(self.jobs.items()))
+            if expires_at > now:
+                break
+            del self.jobs[job_id]
+
+    def _job(self, job_id: str) -> Optional[dict]:
+        self._purge()
+        return self.jobs[job_id][1] if job_id in self.jobs else None
+
+    def _put(self, job_id: str, job: dict):
+        self.jobs[job_id] = (time.time() + self.ttl_seconds, job)
+        self.jobs.move_to_end(job_id)
+        self._purge()
+
+    def create(self, job_id: str, job: dict) -> None:
+        logs = list(job.get("logs", []))
+        with self.lock:
+            self._put(job_id, dict(job, logs=logs[-self.max_logs:], log_count=len(logs), log_base=0, version=1))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.lock:
+            job = self._job(job_id)
+            return dict(job, logs=list(job["logs"])) if job is not None else None
+
+    def update(self, job_id: str, **fields) -> None:
+        logs = fields.pop("logs", None)
+        with self.lock:
+            job = self._job(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            if logs is not None:
+                new, reset = _new_lines(logs, job["log_count"] - job["log_base"])
+                if reset:
+                    job["logs"], job["log_base"] = [], job["log_count"]
+                job["logs"] = (job["logs"] + new)[-self.max_logs:]
+                job["log_count"] += len(new)
+            job["version"] += 1
+            self._put(job_id, job)
+
+    def get_version(self, job_id: str) -> Optional[int]:
+        with self.lock:
+            job = self._job(job_id)
+            return job["version"] if job is not None else None
+
+    def get_changes(self, job_id: str, log_cursor: int) -> Optional[dict]:
+        with self.lock:
+            job = self._job(job_id)
+            if job is None:
+                return None
+            first = job["log_count"] - len(job["logs"])
+            return dict(job, logs=job["logs"][max(log_cursor - first, 0):])
+
+    def delete(self, job_id: str) -> None:
+        with self.lock:
+            self.jobs.pop(job_id, None)
+
+
+class RedisJobStore(JobStore):
+    """
+    Un hash par job (valeurs encodées en JSON) et une liste pour ses logs.
+    Les champs sont écrits avec HSET, donc deux workers qui mettent à jour
+    des champs différents du même job ne s'écrasent pas.
+    """
+
+    def __init__(self, client, ttl_seconds: int, max_logs: int, prefix: str = "multiforge:job:"):
+        super().__init__(ttl_seconds, max_logs)
+        self.client = client
+        self.prefix = prefix
+
+    def _keys(self, job_id: str):
+        key = self.prefix + job_id
+        return key, key + ":logs"
+
+    def _write(self, job_id: str, fields: Dict, new_logs: List[str], reset: bool, version: Optional[int] = None):
+        pipe = self.client.pipeline(transaction=True)
+        self._queue_write(pipe, job_id, fields, new_logs, reset, version)
+        pipe.execute()
+
+    def _queue_write(self, pipe, job_id: str, fields: Dict, new_logs: List[str], reset: bool,
+                     version: Optional[int] = None):
+        key, logs_key = self._keys(job_id)
+        if fields:
+            pipe.hset(key, mapping={k: json.dumps(v) for k, v in fields.items()})
+        if reset:
+            pipe.delete(logs_key)
+        if new_logs:
+            pipe.rpush(logs_key, *new_logs[-self.max_logs:])
+            pipe.ltrim(logs_key, -self.max_logs, -1)
+        if version is None:
+            pipe.hincrby(key, "version", 1)
+        else:
+            pipe.hset(key, "version", version)
+        pipe.expire(key, self.ttl_seconds)
+        pipe.expire(logs_key, self.ttl_seconds)
+
+    def _decode(self, fields: dict, logs: list) -> dict:
+        job = {_text(k): json.loads(v) for k, v in fields.items()}
+        job["logs"] = [_text(line) for line in logs]
+        return job
+
+    def create(self, job_id: str, job: dict) -> None:
+        fields = dict(job)
+        logs = list(fields.pop("logs", []))
+        fields["log_count"], fields["log_base"] = len(logs), 0
+        self._write(job_id, fields, logs, reset=True, version=1)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        key, logs_key = self._keys(job_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hgetall(key)
+        pipe.lrange(logs_key, 0, -1)
+        fields, logs = pipe.execute()
+        return self._decode(fields, logs) if fields else None
+
+    def update(self, job_id: str, **fields) -> None:
+        # log_count / log_base sont relus sous WATCH : si un autre update les
+        # change avant le EXEC, la transaction échoue et on recommence, sans
+        # perdre ni dupliquer de lignes
+        from redis.exceptions import WatchError
+
+        logs = fields.pop("logs", None)
+        key = self._keys(job_id)[0]
+        with self.client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    if not pipe.exists(key):
+                        pipe.unwatch()
+                        return
+                    values, new, reset = dict(fields), [], False
+                    if logs is not None:
+                        log_count, log_base = [int(v or 0) for v in pipe.hmget(key, "log_count", "log_base")]
+                        new, reset = _new_lines(logs, log_count - log_base)
+                        if reset:
+                            values["log_base"] = log_count
+                        values["log_count"] = log_count + len(new)
+                    pipe.multi()
+                    self._queue_write(pipe, job_id, values, new, reset)
+                    pipe.execute()
+                    return
+                except WatchError:
+                    continue
+
+    def get_version(self, job_id: str) -> Optional[int]:
+        version = self.client.hget(self._keys(job_id)[0], "version")
+        return int(version) if version is not None else None
+
+    def get_changes(self, job_id: str, log_cursor: int) -> Optional[dict]:
+        # le hash et la liste dans la même transaction : un update() entre les
+        # deux lectures décalerait log_count par rapport à la liste
+        key, logs_key = self._keys(job_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hgetall(key)
+        pipe.lrange(logs_key, 0, -1)
+        fields, logs = pipe.execute()
+        if not fields:
+            return None
+        job = self._decode(fields, logs)
+        first = job.get("log_count", 0) - len(logs)
+        job["logs"] = job["logs"][max(log_cursor - first, 0):]
+        return job
+
+    def delete(self, job_id: str) -> None:
+        self.client.delete(*self._keys(job_id))
+
+
+def _text(value) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+_job_store: Optional[JobStore] = None
+
+
+def get_job_store() -> JobStore:
+    """
+    Le store configuré par JOB_STORE ("redis" ou "memory"). Si Redis n'est pas
+    joignable, on retombe sur la mémoire (l'état n'est alors pas partagé
+    entre les workers).
+    """
+    global _job_store
+    if _job_store is not None:
+        return _job_store
+
+    ttl, max_logs = settings.JOB_TTL_SECONDS, settings.JOB_MAX_LOGS
+    if settings.JOB_STORE == "redis":
+        try:
+            import redis
+            client = redis.Redis.from_url(settings.REDIS_URL)
+            client.ping()
+            _job_store = RedisJobStore(client, ttl, max_logs)
+            print(f"🗄️ Jobs stockés dans Redis ({settings.REDIS_URL})")
+        except Exception as e:
+            print(f"⚠️ Redis indisponible ({e}), jobs stockés en mémoire")
+    if _job_store is None:
+        _job_store = MemoryJobStore(ttl, max_logs)
+    return _job_store
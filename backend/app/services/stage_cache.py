@@ -0,0 +1,86 @@
+"""
+Cache of pipeline stage results, keyed by a hash of the stage inputs (see
+app/workers/stage_graph.py).
+
+Same backends as the job store: Redis when JOB_STORE=redis (shared by all the
+workers, so a job retried on another worker still finds its stages), memory
+otherwise. Entries expire STAGE_CACHE_TTL_SECONDS after they were written.
+"""
+import json
+import threading
+import time
+from typing import Optional
+
+from app.config import settings
+
+
+class StageCache:
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: dict) -> None:
+        raise NotImplementedError
+
+
+class MemoryStageCache(StageCache):
+    def __init__(self, ttl_seconds: int):
+        super().__init__(ttl_seconds)
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self.entries[key]
+                return None
+            return json.loads(entry[1])
+
+    def set(self, key: str, value: dict) -> None:
+        with self.lock:
+            now = time.time()
+            for k in [k for k, (expires_at, _) in self.entries.items() if expires_at <= now]:
+                del self.entries[k]
+            self.entries[key] = (now + self.ttl_seconds, json.dumps(value))
+
+
+class RedisStageCache(StageCache):
+    def __init__(self, client, ttl_seconds: int, prefix: str = "multiforge:stage:"):
+        super().__init__(ttl_seconds)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[dict]:
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: dict) -> None:
+        self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl_seconds)
+
+
+_stage_cache: Optional[StageCache] = None
+
+
+def get_stage_cache() -> StageCache:
+    """Le cache configuré par JOB_STORE, comme get_job_store."""
+    global _stage_cache
+    if _stage_cache is not None:
+        return _stage_cache
+
+    ttl = settings.STAGE_CACHE_TTL_SECONDS
+    if settings.JOB_STORE == "redis":
+        try:
+            import redis
+            client = redis.Redis.from_url(settings.REDIS_URL)
+            client.ping()
+            _stage_cache = RedisStageCache(client, ttl)
+        except Exception as e:
+            print(f"⚠️ Redis indisponible ({e}), cache des étapes en mémoire")
+    if _stage_cache is None:
+        _stage_cache = MemoryStageCache(ttl)
+    return _stage_cache
@@ -2,6 +2,7 @@
 Storage utilities for uploading files to Supabase Storage
 """
 import os
+from app.config import settings
 from app.services.db_client import supabase_client
 import uuid
 
@@ -95,3 +96,56 @@ def upload_image_to_storage(image_url: str, filename: str = None) -> str:
     except Exception as e:
         print(f"Error uploading image to storage: {e}")
         return None
+
+
+def upload_video_to_storage(video_path: str, filename: str = None) -> str:
+    """
+    Upload a local video file to Supabase Storage and return public URL.
+    
+    Args:
+        video_path: Path of the video file
+        filename: Optional filename (will generate UUID if not provided)
+        
+    Returns:
+        Public URL of uploaded video file
+    """
+    try:
+        if not filename:
+            filename = f"{uuid.uuid4()}.mp4"
+        
+        bucket_name = "videos"
+        
+        try:
+            supabase_client.storage.create_bucket(bucket_name, {"public": True})
+        except:
+            pass
+        
+        with open(video_path, "rb") as f:
+            supabase_client.storage.from_(bucket_name).upload(
+                filename,
+                f.read(),
+                {"content-type": "video/mp4"}
+            )
+        
+        return supabase_client.storage.from_(bucket_name).get_public_url(filename)
+        
+    except Exception as e:
+        print(f"Error uploading video to storage: {e}")
+        return None
+
+
+def stored_file_exists(url) -> bool:
+    """
+    True if `url` is a public Supabase Storage URL that still answers.
+    Only such URLs are kept in the stage cache (see job_pipeline.STAGES):
+    bytes and files of one worker's disk are not valid on another.
+    """
+    if not isinstance(url, str) or not settings.SUPABASE_URL:
+        return False
+    if not url.startswith(f"{settings.SUPABASE_URL.rstrip('/')}/storage/"):
+        return False
+    try:
+        import requests
+        return requests.head(url, timeout=10, allow_redirects=True).ok
+    except Exception:
+        return False
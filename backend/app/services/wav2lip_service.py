@@ -3,12 +3,234 @@ Wav2Lip Service - Simplified version using modern libraries
 Based on https://github.com/Rudrabha/Wav2Lip
 """
 import os
+import sys
+import time
+import importlib
+import threading
+import tempfile
 import cv2
 import numpy as np
 import torch
-from typing import Optional
-import subprocess
-import tempfile
+from typing import List, Optional, Tuple
+
+from app.config import settings
+
+
+WAV2LIP_PATH = os.path.join(os.path.dirname(__file__), 'Wav2Lip')
+
+
+def _import_inference():
+    """
+    Import the Wav2Lip inference module in-process.
+    The Wav2Lip code uses top-level imports (models, audio, face_detection),
+    so its folder has to be on sys.path.
+    """
+    if WAV2LIP_PATH not in sys.path:
+        sys.path.insert(0, WAV2LIP_PATH)
+    return importlib.import_module('inference')
+
+
+class Wav2LipEngine:
+    """
+    Long-lived Wav2Lip runtime.
+    Loads the generator checkpoint and the S3FD face detector once per
+    worker process, then reuses them for every lip-sync request.
+    With backend='torchscript' or 'onnx', both run from the graphs written by
+    Wav2Lip/export.py (export_dir defaults to exported/ next to the checkpoint).
+    precision='int8' quantizes the generator at load time with the calibration
+    written by Wav2Lip/quantize.py (torch backend on CPU only).
+    With autotune=True, the Wav2Lip batch size is tuned for the host at load
+    time and the face detection batch size per frame resolution (both cached).
+    Calls return their own stats, so one engine can serve concurrent requests.
+
+    The options in LOAD_OPTIONS select the weights and runtime, and are
+    fixed when the engine is created: overriding them in a call raises a
+    ValueError. det_face_res / det_min_res may change per call; the call
+    then gets a detector front-end sharing the loaded S3FD network.
+    """
+
+    LOAD_OPTIONS = ('checkpoint_path', 'backend', 'export_dir', 'precision', 'calibration_path')
+
+    def __init__(
+        self,
+        checkpoint_path: str,
+        device: Optional[str] = None,
+        backend: str = 'torch',
+        export_dir: Optional[str] = None,
+        precision: str = 'fp32',
+        autotune: bool = False
+    ):
+        self.checkpoint_path = checkpoint_path
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.backend = backend
+        self.export_dir = export_dir
+        self.precision = precision
+        self.autotune = autotune
+        self.model = None
+        self.detector = None
+        self.load_seconds = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.model is not None
+
+    def load(self) -> "Wav2LipEngine":
+        """Load model + detector (no-op if already loaded)."""
+        with self._lock:
+            if self.loaded:
+                return self
+
+            inference = _import_inference()
+            start = time.time()
+            args = self.options('', '')
+            self.model = inference.load_model(
+                self.checkpoint_path, self.device, args.backend, args.export_dir,
+                args.precision, args.calibration_path
+            )
+            self.detector = inference.build_detector(self.device, args.det_face_res, args.det_min_res,
+                                                     args.backend, args.export_dir)
+            if self.autotune:
+                inference.tune_batch_sizes(self.model, None, None, self.options('', ''))
+            self.load_seconds = time.time() - start
+            print(f"✅ Wav2Lip engine loaded in {self.load_seconds:.1f}s ({self.device}, {self.backend}, {self.precision})")
+        return self
+
+    def options(self, face_path: str, audio_path: str, **overrides):
+        """
+        Build an inference options namespace with the same defaults as the
+        inference.py CLI, plus keyword overrides (e.g. pads=[0, 20, 0, 0]).
+        """
+        fixed = [key for key in self.LOAD_OPTIONS if key in overrides]
+        if fixed:
+            raise ValueError(f"{', '.join(fixed)}: fixed when the engine is created, use another Wav2LipEngine")
+        inference = _import_inference()
+        argv = [
+            '--checkpoint_path', self.checkpoint_path,
+            '--face', face_path,
+            '--audio', audio_path,
+            '--backend', self.backend,
+            '--precision', self.precision,
+        ]
+        if self.export_dir:
+            argv += ['--export_dir', self.export_dir]
+        args = inference.parse_args(argv)
+        for key, value in overrides.items():
+            setattr(args, key, value)
+        return args
+
+    def __call__(
+        self,
+        frames: List[np.ndarray],
+        audio_path: str,
+        output_path: str,
+        fps: float = 25.,
+        **options
+    ) -> Tuple[str, dict]:
+        """
+        Lip-sync already decoded BGR frames to an audio file.
+
+        Args:
+            frames: List of BGR frames (a single frame for a still avatar)
+            audio_path: Path to audio file (any format ffmpeg can read)
+            output_path: Path for the output video
+            fps: Frame rate of the output video
+            **options: Overrides of the inference.py CLI options
+
+        Returns:
+            Path to the generated video, and the run stats (frames, seconds, fps)
+        """
+        options.setdefault('static', len(frames) == 1)
+        args = self.options('', audio_path, fps=fps, outfile=output_path, **options)
+        self._autotune(args, frames[0], options)
+
+        def render(inference, mel_chunks, wav_path, temp_dir):
+            return inference.lipsync(
+                frames, fps, mel_chunks, self.model, args, wav_path, output_path,
+                detector=self._detector(args), temp_dir=temp_dir
+            )
+
+        return output_path, self._execute(render, audio_path, fps)
+
+    def run(self, face_path: str, audio_path: str, output_path: str, **options) -> Tuple[str, dict]:
+        """
+        Lip-sync an image/video file to an audio file; returns the output path
+        and the run stats, as __call__.
+        With stream=True, video frames are decoded and processed in rolling
+        batches instead of being loaded all at once. pipeline=True also runs
+        the stages concurrently; their timings go to stats['stages'].
+        """
+        inference = _import_inference()
+        args = self.options(face_path, audio_path, outfile=output_path, **options)
+
+        if (args.stream or args.pipeline) and not args.static:
+            fps = inference.read_fps(args)
+            self._autotune(args, next(inference.iter_frames(args)), options)
+            pipeline = inference.Pipeline(inference.PIPELINE_STAGES) if args.pipeline else None
+
+            def render(inference, mel_chunks, wav_path, temp_dir):
+                return inference.lipsync_stream(
+                    fps, mel_chunks, self.model, args, wav_path, output_path,
+                    detector=self._detector(args), temp_dir=temp_dir, pipeline=pipeline
+                )
+
+            stats = self._execute(render, audio_path, fps)
+            if pipeline is not None:
+                stats['stages'] = pipeline.summary()['stages']
+            return output_path, stats
+
+        frames, fps = inference.read_frames(args)
+        options.pop('fps', None)
+        options.setdefault('static', args.static)
+        return self(frames, audio_path, output_path, fps=fps, **options)
+
+    def _detector(self, args):
+        """
+        The loaded detector, or, when the call overrides det_face_res /
+        det_min_res, a front-end with those values on the same network.
+        """
+        detector = self.detector
+        if (args.det_face_res, args.det_min_res) == (detector.detection_face_res, detector.min_detection_res):
+            return detector
+        return detector.with_resolution(args.det_face_res, args.det_min_res)
+
+    def _autotune(self, args, frame: np.ndarray, overrides: dict):
+        """
+        Tuned batch sizes for this host and for the detection resolution of
+        `frame` (the first frame of the request), unless the caller gave them
+        explicitly.
+        """
+        if not self.autotune:
+            return
+        inference = _import_inference()
+        self.load()
+
+        detector = self._detector(args) if args.box[0] == -1 and not args.static else None
+        inference.tune_batch_sizes(self.model, detector, frame, args)
+        for key in ('wav2lip_batch_size', 'face_det_batch_size'):
+            if key in overrides:
+                setattr(args, key, overrides[key])
+
+    def _execute(self, render, audio_path: str, fps: float) -> dict:
+        """
+        Shared mel extraction, per-call temp dir and timing around a render.
+        Returns the stats of the run.
+        """
+        inference = _import_inference()
+        self.load()
+
+        with tempfile.TemporaryDirectory(prefix='wav2lip_') as temp_dir:
+            start = time.time()
+            wav_path = inference.prepare_audio(audio_path, temp_dir)
+            mel_chunks = inference.get_mel_chunks(wav_path, fps)
+            written = render(inference, mel_chunks, wav_path, temp_dir)
+            elapsed = time.time() - start
+
+        return {
+            'frames': written,
+            'seconds': elapsed,
+            'fps': written / elapsed if elapsed > 0 else 0.,
+        }
 
 
 class Wav2LipService:
@@ -19,12 +241,30 @@ class Wav2LipService:
     
     def __init__(self):
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.wav2lip_path = os.path.join(os.path.dirname(__file__), 'Wav2Lip')
+        self.wav2lip_path = WAV2LIP_PATH
         self.checkpoint_path = os.path.join(self.wav2lip_path, 'checkpoints', 'wav2lip_gan.pth')
+        self.engine = Wav2LipEngine(
+            self.checkpoint_path, self.device,
+            backend=settings.WAV2LIP_BACKEND,
+            export_dir=settings.WAV2LIP_EXPORT_DIR or None,
+            precision=settings.WAV2LIP_PRECISION,
+            autotune=settings.WAV2LIP_AUTOTUNE
+        )
         
-        print(f"Wav2Lip device: {self.device}")
+        print(f"Wav2Lip device: {self.device} (backend: {settings.WAV2LIP_BACKEND})")
         print(f"Wav2Lip path: {self.wav2lip_path}")
     
+    def warmup(self) -> bool:
+        """
+        Load the model and face detector ahead of the first request.
+        """
+        try:
+            self.engine.load()
+            return True
+        except Exception as e:
+            print(f"❌ Wav2Lip warmup failed: {e}")
+            return False
+    
     def create_talking_video(
         self,
         image_path: str,
@@ -51,31 +291,21 @@ class Wav2LipService:
             print(f"   Audio: {audio_path}")
             print(f"   Output: {output_path}")
             
-            # Use Wav2Lip inference script
-            cmd = [
-                'python',
-                os.path.join(self.wav2lip_path, 'inference.py'),
-                '--checkpoint_path', self.checkpoint_path,
-                '--face', image_path,
-                '--audio', audio_path,
-                '--outfile', output_path,
-                '--resize_factor', '1',
-                '--fps', '25'
-            ]
-            
-            # Run Wav2Lip
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 minutes max
+            # Run Wav2Lip in-process (model + detector stay loaded)
+            _, stats = self.engine.run(
+                image_path,
+                audio_path,
+                output_path,
+                resize_factor=1,
+                fps=25.
             )
             
-            if result.returncode == 0 and os.path.exists(output_path):
-                print(f"✅ Wav2Lip video generated: {output_path}")
+            if os.path.exists(output_path):
+                print(f"✅ Wav2Lip video generated: {output_path} "
+                      f"({stats.get('frames', 0)} frames, {stats.get('fps', 0):.1f} fps)")
                 return output_path
             else:
-                print(f"❌ Wav2Lip failed: {result.stderr}")
+                print(f"❌ Wav2Lip failed: no output written")
                 return None
                 
         except Exception as e:
@@ -1,6 +1,7 @@
-from celery import Celery, current_task
+from celery import Celery, chain
+from celery.signals import worker_process_init
 from app.config import settings
-from app.workers.job_pipeline import run_pipeline
+from app.services.job_store import get_job_store
 import time
 
 # Configuration de Celery
@@ -10,22 +11,45 @@ celery_app = Celery(
     backend=settings.REDIS_URL
 )
 
+# Deux queues : "light" pour les étapes qui attendent des API (script, TTS,
+# avatar, visuels), "heavy" pour le rendu (montage, lip-sync). Un worker par
+# queue, chacun avec sa concurrence :
+#   celery -A app.workers.celery_worker.celery_app worker -Q light -c 8
+#   WAV2LIP_WARMUP=true celery -A app.workers.celery_worker.celery_app worker -Q heavy -c 1
 celery_app.conf.update(
     task_serializer="json",
     accept_content=["json"],
     result_serializer="json",
     timezone="UTC",
     enable_utc=True,
+    task_track_started=True,
+    # Un rendu de plusieurs minutes : on ne réserve pas de tâches d'avance,
+    # et une tâche n'est acquittée qu'une fois finie (relancée si le worker meurt)
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    worker_concurrency=settings.CELERY_CONCURRENCY or None,
+    result_expires=settings.JOB_TTL_SECONDS,
+    task_default_queue=settings.CELERY_LIGHT_QUEUE,
+    task_routes={
+        "app.workers.celery_worker.prepare_video_job": {"queue": settings.CELERY_LIGHT_QUEUE},
+        "app.workers.celery_worker.render_video_job": {"queue": settings.CELERY_HEAVY_QUEUE},
+        "app.workers.celery_worker.process_video_job": {"queue": settings.CELERY_HEAVY_QUEUE},
+    },
 )
 
-@celery_app.task(bind=True)
-def process_video_job(self, request_data: dict):
-    """
-    Wrapper de tâche Celery qui appelle le pipeline métier.
-    Met à jour l'état pour le frontend.
-    """
+@worker_process_init.connect
+def _warmup_wav2lip(**kwargs):
+    """Charge Wav2Lip (modèle + détecteur) au démarrage de chaque process du
+    worker plutôt qu'au premier rendu."""
+    if settings.WAV2LIP_WARMUP:
+        from app.services.wav2lip_service import wav2lip_service
+        wav2lip_service.warmup()
+
+def _progress_callback(task, job_id=None):
+    """Met à jour l'état Celery de la tâche et, pour un job de l'API, le job
+    store (qui alimente le flux /jobs/{job_id}/events)."""
     def update_progress(progress, step, logs):
-        self.update_state(
+        task.update_state(
             state='PROGRESS',
             meta={
                 'progress': progress,
@@ -33,11 +57,116 @@ def process_video_job(self, request_data: dict):
                 'logs': logs
             }
         )
+        if job_id:
+            get_job_store().update(
+                job_id,
+                progress=progress,
+                current_step=step,
+                logs=logs,
+                status="PROCESSING"
+            )
+    return update_progress
+
+def _job_failed(job_id, e):
+    if job_id:
+        get_job_store().update(job_id, status="FAILED", logs=[f"Erreur: {str(e)}"])
+
+@celery_app.task(bind=True)
+def process_video_job(self, request_data: dict):
+    """
+    Wrapper de tâche Celery qui appelle le pipeline métier.
+    Met à jour l'état pour le frontend.
+    """
+    from app.workers.job_pipeline import run_pipeline
 
     # Lancement du pipeline
     try:
-        result = run_pipeline(request_data, update_progress)
+        result = run_pipeline(request_data, _progress_callback(self))
         return result
     except Exception as e:
         # En prod, logger l'erreur ici
-        raise e
\ No newline at end of file
+        raise e
+
+@celery_app.task(bind=True)
+def prepare_video_job(self, request_data: dict, job_id: str = None):
+    """Étapes légères du pipeline (queue light)."""
+    from app.workers.job_pipeline import prepare_video
+    try:
+        return prepare_video(request_data, _progress_callback(self, job_id), job_id)
+    except Exception as e:
+        _job_failed(job_id, e)
+        raise
+
+@celery_app.task(bind=True)
+def render_video_job(self, state: dict, job_id: str = None):
+    """Étapes lourdes du pipeline (queue heavy), à partir de prepare_video_job."""
+    from app.workers.job_pipeline import render_video
+    try:
+        result = render_video(state, _progress_callback(self, job_id))
+    except Exception as e:
+        _job_failed(job_id, e)
+        raise
+    if job_id:
+        get_job_store().update(
+            job_id,
+            status="COMPLETED",
+            progress=100,
+            current_step="Terminé",
+            result_video_url=result.get("result_video_url"),
+            script_text=result.get("script_text"),
+            logs=result.get("logs", [])
+        )
+    return result
+
+def _task_ids(job_id: str, attempt: int):
+    return f"{job_id}:{attempt}:prepare", f"{job_id}:{attempt}:render"
+
+def enqueue_video_job(job_id: str, request_data: dict, attempt: int = 1):
+    """Enchaîne prepare (light) puis render (heavy) ; les ids des tâches
+    dérivent du job_id et de la tentative (un retry a ses propres tâches),
+    get_job_state les retrouve sans rien stocker de plus."""
+    prepare_id, render_id = _task_ids(job_id, attempt)
+    chain(
+        prepare_video_job.s(request_data, job_id).set(task_id=prepare_id),
+        render_video_job.s(job_id).set(task_id=render_id)
+    ).apply_async()
+
+def get_job_state(job_id: str, attempt: int = 1) -> dict:
+    """
+    Champs de JobStatus d'après l'état Celery des deux tâches du job ;
+    vide tant que rien n'a démarré (le job reste PENDING).
+    """
+    prepare, render = [celery_app.AsyncResult(task_id) for task_id in _task_ids(job_id, attempt)]
+
+    for result in (prepare, render):
+        if result.state == 'FAILURE':
+            return {
+                "status": "FAILED",
+                "logs": [f"Erreur: {str(result.info)}"]
+            }
+
+    if render.state == 'SUCCESS':
+        result = render.result
+        return {
+            "status": "COMPLETED",
+            "progress": 100,
+            "current_step": "Terminé",
+            "result_video_url": result.get("result_video_url"),
+            "script_text": result.get("script_text"),
+            "logs": result.get("logs", [])
+        }
+    if render.state in ('STARTED', 'PROGRESS', 'RETRY'):
+        meta = render.info if isinstance(render.info, dict) else {}
+        return dict(meta, status="PROCESSING")
+    if prepare.state == 'SUCCESS':
+        state = prepare.result
+        return {
+            "status": "PROCESSING",
+            "current_step": "En attente du rendu...",
+            "script_text": state["values"].get("script"),
+            "logs": state.get("logs", [])
+        }
+    if prepare.state in ('STARTED', 'PROGRESS', 'RETRY'):
+        meta = prepare.info if isinstance(prepare.info, dict) else {}
+        return dict(meta, status="PROCESSING")
+    return {}
@@ -4,9 +4,12 @@ import requests
 import os
 import json
 import re
+from concurrent.futures import ThreadPoolExecutor
 from app.config import settings
 from app.services.video_editor import combine_audio_video
 from app.services.db_client import supabase_client
+from app.services.storage_utils import stored_file_exists
+from app.workers.stage_graph import Stage, run_stages, encode, decode
 
 def clean_script_for_tts(script_text):
     """
@@ -30,249 +33,300 @@ MOCK_VIDEO_URL = "https://commondatastorage.googleapis.com/gtv-videos-bucket/sam
 DEFAULT_VOICE_ID = "pNInz6obpgDQGcFmaJgB" 
 DEFAULT_MUSIC = "https://cdn.pixabay.com/download/audio/2022/05/27/audio_1808fbf07a.mp3"
 
-def run_pipeline(data: dict, progress_callback):
-    """
-    Pipeline FACELESS avec Persistance DB (Supabase)
-    """
-    mock_mode = settings.MOCK_MODE
-    logs = []
-    
-    topic = data.get('topic', 'No Topic')
-    user_script = data.get('script')
-    visual_style = data.get('visual_style', 'cinematic')
-    user_id = data.get('user_id') # <--- On récupère l'ID utilisateur
-    
-    logs.append(f"🚀 Démarrage Job (Mock={mock_mode}, User={user_id})")
-
-    # --- Étape 1 : Script ---
-    script = ""
+# --- Étapes ---
+# Chaque étape reçoit ses entrées par nom (champs de la requête ou sorties
+# des étapes précédentes) et ajoute ses messages à `logs` ; voir stage_graph.py.
+# L'audio et la vidéo passent d'une étape à l'autre (et de la queue light à
+# la queue heavy) par leur URL dans le stockage Supabase, pas en octets.
+
+def is_url(value):
+    return isinstance(value, str) and value.startswith(("http://", "https://"))
+
+def audio_bytes(audio):
+    """Les octets de l'audio, qu'il soit déjà en mémoire ou dans le stockage."""
+    if not is_url(audio):
+        return audio
+    res = requests.get(audio, timeout=60)
+    res.raise_for_status()
+    return res.content
+
+def generate_script(logs, topic, user_script, mock_mode):
     if user_script:
         logs.append("📝 Script fourni.")
-        script = user_script
-        progress_callback(10, "Validation...", logs)
-    else:
-        logs.append(f"🧠 Génération Script IA sur : {topic}")
-        progress_callback(5, "Rédaction IA...", logs)
-        if mock_mode:
-            time.sleep(1)
-            script = f"Ceci est un script de test sur {topic}."
-        else:
-            try:
-                openai_url = "https://api.openai.com/v1/chat/completions"
-                headers = {"Authorization": f"Bearer {settings.OPENAI_API_KEY}"}
-                payload = {
-                    "model": "gpt-4-turbo-preview",
-                    "messages": [
-                        {"role": "system", "content": "You are a viral scriptwriter for TikTok. Write a 3-part script (Hook, Body, CTA) about the given topic. Keep it under 60 seconds spoken. Return ONLY the text, no markdown headers."},
-                        {"role": "user", "content": topic}
-                    ]
-                }
-                res = requests.post(openai_url, json=payload, headers=headers)
-                if res.status_code == 200:
-                    script = res.json()['choices'][0]['message']['content']
-                    logs.append("✅ Script GPT-4 OK.")
-                else:
-                    raise Exception(f"OpenAI: {res.text}")
-            except Exception as e:
-                logs.append(f"❌ Err Script: {e}")
-                script = f"Script fallback {topic}"
-
-    # --- Étape 2 : Director Mode ---
+        return user_script
+
+    logs.append(f"🧠 Génération Script IA sur : {topic}")
+    if mock_mode:
+        time.sleep(1)
+        return f"Ceci est un script de test sur {topic}."
+
+    openai_url = "https://api.openai.com/v1/chat/completions"
+    headers = {"Authorization": f"Bearer {settings.OPENAI_API_KEY}"}
+    payload = {
+        "model": "gpt-4-turbo-preview",
+        "messages": [
+            {"role": "system", "content": "You are a viral scriptwriter for TikTok. Write a 3-part script (Hook, Body, CTA) about the given topic. Keep it under 60 seconds spoken. Return ONLY the text, no markdown headers."},
+            {"role": "user", "content": topic}
+        ]
+    }
+    res = requests.post(openai_url, json=payload, headers=headers)
+    if res.status_code != 200:
+        raise Exception(f"OpenAI: {res.text}")
+    logs.append("✅ Script GPT-4 OK.")
+    return res.json()['choices'][0]['message']['content']
+
+def extract_keywords(logs, topic, script, visual_style, mock_mode):
     logs.append(f"🎬 Director Mode ({visual_style})...")
-    progress_callback(20, "Analyse Visuelle...", logs)
     keywords = [str(topic).split()[0]]
-    if not mock_mode:
-        try:
-            openai_url = "https://api.openai.com/v1/chat/completions"
-            headers = {"Authorization": f"Bearer {settings.OPENAI_API_KEY}"}
-            payload = {
-                "model": "gpt-4-turbo-preview",
-                "messages": [
-                    {"role": "system", "content": "You are a video director. Extract 3 CONCRETE, VISUAL search terms from this script for stock footage. Focus on emotions, actions, or objects that can be filmed. Avoid abstract concepts. Return ONLY the terms separated by commas, in English."},
-                    {"role": "user", "content": f"Script: {script}\nStyle: {visual_style}"}
-                ]
-            }
-            res = requests.post(openai_url, json=payload, headers=headers)
-            if res.status_code == 200:
-                keywords = [k.strip() for k in res.json()['choices'][0]['message']['content'].split(',')]
-                logs.append(f"🧠 Mots-clés IA: {keywords}")
-        except Exception as e:
-            import traceback
-            logs.append(f"⚠️ Fallback Director: {e}")
-            logs.append(f"DEBUG Traceback: {traceback.format_exc()}")
-
-    # --- Étape 3 : Audio (TTS) ---
+    if mock_mode:
+        return keywords
+
+    openai_url = "https://api.openai.com/v1/chat/completions"
+    headers = {"Authorization": f"Bearer {settings.OPENAI_API_KEY}"}
+    payload = {
+        "model": "gpt-4-turbo-preview",
+        "messages": [
+            {"role": "system", "content": "You are a video director. Extract 3 CONCRETE, VISUAL search terms from this script for stock footage. Focus on emotions, actions, or objects that can be filmed. Avoid abstract concepts. Return ONLY the terms separated by commas, in English."},
+            {"role": "user", "content": f"Script: {script}\nStyle: {visual_style}"}
+        ]
+    }
+    res = requests.post(openai_url, json=payload, headers=headers)
+    if res.status_code == 200:
+        keywords = [k.strip() for k in res.json()['choices'][0]['message']['content'].split(',')]
+        logs.append(f"🧠 Mots-clés IA: {keywords}")
+    return keywords
+
+def synthesize_audio(logs, topic, script, voice_id, mock_mode):
     logs.append("🎙️ Audio (ElevenLabs)...")
-    progress_callback(40, "Synthèse Vocale...", logs)
-    audio_bytes = None
-    if not mock_mode:
-        try:
-            # Extract voice script from complex prompt
-            from app.services.script_extractor import extract_voice_script
-            voice_script = extract_voice_script(data.get('topic', script))
-            logs.append(f"🧠 Script extrait: {len(voice_script)} caractères")
-            
-            tts_text = clean_script_for_tts(voice_script) # Nettoyage !
-            url = f"https://api.elevenlabs.io/v1/text-to-speech/{data.get('voice_id', DEFAULT_VOICE_ID)}"
-            headers = {"xi-api-key": settings.ELEVENLABS_API_KEY, "Content-Type": "application/json"}
-            payload = {
-                "text": tts_text, 
-                "model_id": "eleven_multilingual_v2",
-                "voice_settings": {"stability": 0.5, "similarity_boost": 0.5}
-            }
-            res = requests.post(url, json=payload, headers=headers)
-            if res.status_code == 200:
-                audio_bytes = res.content
-                logs.append("✅ Audio OK.")
-            else:
-                 raise Exception(f"ElevenLabs: {res.text}")
-        except Exception as e:
-             logs.append(f"❌ Err Audio: {e}")
-
-    # --- Étape 3.5 : Avatar Parlant (D-ID) ---
-    talking_avatar_url = None
-    if not mock_mode and audio_bytes:
-        try:
-            logs.append("🎭 Génération avatar parlant...")
-            progress_callback(50, "Avatar parlant (D-ID)...", logs)
-            
-            # Import D-ID client
-            from app.services.did_client import did_client
-            from app.services.avatar_generator import avatar_generator
-            from app.services.script_extractor import extract_avatar_description
-            import tempfile
-            import os
-            
-            # Check if user provided an avatar image
-            avatar_image_url = data.get('avatar_image')
-            
-            if not avatar_image_url:
-                # Extract avatar description from prompt
-                avatar_desc = extract_avatar_description(data.get('topic', ''))
-                
-                if avatar_desc:
-                    # Generate avatar with DALL-E 3
-                    logs.append(f"🎨 Génération avatar: {avatar_desc[:50]}...")
-                    avatar_image_url = avatar_generator.generate_avatar(avatar_desc)
-                    
-                    if avatar_image_url:
-                        logs.append("✅ Avatar généré avec DALL-E 3")
-            
-            # If we have an avatar image and audio, create talking video
-            if avatar_image_url and audio_bytes:
-                # Upload audio to Supabase Storage to get public URL
-                from app.services.storage_utils import upload_audio_to_storage
-                
-                logs.append("📤 Upload audio vers Supabase...")
-                public_audio_url = upload_audio_to_storage(audio_bytes)
-                
-                if public_audio_url:
-                    logs.append("✅ Audio uploadé")
-                    
-                    # Create talking avatar with D-ID
-                    logs.append("🎭 Création avatar parlant avec D-ID...")
-                    talking_avatar_url = did_client.create_talking_avatar(
-                        image_url=avatar_image_url,
-                        audio_url=public_audio_url,
-                        timeout=120
-                    )
-                    
-                    if talking_avatar_url:
-                        logs.append("✅ Avatar parlant créé avec D-ID !")
-                        # Use talking avatar as first video clip
-                        found_videos.insert(0, talking_avatar_url)
-                    else:
-                        logs.append("⚠️ D-ID indisponible, utilise visuels standards")
-                else:
-                    logs.append("⚠️ Upload audio échoué, utilise visuels standards")
-            
-        except Exception as e:
-            logs.append(f"⚠️ Avatar parlant ignoré: {e}")
-            import traceback
-            print(f"D-ID error: {traceback.format_exc()}")
-
-    # --- Étape 4 : Visuels (Hybride: Pexels + Runway) ---
+    if mock_mode:
+        return None
+
+    # Extract voice script from complex prompt
+    from app.services.script_extractor import extract_voice_script
+    voice_script = extract_voice_script(topic or script)
+    logs.append(f"🧠 Script extrait: {len(voice_script)} caractères")
+
+    tts_text = clean_script_for_tts(voice_script) # Nettoyage !
+    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+    headers = {"xi-api-key": settings.ELEVENLABS_API_KEY, "Content-Type": "application/json"}
+    payload = {
+        "text": tts_text, 
+        "model_id": "eleven_multilingual_v2",
+        "voice_settings": {"stability": 0.5, "similarity_boost": 0.5}
+    }
+    res = requests.post(url, json=payload, headers=headers)
+    if res.status_code != 200:
+        raise Exception(f"ElevenLabs: {res.text}")
+    logs.append("✅ Audio OK.")
+
+    from app.services.storage_utils import upload_audio_to_storage
+    public_audio_url = upload_audio_to_storage(res.content)
+    if not public_audio_url:
+        # sans stockage, l'audio suit en octets (et n'est pas mis en cache)
+        logs.append("⚠️ Upload audio échoué, audio non partagé")
+        return res.content
+    return public_audio_url
+
+def create_talking_avatar(logs, audio, topic, avatar_image, mock_mode):
+    if mock_mode or not audio:
+        return None
+
+    logs.append("🎭 Génération avatar parlant...")
+    from app.services.did_client import did_client
+    from app.services.avatar_generator import avatar_generator
+    from app.services.script_extractor import extract_avatar_description
+
+    # Check if user provided an avatar image
+    avatar_image_url = avatar_image
+    if not avatar_image_url:
+        # Extract avatar description from prompt
+        avatar_desc = extract_avatar_description(topic)
+        if avatar_desc:
+            # Generate avatar with DALL-E 3
+            logs.append(f"🎨 Génération avatar: {avatar_desc[:50]}...")
+            avatar_image_url = avatar_generator.generate_avatar(avatar_desc)
+            if avatar_image_url:
+                logs.append("✅ Avatar généré avec DALL-E 3")
+
+    if not avatar_image_url:
+        return None
+
+    # D-ID needs a public URL for the audio
+    public_audio_url = audio if is_url(audio) else None
+    if not public_audio_url:
+        logs.append("⚠️ Audio absent du stockage, utilise visuels standards")
+        return None
+
+    # Create talking avatar with D-ID
+    logs.append("🎭 Création avatar parlant avec D-ID...")
+    talking_avatar_url = did_client.create_talking_avatar(
+        image_url=avatar_image_url,
+        audio_url=public_audio_url,
+        timeout=120
+    )
+    if talking_avatar_url:
+        logs.append("✅ Avatar parlant créé avec D-ID !")
+    else:
+        logs.append("⚠️ D-ID indisponible, utilise visuels standards")
+    return talking_avatar_url
+
+def acquire_visuals(logs, script, mock_mode):
     logs.append("🖼️ Acquisition Visuels (Hybride)...")
-    progress_callback(60, "Acquisition Visuels...", logs)
     found_videos = []
-    
-    if not mock_mode:
-        try:
-            # Import hybrid router
-            from app.services.video_source_router import video_router
-            
-            # Classify scenes with GPT-4
-            scenes = video_router.classify_scenes(script)
-            logs.append(f"🧠 {len(scenes)} scènes classifiées")
-            
-            # Estimate cost
-            estimated_cost = video_router.estimate_cost(scenes)
-            if estimated_cost > 0:
-                logs.append(f"💰 Coût estimé Runway: ${estimated_cost:.2f}")
-            
-            # Get videos for each scene
-            for i, scene in enumerate(scenes[:3]):  # Max 3 scenes for now
-                scene_text = scene.get("text", "")
-                source = scene.get("source", "stock")
-                
-                logs.append(f"🎬 Scène {i+1}: {scene_text[:40]}... ({source})")
-                
-                video_url = video_router.get_video(scene)
-                if video_url:
-                    found_videos.append(video_url)
-                    logs.append(f"✅ Vidéo {i+1} acquise")
-                else:
-                    logs.append(f"⚠️ Échec scène {i+1}")
-            
-        except Exception as e:
-            logs.append(f"❌ Err Visuels: {e}")
-            import traceback
-            print(f"Video acquisition error: {traceback.format_exc()}")
-
-    # --- Étape 5 : Montage ---
+    if mock_mode:
+        return found_videos
+
+    # Import hybrid router
+    from app.services.video_source_router import video_router
+
+    # Classify scenes with GPT-4
+    scenes = video_router.classify_scenes(script)
+    logs.append(f"🧠 {len(scenes)} scènes classifiées")
+
+    # Estimate cost
+    estimated_cost = video_router.estimate_cost(scenes)
+    if estimated_cost > 0:
+        logs.append(f"💰 Coût estimé Runway: ${estimated_cost:.2f}")
+
+    scenes = scenes[:3]  # Max 3 scenes for now
+    for i, scene in enumerate(scenes):
+        scene_text = scene.get("text", "")
+        source = scene.get("source", "stock")
+        logs.append(f"🎬 Scène {i+1}: {scene_text[:40]}... ({source})")
+
+    # Get videos for each scene, in parallel (Runway generations take minutes)
+    def get_video(scene):
+        start = time.time()
+        return video_router.get_video(scene), time.time() - start
+
+    with ThreadPoolExecutor(max_workers=max(len(scenes), 1), thread_name_prefix="scene") as pool:
+        videos = list(pool.map(get_video, scenes))
+
+    for i, (video_url, seconds) in enumerate(videos):
+        if video_url:
+            found_videos.append(video_url)
+            logs.append(f"✅ Vidéo {i+1} acquise ({seconds:.1f}s)")
+        else:
+            logs.append(f"⚠️ Échec scène {i+1}")
+    return found_videos
+
+def render_montage(logs, avatar, visuals, audio, script, mock_mode):
     logs.append("🎞️ Montage & Mixage...")
-    progress_callback(80, "Rendu final...", logs)
-    final_video = MOCK_VIDEO_URL
-    
-    try:
-        vid_src = found_videos[0] if found_videos else MOCK_VIDEO_URL
-        if not mock_mode:
-            if audio_bytes:
-                # TOUJOURS générer avec sous-titres
-                final_video = combine_audio_video(vid_src, audio_bytes, clean_script_for_tts(script), DEFAULT_MUSIC)
-                logs.append(f"✅ Vidéo Générée: {final_video}")
-            else:
-                final_video = vid_src 
-    except Exception as e:
-        logs.append(f"❌ Err Montage: {e}")
-
-    # --- Étape 6 : Persistance (Supabase) ---
-    if supabase_client and user_id:
-        logs.append("💾 Sauvegarde DB...")
-        try:
-            project_data = {
-                "name": topic,
-                "description": script[:100] + "...",
-                "status": "completed",
-                "user_id": user_id,
-                "settings": {
-                    "video_url": final_video,
-                    "script": script,
-                    "style": visual_style,
-                    "keywords": keywords
-                }
-            }
-            supabase_client.table("projects").insert(project_data).execute()
-            logs.append("✅ Projet sauvegardé dans le Dashboard !")
-        except Exception as e:
-             logs.append(f"⚠️ Erreur Sauvegarde: {e}")
-    elif not user_id:
+    if mock_mode:
+        return MOCK_VIDEO_URL
+
+    # L'avatar parlant, s'il existe, ouvre la vidéo
+    videos = ([avatar] if avatar else []) + visuals
+    vid_src = videos[0] if videos else MOCK_VIDEO_URL
+    if not audio:
+        return vid_src
+
+    # TOUJOURS générer avec sous-titres
+    final_video = combine_audio_video(vid_src, audio_bytes(audio), clean_script_for_tts(script), DEFAULT_MUSIC)
+    logs.append(f"✅ Vidéo Générée: {final_video}")
+
+    # La vidéo est dans static/ de ce worker : on la publie dans le stockage
+    from app.services.storage_utils import upload_video_to_storage
+    public_video_url = upload_video_to_storage(os.path.join("static", os.path.basename(final_video)))
+    if not public_video_url:
+        logs.append("⚠️ Upload vidéo échoué, vidéo servie par ce serveur")
+        return final_video
+    logs.append("✅ Vidéo uploadée")
+    return public_video_url
+
+def save_project(logs, user_id, topic, script, visual_style, keywords, montage):
+    if not user_id:
         logs.append("⚠️ Pas d'User ID, pas de sauvegarde.")
+        return None
+    if not supabase_client:
+        return None
+
+    logs.append("💾 Sauvegarde DB...")
+    project_data = {
+        "name": topic,
+        "description": script[:100] + "...",
+        "status": "completed",
+        "user_id": user_id,
+        "settings": {
+            "video_url": montage,
+            "script": script,
+            "style": visual_style,
+            "keywords": keywords
+        }
+    }
+    supabase_client.table("projects").insert(project_data).execute()
+    logs.append("✅ Projet sauvegardé dans le Dashboard !")
+    return True
+
+# Le graphe : un job relancé (POST /jobs/{job_id}/retry) ne repaie pas les
+# appels GPT-4 / ElevenLabs / D-ID / Runway déjà réussis, et refait les
+# étapes passées par leur fallback (jamais mises en cache).
+# L'audio et le montage, partagés entre les jobs, ne sont gardés en cache que
+# sous forme d'URL du stockage, et seulement tant que le fichier existe.
+STAGES = [
+    Stage("script", generate_script, ["topic", "user_script", "mock_mode"], 5, "Rédaction IA...",
+          fallback=lambda topic, **_: f"Script fallback {topic}", error_label="❌ Err Script"),
+    Stage("keywords", extract_keywords, ["topic", "script", "visual_style", "mock_mode"], 20, "Analyse Visuelle...",
+          fallback=lambda topic, **_: [str(topic).split()[0]], error_label="⚠️ Fallback Director"),
+    Stage("audio", synthesize_audio, ["topic", "script", "voice_id", "mock_mode"], 40, "Synthèse Vocale...",
+          fallback=lambda **_: None, error_label="❌ Err Audio", shared=True, keep=stored_file_exists,
+          version=2),
+    Stage("avatar", create_talking_avatar, ["audio", "topic", "avatar_image", "mock_mode"], 50, "Avatar parlant (D-ID)...",
+          fallback=lambda **_: None, error_label="⚠️ Avatar parlant ignoré"),
+    Stage("visuals", acquire_visuals, ["script", "mock_mode"], 60, "Acquisition Visuels...",
+          fallback=lambda **_: [], error_label="❌ Err Visuels"),
+    Stage("montage", render_montage, ["avatar", "visuals", "audio", "script", "mock_mode"], 80, "Rendu final...",
+          fallback=lambda **_: MOCK_VIDEO_URL, error_label="❌ Err Montage", shared=True, keep=stored_file_exists,
+          version=2),
+    Stage("persist", save_project, ["user_id", "topic", "script", "visual_style", "keywords", "montage"], 90, "Sauvegarde...",
+          fallback=lambda **_: None, error_label="⚠️ Erreur Sauvegarde", cached=False),
+]
+# Étapes qui attendent des API (GPT-4, ElevenLabs, D-ID, Runway) : queue "light"
+# de Celery, où elles tournent en parallèle ; le montage et la persistance sur "heavy"
+PREPARE_STAGES = {"script", "keywords", "audio", "avatar", "visuals"}
+
+def initial_values(data: dict) -> dict:
+    return {
+        "topic": data.get('topic', 'No Topic'),
+        "user_script": data.get('script'),
+        "visual_style": data.get('visual_style', 'cinematic'),
+        "voice_id": data.get('voice_id', DEFAULT_VOICE_ID),
+        "avatar_image": data.get('avatar_image'),
+        "user_id": data.get('user_id'), # <--- On récupère l'ID utilisateur
+        "mock_mode": settings.MOCK_MODE,
+    }
+
+def run_pipeline(data: dict, progress_callback, job_id: str = None):
+    """
+    Pipeline FACELESS avec Persistance DB (Supabase). Avec un job_id, les
+    étapes déjà réussies pour ce job sont reprises du cache.
+    """
+    return render_video(prepare_video(data, progress_callback, job_id), progress_callback)
+
+def prepare_video(data: dict, progress_callback, job_id: str = None) -> dict:
+    """
+    Étapes légères (script, director, TTS, avatar, visuels), des appels d'API.
+    Retourne un état sérialisable en JSON pour render_video, qui peut
+    tourner sur un autre worker (queue "heavy" de Celery).
+    """
+    values = initial_values(data)
+    logs = [f"🚀 Démarrage Job (Mock={values['mock_mode']}, User={values['user_id']})"]
+    run_stages([s for s in STAGES if s.name in PREPARE_STAGES], values, job_id, logs, progress_callback)
+    return {"job_id": job_id, "values": encode(values), "logs": logs}
+
+def render_video(state: dict, progress_callback) -> dict:
+    """
+    Étapes lourdes (montage) et persistance, à partir de l'état retourné
+    par prepare_video.
+    """
+    values = decode(state["values"])
+    logs = list(state["logs"])
+    run_stages([s for s in STAGES if s.name not in PREPARE_STAGES], values, state["job_id"], logs, progress_callback)
 
     progress_callback(100, "Terminé", logs)
     return {
         "status": "COMPLETED",
-        "result_video_url": final_video, 
-        "script_text": script,
+        "result_video_url": values["montage"], 
+        "script_text": values["script"],
         "logs": logs
-    }
\ No newline at end of file
+    }
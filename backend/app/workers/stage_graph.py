@@ -0,0 +1,165 @@
+"""
+Stage graph of the video pipeline (see job_pipeline.py).
+
+A Stage is a function of named inputs (request fields or the outputs of other
+stages) producing one output, named after the stage. Outputs are cached by a
+hash of the stage inputs, so re-running a job (POST /jobs/{id}/retry) skips
+every stage that already succeeded and resumes at the one that failed.
+
+Stages that call generative services (GPT-4, DALL-E, Runway) give a new
+result on every job: they are cached per job. Stages whose output only
+depends on their inputs (TTS, montage) are `shared` and cached across jobs.
+
+Stages whose inputs are ready run concurrently in a thread pool: most of
+them wait on HTTP APIs, so once the script exists the keywords, TTS + avatar
+and visuals branches overlap and the wall time tends to the slowest branch.
+"""
+import base64
+import hashlib
+import json
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional
+
+from app.config import settings
+from app.services.stage_cache import get_stage_cache
+
+
+def encode(value):
+    """JSON-compatible copy of a stage value (bytes as base64)."""
+    if isinstance(value, bytes):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, dict):
+        return {k: encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode(v) for v in value]
+    return value
+
+
+def decode(value):
+    if isinstance(value, dict):
+        if set(value) == {"__bytes__"}:
+            return base64.b64decode(value["__bytes__"])
+        return {k: decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    return value
+
+
+class Stage:
+    """
+    `fn(logs, **inputs)` returns the stage output. When it raises, the stage
+    gives `fallback(**inputs)` instead (not cached, so a retry runs it again)
+    or, without a fallback, fails the job.
+
+    With `keep`, an output is only cached when `keep(output)` is true, and a
+    cached one is only reused while it still is (e.g. a stored file that
+    must still exist); otherwise the stage runs again.
+    """
+
+    def __init__(self, name: str, fn: Callable, inputs: List[str], progress: int, step: str,
+                 fallback: Optional[Callable] = None, error_label: str = None,
+                 shared: bool = False, cached: bool = True, version: int = 1,
+                 keep: Optional[Callable] = None):
+        self.name = name
+        self.fn = fn
+        self.inputs = inputs
+        self.progress = progress
+        self.step = step
+        self.fallback = fallback
+        self.error_label = error_label or f"❌ Err {name}"
+        self.shared = shared
+        self.cached = cached
+        self.version = version
+        self.keep = keep
+
+    def cache_key(self, inputs: dict, job_id: Optional[str]) -> Optional[str]:
+        if not self.cached or (not self.shared and not job_id):
+            return None
+        key = {
+            "stage": self.name,
+            "version": self.version,
+            "job_id": None if self.shared else job_id,
+            "inputs": encode(inputs),
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def run(self, values: dict, job_id: Optional[str], logs: List[str]):
+        inputs = {k: values[k] for k in self.inputs}
+        key = self.cache_key(inputs, job_id)
+        if key:
+            hit = get_stage_cache().get(key)
+            if hit is not None:
+                output = decode(hit["output"])
+                if self.keep is None or self.keep(output):
+                    logs.append(f"♻️ Étape {self.name} en cache")
+                    return output
+
+        try:
+            output = self.fn(logs=logs, **inputs)
+        except Exception as e:
+            if self.fallback is None:
+                raise
+            logs.append(f"{self.error_label}: {e}")
+            print(f"Stage {self.name} error: {traceback.format_exc()}")
+            return self.fallback(**inputs)
+
+        if key and (self.keep is None or self.keep(output)):
+            get_stage_cache().set(key, {"output": encode(output)})
+        return output
+
+
+def order(stages: Iterable[Stage], available: Iterable[str]) -> List[Stage]:
+    """
+    Les étapes dans un ordre qui respecte leurs dépendances (à égalité,
+    l'ordre de la liste). ValueError si une entrée n'est produite par rien.
+    """
+    stages, done, ordered = list(stages), set(available), []
+    while stages:
+        ready = [s for s in stages if all(i in done for i in s.inputs)]
+        if not ready:
+            missing = {i for s in stages for i in s.inputs if i not in done and i not in {t.name for t in stages}}
+            raise ValueError(f"Stage inputs not produced by any stage: {sorted(missing) or 'cycle'}")
+        stage = ready[0]
+        stages.remove(stage)
+        done.add(stage.name)
+        ordered.append(stage)
+    return ordered
+
+
+def _timed_run(stage: Stage, inputs: dict, job_id: Optional[str], logs: List[str]):
+    start = time.time()
+    output = stage.run(inputs, job_id, logs)
+    return output, time.time() - start
+
+
+def run_stages(stages: Iterable[Stage], values: Dict, job_id: Optional[str], logs: List[str], progress_callback,
+               max_workers: int = None) -> Dict:
+    """
+    Runs `stages` on `values` (updated with their outputs) and returns it.
+    Each stage starts as soon as its inputs exist; its duration goes to the
+    logs. The first stage failure is raised once the running ones are done.
+    """
+    pending, running = order(stages, values), {}
+    count, progress, busy, start = len(pending), 0, 0., time.time()
+    with ThreadPoolExecutor(max_workers=max_workers or settings.PIPELINE_MAX_PARALLEL_STAGES,
+                            thread_name_prefix="stage") as pool:
+        while pending or running:
+            for stage in [s for s in pending if all(i in values for i in s.inputs)]:
+                pending.remove(stage)
+                # les étapes démarrent dans le désordre : la progression ne recule pas
+                progress = max(progress, stage.progress)
+                progress_callback(progress, stage.step, logs)
+                inputs = {k: values[k] for k in stage.inputs}
+                running[pool.submit(_timed_run, stage, inputs, job_id, logs)] = stage
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                values[stage.name], seconds = future.result()
+                busy += seconds
+                logs.append(f"⏱️ {stage.name} : {seconds:.1f}s")
+
+    logs.append(f"⏱️ {count} étapes en {time.time() - start:.1f}s ({busy:.1f}s cumulées)")
+    return values
@@ -13,9 +13,13 @@ echo "🚀 Starting MultiForge Backend..."
 # Configure Python Path to include current directory
 export PYTHONPATH=$PYTHONPATH:$(pwd)
 
-# Start Celery Worker
-echo "🧵 Starting Celery Worker..."
-$CELERY_BIN -A app.workers.celery_worker.celery_app worker --loglevel=info &
+# Jobs go through the Celery workers started below
+export JOB_EXECUTION=${JOB_EXECUTION:-celery}
+
+# Start Celery Workers (light: API calls, heavy: rendering)
+echo "🧵 Starting Celery Workers..."
+$CELERY_BIN -A app.workers.celery_worker.celery_app worker -Q light -c 4 -n light@%h --loglevel=info &
+$CELERY_BIN -A app.workers.celery_worker.celery_app worker -Q heavy -c 1 -n heavy@%h --loglevel=info &
 
 # Start FastAPI Server
 echo "⚡ Starting FastAPI Server..."
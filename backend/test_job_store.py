@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""Job store checks: incremental log reads (get_changes) interleaved with updates,
+as the /jobs/{id}/events stream does. Run with pytest or directly."""
+import sys
+import os
+
+sys.path.append(os.getcwd())
+
+from app.services.job_store import MemoryJobStore, RedisJobStore
+
+
+def stores(max_logs=5):
+    yield MemoryJobStore(60, max_logs)
+    try:
+        import fakeredis
+    except ImportError:
+        print("⚠️ fakeredis absent, RedisJobStore non testé")
+        return
+    yield RedisJobStore(fakeredis.FakeRedis(), 60, max_logs)
+
+
+def read_stream(store, job_id, steps):
+    """Applies each update, reading the changes in between like a stream client;
+    returns every line the client received, in order."""
+    received, cursor = [], 0
+    for logs in steps:
+        store.update(job_id, logs=logs)
+        job = store.get_changes(job_id, cursor)
+        received += job["logs"]
+        cursor = job["log_count"]
+    return received
+
+
+def test_interleaved_updates():
+    for store in stores():
+        store.create("j", {"job_id": "j", "status": "PENDING", "logs": []})
+        logs, steps = [], []
+        for i in range(4):
+            logs = logs + [f"l{i}"]
+            steps.append(logs)
+        assert read_stream(store, "j", steps) == ["l0", "l1", "l2", "l3"], type(store).__name__
+
+
+def test_several_updates_between_reads():
+    for store in stores():
+        store.create("j", {"job_id": "j", "status": "PENDING", "logs": []})
+        store.update("j", logs=["a"])
+        job = store.get_changes("j", 0)
+        assert job["logs"] == ["a"]
+        cursor = job["log_count"]
+        store.update("j", logs=["a", "b"])
+        store.update("j", logs=["a", "b", "c"], progress=10)
+        job = store.get_changes("j", cursor)
+        assert job["logs"] == ["b", "c"] and job["progress"] == 10, type(store).__name__
+        assert store.get_changes("j", job["log_count"])["logs"] == []
+
+
+def test_trimmed_and_reset_logs():
+    for store in stores(max_logs=3):
+        store.create("j", {"job_id": "j", "status": "PENDING", "logs": []})
+        store.update("j", logs=["1", "2"])
+        cursor = store.get_changes("j", 0)["log_count"]
+        # 4 nouvelles lignes, 3 gardées : la plus ancienne est perdue pour le client
+        store.update("j", logs=["1", "2", "3", "4", "5", "6"])
+        job = store.get_changes("j", cursor)
+        assert job["logs"] == ["4", "5", "6"], type(store).__name__
+        cursor = job["log_count"]
+        # une liste plus courte remplace l'ancienne (retry, erreur) : lignes nouvelles pour le client
+        store.update("j", logs=["Erreur: x"])
+        job = store.get_changes("j", cursor)
+        assert job["logs"] == ["Erreur: x"] and store.get("j")["logs"] == ["Erreur: x"], type(store).__name__
+        store.update("j", logs=["Erreur: x", "retry"])
+        assert store.get_changes("j", job["log_count"])["logs"] == ["retry"]
+
+
+def test_update_unknown_job():
+    for store in stores():
+        store.update("inconnu", progress=10, logs=["x"])
+        assert store.get("inconnu") is None and store.get_version("inconnu") is None, type(store).__name__
+
+
+def test_update_racing_another_update():
+    """Un autre worker met à jour les logs entre la lecture de log_count et
+    l'écriture : l'update doit repartir du nouveau compte (Redis seulement,
+    MemoryJobStore fait tout sous son verrou)."""
+    import app.services.job_store as job_store
+    for store in stores():
+        if not isinstance(store, RedisJobStore):
+            continue
+        store.create("j", {"job_id": "j", "status": "PENDING", "logs": ["a"]})
+        new_lines, calls = job_store._new_lines, []
+
+        def racing_new_lines(logs, stored):
+            calls.append(stored)
+            if len(calls) == 1:
+                job_store._new_lines = new_lines
+                store.update("j", logs=["a", "b"])
+                job_store._new_lines = racing_new_lines
+            return new_lines(logs, stored)
+
+        job_store._new_lines = racing_new_lines
+        try:
+            store.update("j", status="PROCESSING", logs=["a", "b", "c"])
+        finally:
+            job_store._new_lines = new_lines
+        job = store.get("j")
+        assert calls == [1, 2], calls
+        assert job["logs"] == ["a", "b", "c"] and job["log_count"] == 3 and job["status"] == "PROCESSING", job
+
+if __name__ == "__main__":
+    test_interleaved_updates()
+    test_several_updates_between_reads()
+    test_trimmed_and_reset_logs()
+    test_update_unknown_job()
+    test_update_racing_another_update()
+    print("✅ Job store OK")
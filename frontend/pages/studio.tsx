@@ -270,14 +270,61 @@ export default function Studio() {
     topic, scriptContent, visualStyle, platform, reset
   } = useJobStore();
 
-  // Polling Logic
+  // Progress stream (SSE). The browser reconnects by itself after a network
+  // error, resuming after the last event id (the log cursor); polling only
+  // takes over once the stream is closed for good.
   useEffect(() => {
-    let interval: NodeJS.Timeout;
-
-    if (jobId && status !== 'COMPLETED' && status !== 'FAILED') {
+    if (!jobId) return;
+    const apiUrl = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
+    let interval: NodeJS.Timeout | undefined;
+    let finished = false;
+    let cursor: number | null = null;
+    let logBase: number | null = null;
+    // Each event only carries the changed fields and the log lines from the
+    // cursor up to its id (all of them in the first one)
+    const events = new EventSource(`${apiUrl}/jobs/${jobId}/events`);
+
+    const onStatus = (newStatus?: string) => {
+      if (newStatus === 'COMPLETED' || newStatus === 'FAILED') {
+        finished = true;
+        events.close();
+        clearInterval(interval);
+      }
+      if (newStatus === 'COMPLETED') {
+        setStep(5);
+      }
+    };
+
+    events.addEventListener('progress', (e) => {
+      const data = JSON.parse((e as MessageEvent).data);
+      const update: Parameters<typeof updateStatus>[0] = {};
+      if (data.status !== undefined) update.status = data.status;
+      if (data.progress !== undefined) update.progress = data.progress;
+      if (data.current_step !== undefined) update.currentStep = data.current_step;
+      if (data.result_video_url !== undefined) update.resultVideoUrl = data.result_video_url;
+      // The lines follow ours unless the server replaced its log list
+      // (log_base moved) or dropped lines we never got: then they replace ours
+      const lines: string[] = data.logs || [];
+      const eventCursor = Number((e as MessageEvent).lastEventId);
+      const reset = data.log_base !== undefined && data.log_base !== logBase;
+      if (data.log_base !== undefined) logBase = data.log_base;
+      if (reset || eventCursor - lines.length !== cursor) {
+        update.logs = lines;
+      } else if (lines.length) {
+        update.logs = [...useJobStore.getState().logs, ...lines];
+      }
+      cursor = eventCursor;
+      updateStatus(update);
+      onStatus(data.status);
+    });
+    events.addEventListener('end', () => events.close());
+
+    events.onerror = () => {
+      if (events.readyState !== EventSource.CLOSED || finished || interval) return;
+      console.error("Event stream closed, falling back to polling");
       interval = setInterval(async () => {
         try {
-          const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'}/jobs/${jobId}`);
+          const res = await fetch(`${apiUrl}/jobs/${jobId}`);
           const data = await res.json();
 
           updateStatus({
@@ -287,17 +334,18 @@ export default function Studio() {
             logs: data.logs,
             resultVideoUrl: data.result_video_url,
           });
-
-          if (data.status === 'COMPLETED') {
-            setStep(5);
-          }
+          onStatus(data.status);
         } catch (err) {
           console.error("Polling error", err);
         }
       }, 2000);
-    }
-    return () => clearInterval(interval);
-  }, [jobId, status, updateStatus]);
+    };
+
+    return () => {
+      events.close();
+      clearInterval(interval);
+    };
+  }, [jobId, updateStatus]);
 
   const startGeneration = async () => {
     setStep(4);